@@ -0,0 +1,190 @@
+'''
+ID3v2 Async Scanner
+-------------------
+Scans the ID3v2 tags of many MP3 files on network storage, where every
+open and read takes milliseconds.
+
+* Many files are read at the same time (bounded: --concurrency), the
+  blocking reads run in a thread pool, the scheduling is done by asyncio
+* Per file: the first read gets the header and - most times - the complete
+  tag (globFirstReadSize bytes), a second read gets the rest of a larger tag
+* The frame index of a file (name, offset, size, flags of every frame)
+  is yielded as soon as the file is done, not in the order of the files
+
+So the time of a scan is bound by the bandwidth of the storage, not by the
+latency of the single reads.
+
+Usage:
+  python id3v2AsyncScanner.py PATH [PATH ...] [-c 64] [--json]
+PATH is a MP3 file or a directory (searched recursively).
+
+    async for result in scanFiles(fileNames) :
+        print(result.fileName, len(result.frames))
+
+J. Grätzer
+'''
+
+from sys import exit
+import json
+import asyncio
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from id3v2TagParser import TagError, parseTagHeader, iterFrames, decodeUnsync, findUnsyncBytes, getFileOffset
+from id3v2TagExtractor import findMp3Files
+
+
+# --- SETTINGS ---
+globConcurrency = 64            # files read at the same time
+globFirstReadSize = 64 * 1024   # bytes of the first read: header and most tags
+
+# --- TYPES ---
+# Result of a file. header is a TagHeader, frames is a list of tuples
+# (frameName, offset, size, flags), error is None or the error message.
+ScanResult = namedtuple("ScanResult", ["fileName", "header", "frames", "error"])
+
+# --- FUNCTIONS ---
+def openAndReadHead(myfile) :
+    ''' Blocking (thread pool): opens the file and reads the first
+        globFirstReadSize bytes. Returns a tuple (file, bytes).
+    '''
+    f = open(myfile, "rb", buffering=0)
+    try :
+        return f, f.read(globFirstReadSize)
+    except BaseException :
+        f.close()
+        raise
+
+def readRest(f, myCount) :
+    ''' Blocking (thread pool): reads myCount more bytes and closes the file
+    '''
+    try :
+        chunks = []
+        while myCount > 0 :
+            chunk = f.read(myCount)
+            if not chunk :
+                break  # end of file
+            chunks.append(chunk)
+            myCount = myCount - len(chunk)
+        return b"".join(chunks)
+    finally :
+        f.close()
+
+def indexFrames(myTag, myHeader) :
+    ''' Returns the frame index of the tag bytes myTag (starting at the header).
+        The offsets are addresses in the file, also for unsynchronised ID3v2.3 tags.
+    '''
+    unsyncBytes = []
+    if myHeader.flagUnsync and myHeader.version == 3 :
+        unsyncBytes = findUnsyncBytes(myTag)
+        myTag = myTag[0:10] + decodeUnsync(myTag[10:])
+    frames = []
+    for frame in iterFrames(myTag, myHeader) :
+        frames.append((frame.frameName, getFileOffset(unsyncBytes, frame.offset), frame.size, frame.flags))
+        frame.frame.release()
+    return frames
+
+def closeOpenedFile(myFuture) :
+    ''' Done callback of openAndReadHead(), if nobody waits for it any more:
+        closes the file opened
+    '''
+    if not myFuture.cancelled() and myFuture.exception() is None :
+        myFuture.result()[0].close()
+
+async def scanFile(myfile, loop, pool) :
+    ''' Reads and indexes the tag of a file. Returns a ScanResult, also for
+        unexpected errors (the message is the repr() of the exception).
+    '''
+    try :
+        opening = loop.run_in_executor(pool, openAndReadHead, myfile)
+        try :
+            f, head = await asyncio.shield(opening)
+        except asyncio.CancelledError :
+            opening.add_done_callback(closeOpenedFile)   # the thread opens the file anyway
+            raise
+        closeHere = True
+        try :
+            header = parseTagHeader(head[0:10])
+            tagEnd = 10 + header.size
+            if tagEnd > len(head) :
+                closeHere = False   # readRest() closes the file, even if this task is cancelled
+                head = head + await loop.run_in_executor(pool, readRest, f, tagEnd - len(head))
+                if tagEnd > len(head) :
+                    raise TagError("the tag size exceeds the file size")
+        finally :
+            if closeHere :
+                f.close()
+        return ScanResult(myfile, header, indexFrames(head[0:tagEnd], header), None)
+    except (OSError, TagError) as e :
+        return ScanResult(myfile, None, [], str(e))
+    except Exception as e :
+        return ScanResult(myfile, None, [], repr(e))
+
+async def scanFiles(myFileNames, myConcurrency=globConcurrency) :
+    ''' Async generator: yields a ScanResult for every file of myFileNames,
+        in the order they are done. At most myConcurrency files are read
+        at the same time.
+    '''
+    loop = asyncio.get_running_loop()
+    fileNames = iter(myFileNames)
+    results = asyncio.Queue()
+
+    async def worker() :
+        try :
+            for fileName in fileNames :   # the workers share the iterator
+                await results.put(await scanFile(fileName, loop, pool))
+        finally :
+            await results.put(None)       # this worker is done, the consumer must not wait for it
+
+    with ThreadPoolExecutor(max_workers=myConcurrency) as pool :
+        workers = [asyncio.ensure_future(worker()) for i in range(myConcurrency)]
+        try :
+            running = len(workers)
+            while running > 0 :
+                result = await results.get()
+                if result is None :
+                    running = running - 1
+                else :
+                    yield result
+        finally :
+            for task in workers :
+                task.cancel()
+            # Wait for the cancelled workers, before the pool is shut down
+            await asyncio.gather(*workers, return_exceptions=True)
+
+async def scanPaths(myPaths, myConcurrency, myJson) :
+    ''' Scans all MP3 files found in myPaths and prints a line per file.
+        Returns the number of files failed.
+    '''
+    loop = asyncio.get_running_loop()
+    mp3Files = await loop.run_in_executor(None, findMp3Files, myPaths)  # walking is blocking, too
+    failed = 0
+    async for result in scanFiles([fileName for fileName, relName in mp3Files], myConcurrency) :
+        if result.error :
+            failed = failed + 1
+        if myJson :
+            print(json.dumps({"file": result.fileName, "error": result.error,
+                              "version": result.header.version if result.header else None,
+                              "frames": [list(frame) for frame in result.frames]}))
+        elif result.error :
+            print("FAILED " + result.fileName + " ... " + result.error)
+        else :
+            print(result.fileName + ": ID3v2." + str(result.header.version) + ", "
+                  + " ".join(frame[0] for frame in result.frames))
+    if not myJson :
+        print("OK, " + str(len(mp3Files) - failed) + " files scanned, " + str(failed) + " failed.")
+    return failed
+
+
+# --- MAIN SCRIPT ---
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description="Scans the ID3v2 tags of MP3 files with many reads at the same time.")
+    parser.add_argument("paths", nargs="+", metavar="PATH", help="MP3 file or directory")
+    parser.add_argument("-c", "--concurrency", type=int, default=globConcurrency,
+                        help="files read at the same time (default: " + str(globConcurrency) + ")")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per file")
+    args = parser.parse_args()
+
+    failedCount = asyncio.run(scanPaths(args.paths, max(1, args.concurrency), args.json))
+    exit(1 if failedCount > 0 else 0)
@@ -0,0 +1,316 @@
+'''
+ID3v2 Audio Index
+-----------------
+Walks the MPEG audio frames behind the ID3v2 tag, e.g. of XXX_audio.mp3
+(id3v2TagExtractor.py) or of a complete MP3 file.
+
+* Finds the frame sync with mmap.find(), not byte by byte, than jumps
+  from frame header to frame header (the frame length is computed)
+* Detects the Xing/Info header (LAME) and the VBRI header (Fraunhofer)
+  in the first frame, and CBR or VBR
+* Builds a seek table: an array with the byte offset of every audio frame,
+  the time of frame i is i * samples per frame / sample rate
+* Computes the duration from the frames counted
+
+Usage:
+  python id3v2AudioIndex.py FILE.mp3 [--at MS] [--lyrics]
+--at MS prints the byte offset of the frame playing at MS milliseconds.
+--lyrics checks, that the timestamps of the SYLT or XSRT frame
+(see id3v2LyricsDecoder.py) are within the duration of the audio.
+
+J. Grätzer
+'''
+
+from sys import exit
+import mmap
+import argparse
+from array import array
+
+from id3v2TagParser import Id3v2Tag, TagError, findTrailingTags
+
+
+# --- SETTINGS ---
+# Bitrates in kbit/s by (MPEG version 1 or 2, layer) and bitrate index 0-14 (MPEG 2.5 like MPEG 2)
+globBitrates = {(1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+                (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+                (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+                (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+                (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+                (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)}
+# Sample rates in Hz by the 2 version bits of the header and the sample rate index
+globSampleRates = {0b11: (44100, 48000, 32000),   # MPEG 1
+                   0b10: (22050, 24000, 16000),   # MPEG 2
+                   0b00: (11025, 12000, 8000)}    # MPEG 2.5
+globSyncCheckFrames = 3   # a sync is accepted, if this number of frames follow each other
+
+# --- TYPES ---
+class FrameHeader :
+    ''' The values of a 4 bytes MPEG audio frame header
+    '''
+    __slots__ = ("versionBits", "layer", "bitrate", "sampleRate", "mono", "length", "samples")
+
+    def __init__(self, myVersionBits, myLayer, myBitrate, mySampleRate, myMono, myLength, mySamples) :
+        self.versionBits = myVersionBits
+        self.layer = myLayer
+        self.bitrate = myBitrate
+        self.sampleRate = mySampleRate
+        self.mono = myMono
+        self.length = myLength
+        self.samples = mySamples
+
+
+class AudioIndex :
+    ''' Seek table and values of the audio data.
+        offsets: array of the byte offsets (in the file) of all audio frames.
+    '''
+    __slots__ = ("offsets", "sampleRate", "samplesPerFrame", "layer", "versionBits", "vbr",
+                 "infoHeader", "infoFrames", "audioStart", "audioEnd", "lostBytes")
+
+    def __init__(self) :
+        self.offsets = array("Q")   # 64 bits ("L" has 32 bits on Windows: files > 4 GB)
+        self.sampleRate = 0
+        self.samplesPerFrame = 0
+        self.layer = 0
+        self.versionBits = 0
+        self.vbr = False
+        self.infoHeader = ""      # "Xing", "Info", "VBRI" or ""
+        self.infoFrames = None    # number of frames given by the info header
+        self.audioStart = 0
+        self.audioEnd = 0
+        self.lostBytes = 0        # bytes skipped between frames (no valid frame header)
+
+    def __len__(self) :
+        return len(self.offsets)
+
+    def duration(self) :
+        ''' Returns the duration in ms, computed from the frames counted
+        '''
+        if self.sampleRate == 0 :
+            return 0
+        return len(self.offsets) * self.samplesPerFrame * 1000 // self.sampleRate
+
+    def timeOf(self, myFrameIndex) :
+        ''' Returns the start time in ms of audio frame myFrameIndex, or -1
+            (no valid audio frame found)
+        '''
+        if self.sampleRate == 0 :
+            return -1
+        return myFrameIndex * self.samplesPerFrame * 1000 // self.sampleRate
+
+    def frameAt(self, myTime) :
+        ''' Returns the index of the audio frame playing at myTime ms, or -1
+        '''
+        if self.sampleRate == 0 :
+            return -1
+        i = myTime * self.sampleRate // (1000 * self.samplesPerFrame)
+        return i if i < len(self.offsets) else -1
+
+    def offsetAt(self, myTime) :
+        ''' Returns the byte offset of the audio frame playing at myTime ms, or -1
+        '''
+        i = self.frameAt(myTime)
+        return self.offsets[i] if i >= 0 else -1
+
+
+# --- FUNCTIONS ---
+def parseFrameHeader(myBytes) :
+    ''' Returns a FrameHeader of 4 header bytes, or None if they are no valid header.
+        Free format bitrates are not supported.
+    '''
+    if len(myBytes) < 4 or myBytes[0] != 0xFF or (myBytes[1] & 0xE0) != 0xE0 :
+        return None
+    versionBits = (myBytes[1] >> 3) & 0b11
+    layer = 4 - ((myBytes[1] >> 1) & 0b11)   # 1, 2 or 3 - and 4 is reserved
+    bitrateIndex = myBytes[2] >> 4
+    sampleRateIndex = (myBytes[2] >> 2) & 0b11
+    if versionBits == 0b01 or layer == 4 or bitrateIndex == 0 or bitrateIndex == 15 or sampleRateIndex == 3 :
+        return None
+    bitrate = globBitrates[(1 if versionBits == 0b11 else 2, layer)][bitrateIndex] * 1000
+    sampleRate = globSampleRates[versionBits][sampleRateIndex]
+    padding = (myBytes[2] >> 1) & 1
+    if layer == 1 :
+        samples = 384
+        length = (12 * bitrate // sampleRate + padding) * 4
+    elif layer == 3 and versionBits != 0b11 :
+        samples = 576   # MPEG 2 and 2.5 layer III
+        length = 72 * bitrate // sampleRate + padding
+    else :
+        samples = 1152
+        length = 144 * bitrate // sampleRate + padding
+    return FrameHeader(versionBits, layer, bitrate, sampleRate, (myBytes[3] >> 6) == 0b11, length, samples)
+
+def isSameStream(myHeader, myFirstHeader) :
+    ''' True, if myHeader fits to the first frame header of the stream
+    '''
+    return (myHeader is not None and myHeader.versionBits == myFirstHeader.versionBits
+            and myHeader.layer == myFirstHeader.layer and myHeader.sampleRate == myFirstHeader.sampleRate)
+
+def findSync(myBuffer, myStart, myEnd, myFirstHeader=None) :
+    ''' Returns the address of the next frame header from myStart on, that is
+        followed by valid frame headers (globSyncCheckFrames), or -1.
+        FFH bytes are found by myBuffer.find(), not byte by byte.
+    '''
+    pos = myBuffer.find(b"\xff", myStart, myEnd)
+    while 0 <= pos and pos + 4 <= myEnd :
+        syncHeader = parseFrameHeader(myBuffer[pos:pos + 4])
+        if syncHeader is not None and (myFirstHeader is None or isSameStream(syncHeader, myFirstHeader)) :
+            header = syncHeader
+            nextPos = pos
+            for i in range(globSyncCheckFrames) :
+                nextPos = nextPos + header.length
+                if nextPos + 4 > myEnd :
+                    return pos   # the frames reach the end of the audio data
+                header = parseFrameHeader(myBuffer[nextPos:nextPos + 4])
+                if not isSameStream(header, syncHeader) :
+                    break
+            else :
+                return pos
+        pos = myBuffer.find(b"\xff", pos + 1, myEnd)
+    return -1
+
+def readInfoHeader(myBuffer, myPos, myHeader) :
+    ''' Looks for a Xing/Info or VBRI header in the frame at myPos.
+        Returns a tuple (name or "", number of frames or None).
+    '''
+    # Xing/Info: behind the side information of the first frame
+    if myHeader.versionBits == 0b11 :
+        sideInfoSize = 17 if myHeader.mono else 32
+    else :
+        sideInfoSize = 9 if myHeader.mono else 17
+    pos = myPos + 4 + sideInfoSize
+    name = bytes(myBuffer[pos:pos + 4])
+    if name == b"Xing" or name == b"Info" :
+        flags = int.from_bytes(myBuffer[pos + 4:pos + 8], "big")
+        frames = int.from_bytes(myBuffer[pos + 8:pos + 12], "big") if flags & 1 else None
+        return name.decode("latin-1"), frames
+    # VBRI: always 32 bytes behind the frame header
+    pos = myPos + 4 + 32
+    if bytes(myBuffer[pos:pos + 4]) == b"VBRI" :
+        return "VBRI", int.from_bytes(myBuffer[pos + 14:pos + 18], "big")
+    return "", None
+
+def indexAudio(myBuffer, myStart, myEnd) :
+    ''' Walks the MPEG audio frames of myBuffer from myStart to myEnd.
+        Returns an AudioIndex.
+    '''
+    index = AudioIndex()
+    index.audioStart = myStart
+    index.audioEnd = myEnd
+    pos = findSync(myBuffer, myStart, myEnd)
+    if pos < 0 :
+        index.lostBytes = myEnd - myStart
+        return index
+    index.lostBytes = pos - myStart
+    firstHeader = parseFrameHeader(myBuffer[pos:pos + 4])
+    index.sampleRate = firstHeader.sampleRate
+    index.samplesPerFrame = firstHeader.samples
+    index.layer = firstHeader.layer
+    index.versionBits = firstHeader.versionBits
+
+    # The info header frame contains no audio
+    index.infoHeader, index.infoFrames = readInfoHeader(myBuffer, pos, firstHeader)
+    if index.infoHeader :
+        pos = pos + firstHeader.length
+    index.vbr = index.infoHeader == "Xing" or index.infoHeader == "VBRI"
+
+    offsets = index.offsets
+    bitrate = firstHeader.bitrate
+    while pos + 4 <= myEnd :
+        header = parseFrameHeader(myBuffer[pos:pos + 4])
+        if not isSameStream(header, firstHeader) :
+            nextPos = findSync(myBuffer, pos + 1, myEnd, firstHeader)
+            if nextPos < 0 :
+                index.lostBytes = index.lostBytes + myEnd - pos
+                break
+            index.lostBytes = index.lostBytes + nextPos - pos
+            pos = nextPos
+            continue
+        if pos + header.length > myEnd :
+            index.lostBytes = index.lostBytes + myEnd - pos   # last frame is cut
+            break
+        if header.bitrate != bitrate :
+            index.vbr = True
+        offsets.append(pos)
+        pos = pos + header.length
+    return index
+
+def indexFile(myfile) :
+    ''' Returns the AudioIndex of a MP3 file (with or without ID3v2 tag).
+        Tags and blocks at the end of the file are not part of the audio data.
+    '''
+    with open(myfile, "rb") as f :
+        if f.read(3) == b"ID3" :
+            with Id3v2Tag(myfile) as tag :
+                start = tag.audioStart()
+                try :
+                    end = tag.audioEnd()
+                except TagError :
+                    # A broken frame (e.g. while looking for the SEEK frame), see hashAudio()
+                    end = findTrailingTags(tag.view, start).audioEnd
+        else :
+            start = 0
+            end = None
+        f.seek(0)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer :
+            if end is None :
+                end = findTrailingTags(buffer).audioEnd
+            return indexAudio(buffer, start, end)
+
+def checkLyrics(myfile, myIndex) :
+    ''' Checks, that the timestamps of the SYLT or XSRT frame of myfile are
+        within the audio. Returns the number of timestamps behind the end,
+        or -1 if there is no such frame.
+    '''
+    from id3v2LyricsDecoder import loadFromMp3
+    try :
+        lyrics = loadFromMp3(myfile)
+    except TagError :
+        return -1   # no ID3v2 tag, e.g. XXX_audio.mp3
+    if lyrics is None :
+        return -1
+    end = len(myIndex) if lyrics.timeUnit == "frames" else myIndex.duration()
+    late = 0
+    for i in range(len(lyrics)) :
+        start, stop, text = lyrics.entry(i)
+        if start > end or (stop is not None and stop > end) :
+            late = late + 1
+            print("PROBLEM: " + lyrics.frameName + " entry at " + str(start) + " " + lyrics.timeUnit
+                  + " is behind the end (" + str(end) + "): " + text.strip()[:40])
+    return late
+
+
+# --- MAIN SCRIPT ---
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description="Index of the MPEG audio frames of a MP3 file.")
+    parser.add_argument("file", help="MP3 file, e.g. XXX_audio.mp3")
+    parser.add_argument("--at", type=int, default=None, help="print the byte offset of the frame playing at this time (ms)")
+    parser.add_argument("--lyrics", action="store_true", help="check the timestamps of the SYLT or XSRT frame")
+    args = parser.parse_args()
+
+    try :
+        audioIndex = indexFile(args.file)
+    except (OSError, TagError, ValueError) as e :
+        print("ERROR: " + str(e))
+        exit(1) # Exit with error code 1
+    if len(audioIndex) == 0 :
+        print("PROBLEM: no MPEG audio frames found")
+        exit(1) # Exit with error code 1
+
+    versionName = {0b11: "MPEG 1", 0b10: "MPEG 2", 0b00: "MPEG 2.5"}[audioIndex.versionBits]
+    print(versionName + " layer " + str(audioIndex.layer) + ", " + str(audioIndex.sampleRate) + " Hz, "
+          + ("VBR" if audioIndex.vbr else "CBR") + (", " + audioIndex.infoHeader + " header" if audioIndex.infoHeader else ""))
+    print(str(len(audioIndex)) + " frames, duration " + str(audioIndex.duration()) + " ms, audio "
+          + hex(audioIndex.audioStart) + " to " + hex(audioIndex.audioEnd) + ", " + str(audioIndex.lostBytes) + " bytes skipped")
+    if audioIndex.infoFrames is not None and audioIndex.infoFrames != len(audioIndex) :
+        print("PROBLEM: the " + audioIndex.infoHeader + " header counts " + str(audioIndex.infoFrames) + " frames")
+    if args.at is not None :
+        offset = audioIndex.offsetAt(args.at)
+        print("At " + str(args.at) + " ms: " + (hex(offset) if offset >= 0 else "behind the end"))
+    if args.lyrics :
+        lateCount = checkLyrics(args.file, audioIndex)
+        if lateCount < 0 :
+            print("There is no SYLT or XSRT frame.")
+        elif lateCount == 0 :
+            print("OK, all lyrics timestamps are within the audio.")
+        else :
+            exit(1) # Exit with error code 1
@@ -0,0 +1,311 @@
+'''
+ID3v2 Batch Patch
+-----------------
+Changes the ID3v2 tags of many MP3 files, driven by a manifest.
+
+The manifest is a JSON or CSV file with one operation per row:
+* file:   the MP3 file
+* frame:  the frame name, e.g. TALB
+* action: add, replace or delete
+* source: the new frame - a .bin frame file (ID3v2.4 frame, header and data,
+          e.g. of id3v2FrameCreator_APIC.py), or "text:..." for a text frame
+
+JSON: a list of objects {"file": ..., "frame": ..., "action": ..., "source": ...}
+CSV: a header line file,frame,action,source and one line per operation.
+Relative filenames are relative to the directory of the manifest.
+
+Actions:
+* add:     appends the frame behind the last frame
+* replace: the frame takes the position of the first frame with that name,
+           the other frames with that name are removed. Appended, if there is none.
+* delete:  removes all frames with that name
+
+All operations of a file are done on one parsed tag, and the file is written
+once: in place, if the new frames fit into the old tag (frames plus padding),
+else the file is rewritten with the padding of a padding policy (option
+--padding, see id3v2TagReassembler.py, default: globRewritePaddingPolicy). In place,
+only the bytes from the first frame changed to the end of the old frames are
+written. The files are patched in parallel by a pool of worker processes.
+A MP3 file without ID3v2 tag gets a new ID3v2.4 tag (the frames of add and
+replace, and the padding of the policy) in front of its data.
+
+Usage:
+  python id3v2BatchPatch.py MANIFEST [-j JOBS] [-n] [--padding POLICY]
+
+J. Grätzer
+'''
+
+from sys import exit
+import os
+import csv
+import json
+import time
+import argparse
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from id3v2TagParser import (Id3v2Tag, TagError, findPaddingStart,
+                            decodeFrameSize, encodeFrameSize)
+from id3v2TagReassembler import makeTagHeaderBytes, writePadding, copyBytes, getPaddingSize, globId3v2Version
+
+
+# --- SETTINGS ---
+globActions = ("add", "replace", "delete")
+globTextSourcePrefix = "text:"
+globRewritePaddingPolicy = "fixed:1024"   # padding of rewritten files, so the next patch fits in place
+
+# --- INTERNAL GLOBALS ---
+# Frames of the sources, read once per worker process: (source, version) -> frame bytes
+globSourceCache = {}
+
+# --- TYPES ---
+# An operation of the manifest, source is None for delete
+PatchOperation = namedtuple("PatchOperation", ["frameName", "action", "source"])
+
+# --- FUNCTIONS ---
+def checkOperation(myRow, myWhere) :
+    ''' Returns the PatchOperation of a manifest row (dict), raises ValueError
+    '''
+    # JSON rows can hold numbers, lists, ... instead of text
+    for key in ("file", "frame", "action", "source") :
+        if myRow.get(key) is not None and not isinstance(myRow[key], str) :
+            raise ValueError(myWhere + ": the " + key + " is not a text: " + repr(myRow[key]))
+    frameName = (myRow.get("frame") or "").strip()
+    action = (myRow.get("action") or "").strip().lower()
+    source = myRow.get("source") or None
+    if not myRow.get("file") :
+        raise ValueError(myWhere + ": the file is missing")
+    if len(frameName) != 4 or not all(c.isupper() or c.isdigit() for c in frameName) :
+        raise ValueError(myWhere + ": bad frame name " + repr(frameName))
+    if action not in globActions :
+        raise ValueError(myWhere + ": unknown action " + repr(action) + ", use " + ", ".join(globActions))
+    if action != "delete" and source is None :
+        raise ValueError(myWhere + ": the source of the new frame is missing")
+    return PatchOperation(frameName, action, source if action != "delete" else None)
+
+def readPatchManifest(myManifestFileName) :
+    ''' Reads a manifest (.json or .csv). Returns an OrderedDict:
+        MP3 filename -> list of PatchOperation (in manifest order).
+    '''
+    baseDir = os.path.dirname(os.path.abspath(myManifestFileName))
+    with open(myManifestFileName, "r", encoding="utf-8", newline="") as f :
+        if myManifestFileName.lower().endswith(".json") :
+            rows = json.load(f)
+            firstLine = 1   # rows of the JSON list: 1, 2, ...
+        else :
+            rows = list(csv.DictReader(f))
+            firstLine = 2   # behind the CSV header line
+    if not isinstance(rows, list) :
+        raise ValueError("the manifest is not a list of operations: " + myManifestFileName)
+
+    patches = OrderedDict()
+    for i, row in enumerate(rows) :
+        if not isinstance(row, dict) :
+            raise ValueError(myManifestFileName + ", row " + str(i + firstLine) + ": not an object")
+        operation = checkOperation(row, myManifestFileName + ", row " + str(i + firstLine))
+        if operation.source and not operation.source.startswith(globTextSourcePrefix) :
+            operation = operation._replace(source=os.path.join(baseDir, operation.source))
+        patches.setdefault(os.path.join(baseDir, row["file"]), []).append(operation)
+    return patches
+
+def makeTextFrame(myFrameName, myText, myId3Vers) :
+    ''' Returns the bytes of a text frame (T***): UTF-8 (ID3v2.4), UTF-16 (ID3v2.3)
+    '''
+    if myId3Vers == 3 :
+        data = b'\x01' + myText.encode("utf-16")    # 01H: UTF-16 with BOM
+    else :
+        data = b'\x03' + myText.encode("utf-8")     # 03H: UTF-8
+    return bytes(myFrameName, "latin-1") + encodeFrameSize(len(data), myId3Vers) + b'\x00\x00' + data
+
+def loadSourceFrame(myOperation, myId3Vers) :
+    ''' Returns the new frame of an add or replace operation, for a tag of
+        version myId3Vers. The frames are cached, so a cover picture used
+        for thousands of files is read once per worker process.
+    '''
+    key = (myOperation.source, myId3Vers)
+    if key in globSourceCache :
+        return globSourceCache[key]
+
+    if myOperation.source.startswith(globTextSourcePrefix) :
+        if myOperation.frameName[0] != "T" or myOperation.frameName == "TXXX" :
+            raise TagError("text source for frame " + myOperation.frameName + ", use a .bin frame file")
+        frame = makeTextFrame(myOperation.frameName, myOperation.source[len(globTextSourcePrefix):], myId3Vers)
+    else :
+        with open(myOperation.source, "rb") as f :  # read in binary mode
+            frame = f.read()
+        if len(frame) < 10 or decodeFrameSize(frame[4:8], 4) != len(frame) - 10 :
+            raise TagError("no ID3v2.4 frame file: " + myOperation.source)
+        if frame[0:4].decode("latin-1") != myOperation.frameName :
+            raise TagError("the frame file " + myOperation.source + " holds a "
+                           + frame[0:4].decode("latin-1") + " frame, not " + myOperation.frameName)
+        if myId3Vers == 3 :
+            # ID3v2.3: standard integer size, status flags abc00000 (ID3v2.4: 0abc0000)
+            if frame[9] != 0 :
+                raise TagError("the frame file " + myOperation.source + " has ID3v2.4 format flags, "
+                               "it can't be put into a ID3v2.3 tag")
+            frame = frame[0:4] + encodeFrameSize(len(frame) - 10, 3) + bytes([(frame[8] << 1) & 0b11100000, 0]) + frame[10:]
+    globSourceCache[key] = frame
+    return frame
+
+def applyOperations(myFrames, myOperations, myId3Vers) :
+    ''' Applies myOperations to the list myFrames of tuples (frame name, frame bytes,
+        old offset). New frames have the old offset None. Returns the new list.
+    '''
+    for operation in myOperations :
+        if operation.action == "delete" :
+            myFrames = [frame for frame in myFrames if frame[0] != operation.frameName]
+            continue
+        newFrame = (operation.frameName, loadSourceFrame(operation, myId3Vers), None)
+        if operation.action == "add" :
+            myFrames.append(newFrame)
+            continue
+        # replace: the position of the first frame with this name, else append
+        newFrames = []
+        for frame in myFrames :
+            if frame[0] != operation.frameName :
+                newFrames.append(frame)
+            elif newFrame is not None :
+                newFrames.append(newFrame)
+                newFrame = None
+        if newFrame is not None :
+            newFrames.append(newFrame)
+        myFrames = newFrames
+    return myFrames
+
+def patchFile(myfile, myOperations, myDryRun=False, myPaddingPolicy=globRewritePaddingPolicy) :
+    ''' Applies myOperations (list of PatchOperation) to the tag of a MP3 file.
+        A rewritten file gets the padding of myPaddingPolicy, so the next patch fits in place.
+        A file without ID3v2 tag gets a new tag of version globId3v2Version.
+        Returns a tuple (myfile, ok, message, bytes rewritten, True if in place).
+    '''
+    try :
+        with open(myfile, "rb") as f :  # read in binary mode
+            hasTag = f.read(3) == b"ID3"
+        if not hasTag :
+            # A new tag in front of the whole file, delete has nothing to do
+            tagVersion = globId3v2Version
+            tagBody = b''.join(frame[1] for frame in applyOperations([], myOperations, tagVersion))
+            if len(tagBody) == 0 :
+                return myfile, True, "OK, unchanged (no ID3v2 tag)", 0, True
+            inPlace = False
+            audioStart = 0
+        else :
+            with Id3v2Tag(myfile) as tag :
+                header = tag.header
+                tagVersion = header.version
+                frames = [(frame.frameName, frame.frame, frame.offset) for frame in tag.frames()]
+                newFrames = applyOperations(list(frames), myOperations, tagVersion)
+                framesSize = sum(len(frame[1]) for frame in newFrames)
+                inPlace = 10 + framesSize <= header.bruttoSize
+
+                if inPlace :
+                    # The new tag has no footer, so the old footer bytes become padding, too
+                    newHeader = makeTagHeaderBytes(header.bruttoSize - 10, tagVersion)
+                    # The offsets of the tag view are file offsets, if the tag is not
+                    # unsynchronised and has no extended header and no footer
+                    if newHeader == bytes(tag.view[0:10]) and header.flags == 0 :
+                        writeStart = 10
+                        oldEnd = findPaddingStart(tag.tagView, header)   # behind it: 00H bytes already
+                        for k, frame in enumerate(newFrames) :
+                            # Unchanged: the old frame, or a new frame equal to the bytes found there
+                            if frame[2] != writeStart and tag.tagView[writeStart:writeStart + len(frame[1])] != frame[1] :
+                                break
+                            writeStart = writeStart + len(frame[1])
+                        else :
+                            k = len(newFrames)
+                        pieces = [frame[1] for frame in newFrames[k:]]
+                    else :
+                        writeStart = 0
+                        oldEnd = header.bruttoSize
+                        pieces = [newHeader] + [frame[1] for frame in newFrames]
+                    tagData = b''.join(pieces)   # copies the frames, before the mapping is closed
+                    paddingSize = max(oldEnd - writeStart - len(tagData), 0)
+                else :
+                    tagBody = b''.join(frame[1] for frame in newFrames)
+                    audioStart = tag.audioStart()
+                for frame in frames :
+                    frame[1].release()
+                newFrames = None
+    except (OSError, TagError) as e :
+        return myfile, False, "ERROR: " + str(e), 0, False
+
+    tmpFileName = None
+    try :
+        if inPlace :
+            written = len(tagData) + paddingSize
+            if written == 0 :
+                return myfile, True, "OK, unchanged", 0, True
+            if not myDryRun :
+                with open(myfile, "r+b", buffering=0) as fileTarget :
+                    fileTarget.seek(writeStart)
+                    fileTarget.write(tagData)
+                    writePadding(fileTarget, paddingSize)
+            return myfile, True, "OK, in place, " + str(written) + " bytes rewritten", written, True
+
+        # Write a new file: tag, than the audio data of the old file
+        paddingSize = getPaddingSize(len(tagBody), myPaddingPolicy)
+        written = 10 + len(tagBody) + paddingSize + os.path.getsize(myfile) - audioStart
+        if not myDryRun :
+            tmpFileName = myfile + ".tmp" + str(os.getpid())
+            with open(myfile, "rb") as f, open(tmpFileName, "wb", buffering=0) as fileTarget :
+                fileTarget.write(makeTagHeaderBytes(len(tagBody) + paddingSize, tagVersion))
+                fileTarget.write(tagBody)
+                writePadding(fileTarget, paddingSize)
+                copyBytes(f, fileTarget, audioStart, os.fstat(f.fileno()).st_size - audioStart)
+            os.replace(tmpFileName, myfile)
+        message = "OK, rewritten, " if hasTag else "OK, new ID3v2 tag, rewritten, "
+        return myfile, True, message + str(written) + " bytes", written, False
+    except (OSError, ValueError) as e :
+        if tmpFileName is not None :
+            try :
+                os.remove(tmpFileName)   # the original file is replaced only at the end
+            except OSError :
+                pass
+        return myfile, False, "ERROR: " + str(e), 0, False
+
+def patchFiles(myPatches, myJobs=None, myDryRun=False, myPaddingPolicy=globRewritePaddingPolicy) :
+    ''' Patches the files of myPatches (see readPatchManifest()) using a pool
+        of worker processes. Returns the number of files failed.
+    '''
+    startTime = time.perf_counter()
+    failed = 0
+    inPlaceCount = 0
+    totalBytes = 0
+    with ProcessPoolExecutor(max_workers=myJobs) as pool :
+        futures = [pool.submit(patchFile, fileName, operations, myDryRun, myPaddingPolicy) for fileName, operations in myPatches.items()]
+        for future in as_completed(futures) :
+            fileName, ok, message, written, inPlace = future.result()
+            if ok :
+                totalBytes = totalBytes + written
+                inPlaceCount = inPlaceCount + (1 if inPlace else 0)
+                print("OK     " + fileName + " ... " + message)
+            else :
+                failed = failed + 1
+                print("FAILED " + fileName + " ... " + message)
+    elapsed = max(time.perf_counter() - startTime, 1e-9)
+
+    print("Files: {0} ok ({1} in place), {2} failed{3}".format(
+        len(myPatches) - failed, inPlaceCount, failed, ", dry run" if myDryRun else ""))
+    print("Bytes rewritten: {0} ({1:.2f}s, {2:.1f} files/s)".format(totalBytes, elapsed, len(myPatches) / elapsed))
+    return failed
+
+
+# --- MAIN SCRIPT ---
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description="Adds, replaces and deletes ID3v2 frames of many MP3 files, "
+                                     "driven by a manifest (JSON or CSV).")
+    parser.add_argument("manifest", help="JSON or CSV file: file, frame, action, source")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: CPUs)")
+    parser.add_argument("-n", "--dry-run", action="store_true", dest="dryRun",
+                        help="report the bytes to rewrite, but don't write")
+    parser.add_argument("--padding", default=globRewritePaddingPolicy, metavar="POLICY",
+                        help="padding of rewritten files (default: " + globRewritePaddingPolicy + ", see id3v2TagReassembler.py)")
+    args = parser.parse_args()
+
+    try :
+        getPaddingSize(0, args.padding)   # check the policy before writing
+        patches = readPatchManifest(args.manifest)
+    except (OSError, ValueError, KeyError) as e :
+        print("ERROR: " + str(e))
+        exit(1) # Exit with error code 1
+    exit(1 if patchFiles(patches, args.jobs, args.dryRun, args.padding) > 0 else 0)
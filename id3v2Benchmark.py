@@ -0,0 +1,341 @@
+'''
+ID3v2 Benchmark
+---------------
+Measures, how the scripts of this project scale, on a synthetic corpus.
+
+* Generates synthetic MP3 files: ID3v2.3 and ID3v2.4 tags, with or without
+  extended header, footer, padding and unsynchronisation, 5 to 5000 frames,
+  APIC pictures up to tens of MB, followed by CBR MPEG audio frames.
+  The corpus is reproducible: the same seed gives the same files.
+* Times the stages: extraction (id3v2TagExtractor.py), reassembly
+  (id3v2TagReassembler.py), size checking (id3v2TagFramesSizeCheck.py)
+  and frame creation (id3v2FrameCreator_*.py). The files written by the
+  reassembly are checked (not timed): a stage with invalid files fails,
+  and the exit code is 1.
+* Every stage runs in its own fresh process, so the peak RSS (resident
+  memory) belongs to that stage. The read/write syscalls are taken from
+  /proc/self/io (Linux only, else null).
+* Writes the results as JSON, and compares them with an older run.
+
+Usage:
+  python id3v2Benchmark.py [-o results.json] [--quick] [--files N] [--compare old.json]
+
+J. Grätzer
+'''
+
+from sys import exit
+import sys
+import os
+import io
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+
+from id3v2TagParser import encodeSynchsafe, encodeInteger
+from id3v2Unsync import encodeUnsync, encodeFrameUnsync
+
+
+# --- SETTINGS ---
+globResultsFilename = "id3v2Benchmark.json"
+globSeed = 20200607
+globRegressionFactor = 1.2   # slower by this factor counts as regression
+
+# The corpus: (profile name, settings of makeSyntheticMp3())
+globProfiles = [
+    ("v3-small",      dict(version=3, frameCount=5,    apicSize=0)),
+    ("v4-padding",    dict(version=4, frameCount=50,   apicSize=256 * 1024, padding=4096)),
+    ("v3-ext",        dict(version=3, frameCount=20,   apicSize=64 * 1024, extendedHeader=True, padding=1024)),
+    ("v4-ext-footer", dict(version=4, frameCount=20,   apicSize=64 * 1024, extendedHeader=True, footer=True)),
+    ("v3-unsync",     dict(version=3, frameCount=20,   apicSize=1024 * 1024, unsync=True, padding=1024)),
+    ("v4-unsync",     dict(version=4, frameCount=20,   apicSize=1024 * 1024, unsync=True)),
+    ("v4-many",       dict(version=4, frameCount=5000, apicSize=0, padding=1024)),
+    ("v4-bigapic",    dict(version=4, frameCount=10,   apicSize=32 * 1024 * 1024)),
+]
+# --quick: smaller pictures, fewer files
+globQuickApicLimit = 2 * 1024 * 1024
+
+# One CBR MPEG-1 Layer III frame: 128 kbit/s, 44.1 kHz, 417 bytes
+globMpegFrameHeader = b'\xff\xfb\x90\x64'
+globMpegFrameSize = 417
+
+globStages = ["extract", "reassemble", "sizecheck", "create"]
+
+# --- FUNCTIONS ---
+def makeFrame(myFrameName, myData, myVersion) :
+    ''' Returns a frame (header and data) for the given ID3v2 version
+    '''
+    if myVersion == 3 :
+        sizeBytes = encodeInteger(len(myData))
+    else :
+        sizeBytes = encodeSynchsafe(len(myData))
+    return bytes(myFrameName, "latin-1") + sizeBytes + b'\x00\x00' + myData
+
+def makeSyntheticMp3(myFileName, myRandom, version=4, frameCount=10, apicSize=0, padding=0,
+                     extendedHeader=False, footer=False, unsync=False, audioFrames=200) :
+    ''' Writes a synthetic MP3 file. myRandom is a random.Random object,
+        so the same seed gives the same file. Returns the file size.
+    '''
+    textFrames = ["TIT2", "TPE1", "TALB", "TCON", "TRCK"]
+    frames = []
+    if apicSize > 0 :
+        # The picture data is random, like compressed image data, with a JPEG start
+        data = b'\x00image/jpeg\x00\x03cover\x00' + b'\xff\xd8\xff\xe0' + myRandom.randbytes(apicSize)
+        frames.append(makeFrame("APIC", data, version))
+    for i in range(max(frameCount - len(frames), 0)) :
+        if i < len(textFrames) :
+            frames.append(makeFrame(textFrames[i], b'\x03' + bytes("Text " + str(i), "utf-8"), version))
+        else :
+            frames.append(makeFrame("TXXX", b'\x03' + bytes("key" + str(i), "utf-8") + b'\x00'
+                                    + bytes("value " + str(myRandom.random()), "utf-8"), version))
+
+    flags = 0
+    if unsync :
+        flags = flags | 0b10000000
+        if version == 4 :
+            frames = [encodeFrameUnsync(frame) for frame in frames]
+    body = b''.join(frames)
+    if unsync and version == 3 :
+        body = encodeUnsync(body)
+
+    extended = b''
+    if extendedHeader :
+        flags = flags | 0b01000000
+        if version == 3 :
+            extended = encodeInteger(6) + b'\x00\x00' + encodeInteger(padding)
+        else :
+            extended = encodeSynchsafe(6) + b'\x01\x00'
+    if footer and version == 4 :
+        flags = flags | 0b00010000
+        padding = 0   # a tag with footer has no padding
+
+    tagSize = len(extended) + len(body) + padding
+    headerBytes = b'ID3' + bytes([version, 0, flags]) + encodeSynchsafe(tagSize)
+    with open(myFileName, "wb") as f :
+        f.write(headerBytes)
+        f.write(extended)
+        f.write(body)
+        f.write(bytes(padding))
+        if footer and version == 4 :
+            f.write(b'3DI' + headerBytes[3:])
+        for i in range(audioFrames) :
+            f.write(globMpegFrameHeader + bytes([i & 0xFF]) * (globMpegFrameSize - 4))
+        return f.tell()
+
+def makeCorpus(myDir, myFilesPerProfile, myQuick) :
+    ''' Generates the corpus: myFilesPerProfile MP3 files per profile in
+        myDir/<profile>/, and the input files of the frame creators in myDir/create/.
+        Returns a dict: profile name -> list of filenames.
+    '''
+    myRandom = random.Random(globSeed)
+    corpus = {}
+    for profileName, settings in globProfiles :
+        settings = dict(settings)
+        if myQuick :
+            settings["apicSize"] = min(settings["apicSize"], globQuickApicLimit)
+        profileDir = os.path.join(myDir, profileName)
+        os.makedirs(profileDir, exist_ok=True)
+        corpus[profileName] = []
+        for i in range(myFilesPerProfile) :
+            fileName = os.path.join(profileDir, "track{0:03d}.mp3".format(i))
+            makeSyntheticMp3(fileName, myRandom, **settings)
+            corpus[profileName].append(fileName)
+
+    # Input files of the frame creators
+    createDir = os.path.join(myDir, "create")
+    os.makedirs(createDir, exist_ok=True)
+    lineCount = 500 if myQuick else 5000
+    with open(os.path.join(createDir, "lyrics.txt"), "w", encoding="utf-8") as f :
+        for i in range(lineCount) :
+            f.write("Line " + str(i) + " of the lyrics\n")
+    with open(os.path.join(createDir, "lyrics.lrc"), "w", encoding="utf-8") as f :
+        for i in range(lineCount) :
+            f.write("[{0:02d}:{1:02d}.{2:02d}]Line {3}\n".format(i // 600, (i // 10) % 60, (i % 10) * 10, i))
+    with open(os.path.join(createDir, "subtitles.srt"), "w", encoding="utf-8") as f :
+        for i in range(lineCount) :
+            f.write("{0}\n00:{1:02d}:{2:02d},000 --> 00:{1:02d}:{2:02d},900\nSubtitle {0}\n\n".format(
+                i + 1, (i // 60) % 60, i % 60))
+    pictureSize = globQuickApicLimit if myQuick else 16 * 1024 * 1024
+    with open(os.path.join(createDir, "cover.png"), "wb") as f :
+        f.write(b'\x89PNG\r\n\x1a\n' + myRandom.randbytes(pictureSize))
+    corpus["create"] = [os.path.join(createDir, name) for name in ("lyrics.txt", "lyrics.lrc", "subtitles.srt", "cover.png")]
+    return corpus
+
+def readIoCounters() :
+    ''' Returns a dict of /proc/self/io (syscr, syscw, ...), or None (not Linux)
+    '''
+    try :
+        with open("/proc/self/io", "r") as f :
+            return {key: int(value) for key, value in (line.split(":") for line in f)}
+    except OSError :
+        return None
+
+def getPeakRssKb() :
+    ''' Returns the peak resident memory of this process in KB, or None
+    '''
+    try :
+        import resource
+    except ImportError :
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak   # macOS tells bytes
+
+def runStage(myStage, myFiles, myWorkDir) :
+    ''' Runs one stage on myFiles. This runs in a fresh process.
+        Returns a dict with the measured values.
+    '''
+    import id3v2TagExtractor
+    import id3v2TagReassembler
+    import id3v2TagFramesSizeCheck
+
+    os.makedirs(myWorkDir, exist_ok=True)
+    inputBytes = sum(os.path.getsize(fileName) for fileName in myFiles)
+    ioBefore = readIoCounters()
+    startTime = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()) :
+        if myStage == "extract" :
+            for i, fileName in enumerate(myFiles) :
+                outDir = os.path.join(myWorkDir, str(i))
+                os.makedirs(outDir, exist_ok=True)
+                id3v2TagExtractor.extractFile(fileName, os.path.join(outDir, "XXX_"))
+        elif myStage == "reassemble" :
+            # Uses the output of the extract stage, the reassembler works in the current directory.
+            # The tag gets the version of the frames (XXX_header.bin), so ID3v2.3 frames give a ID3v2.3 tag.
+            oldDir = os.getcwd()
+            try :
+                for i in range(len(myFiles)) :
+                    os.chdir(os.path.join(myWorkDir, str(i)))
+                    fileList = id3v2TagReassembler.getFrameFileList()
+                    id3v2TagReassembler.writeAudioFileWithHeaderAndFrames(
+                        id3v2TagReassembler.globNewAudioFilename, fileList,
+                        id3v2TagReassembler.readHeaderFileVersion(fileList))
+            finally :
+                os.chdir(oldDir)
+        elif myStage == "sizecheck" :
+            for fileName in myFiles :
+                id3v2TagFramesSizeCheck.validateMp3File(fileName)
+        else :
+            runCreateStage(myFiles, myWorkDir)
+    seconds = time.perf_counter() - startTime
+    ioAfter = readIoCounters()
+
+    # A fast stage, that writes broken files, is no result: check the files written (not timed)
+    invalidFiles = []
+    if myStage == "reassemble" :
+        for i in range(len(myFiles)) :
+            newFile = os.path.join(myWorkDir, str(i), id3v2TagReassembler.globNewAudioFilename)
+            report = id3v2TagFramesSizeCheck.validateMp3File(newFile)
+            if not report["ok"] :
+                invalidFiles.append(newFile + ": " + "; ".join(report["errors"]))
+
+    result = {"files": len(myFiles), "bytes": inputBytes, "seconds": seconds,
+              "filesPerSecond": len(myFiles) / max(seconds, 1e-9),
+              "mbPerSecond": inputBytes / max(seconds, 1e-9) / 1e6,
+              "peakRssKb": getPeakRssKb(), "invalidFiles": invalidFiles,
+              "readSyscallsPerFile": None, "writeSyscallsPerFile": None}
+    if ioBefore and ioAfter :
+        result["readSyscallsPerFile"] = (ioAfter["syscr"] - ioBefore["syscr"]) / len(myFiles)
+        result["writeSyscallsPerFile"] = (ioAfter["syscw"] - ioBefore["syscw"]) / len(myFiles)
+    return result
+
+def runCreateStage(myFiles, myWorkDir) :
+    ''' Creates USLT, SYLT, XSRT and APIC frames from the creator input files
+    '''
+    import id3v2FrameCreator_USLT
+    import id3v2FrameCreator_SYLT
+    import id3v2FrameCreator_XSRT
+    import id3v2FrameCreator_APIC
+
+    textFile, lrcFile, srtFile, pictureFile = myFiles
+    coreBytes = id3v2FrameCreator_USLT.makeFrameCoreBytes(textFile, "eng", "")
+    id3v2FrameCreator_USLT.writeFrame(os.path.join(myWorkDir, "XXX_N001_USLT.bin"), coreBytes, "USLT")
+    coreBytes = id3v2FrameCreator_SYLT.makeFrameCoreBytes(lrcFile, "eng", "", b'\x00')
+    id3v2FrameCreator_SYLT.writeFrame(os.path.join(myWorkDir, "XXX_N002_SYLT.bin"), coreBytes, "SYLT")
+    coreBytes = id3v2FrameCreator_XSRT.makeFrameCoreBytes(srtFile, "eng", "")
+    id3v2FrameCreator_XSRT.writeFrame(os.path.join(myWorkDir, "XXX_N003_XSRT.bin"), coreBytes, "XSRT")
+    id3v2FrameCreator_APIC.writeFrameStreamed(os.path.join(myWorkDir, "XXX_N004_APIC.bin"), pictureFile, "APIC")
+
+def runBenchmark(myFilesPerProfile, myQuick) :
+    ''' Generates the corpus in a temporary directory and runs all stages.
+        Returns the results as a dict.
+    '''
+    results = []
+    baseDir = tempfile.mkdtemp(prefix="id3v2Benchmark_")
+    # "spawn": every stage starts in a fresh process, without the memory of this one
+    context = multiprocessing.get_context("spawn")
+    try :
+        print("Generating the corpus in " + baseDir)
+        corpus = makeCorpus(os.path.join(baseDir, "corpus"), myFilesPerProfile, myQuick)
+        jobs = [(profileName, stage) for profileName, settings in globProfiles for stage in globStages if stage != "create"]
+        jobs.append(("create", "create"))
+        for profileName, stage in jobs :
+            workDir = os.path.join(baseDir, "work", profileName)
+            with context.Pool(1) as pool :
+                result = pool.apply(runStage, (stage, corpus[profileName], workDir))
+            result = dict(profile=profileName, stage=stage, **result)
+            results.append(result)
+            print("{0:14s} {1:10s} {2:8.1f} files/s {3:8.1f} MB/s  peak RSS {4} KB  syscalls/file r={5} w={6}".format(
+                profileName, stage, result["filesPerSecond"], result["mbPerSecond"], result["peakRssKb"],
+                formatCount(result["readSyscallsPerFile"]), formatCount(result["writeSyscallsPerFile"])))
+            for invalidFile in result["invalidFiles"] :
+                print("FAILED " + profileName + " " + stage + ": invalid output " + invalidFile)
+    finally :
+        shutil.rmtree(baseDir, ignore_errors=True)
+
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "quick": myQuick, "filesPerProfile": myFilesPerProfile,
+            "seed": globSeed, "results": results}
+
+def formatCount(myValue) :
+    ''' Formats a syscall count, that may be None
+    '''
+    return "-" if myValue is None else "{0:.0f}".format(myValue)
+
+def compareResults(myOldResults, myNewResults) :
+    ''' Prints the speed of the new run relative to the old run per profile and stage.
+        Returns the number of regressions (slower than globRegressionFactor).
+    '''
+    old = {(r["profile"], r["stage"]): r for r in myOldResults["results"]}
+    regressions = 0
+    for r in myNewResults["results"] :
+        key = (r["profile"], r["stage"])
+        if key not in old :
+            continue
+        factor = r["seconds"] / max(old[key]["seconds"], 1e-9)
+        mark = ""
+        if factor > globRegressionFactor :
+            mark = "  REGRESSION"
+            regressions = regressions + 1
+        print("{0:14s} {1:10s} time x{2:.2f}{3}".format(r["profile"], r["stage"], factor, mark))
+    return regressions
+
+
+# --- MAIN SCRIPT ---
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description="Benchmark of the ID3v2 scripts on a synthetic corpus.")
+    parser.add_argument("-o", "--output", default=globResultsFilename, help="results file (default: " + globResultsFilename + ")")
+    parser.add_argument("--files", type=int, default=5, help="files per profile (default: 5)")
+    parser.add_argument("--quick", action="store_true", help="small pictures and frame creator inputs")
+    parser.add_argument("--compare", metavar="OLD", help="compare with the results of an older run")
+    args = parser.parse_args()
+
+    newResults = runBenchmark(args.files, args.quick)
+    with open(args.output, "w", encoding="utf-8") as f :
+        json.dump(newResults, f, indent=1)
+    print("OK, results saved: " + args.output)
+    failedStages = [r for r in newResults["results"] if r.get("invalidFiles")]
+    if failedStages :
+        print("PROBLEM: " + str(len(failedStages)) + " stages wrote invalid files.")
+
+    if args.compare :
+        with open(args.compare, "r", encoding="utf-8") as f :
+            oldResults = json.load(f)
+        if compareResults(oldResults, newResults) > 0 :
+            exit(1) # Exit with error code 1
+    if failedStages :
+        exit(1) # Exit with error code 1
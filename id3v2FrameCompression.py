@@ -0,0 +1,126 @@
+'''
+ID3v2 Frame Compression
+-----------------------
+Compresses and decompresses the data of ID3v2 frames with zlib.
+
+* ID3v2.4: frame flag k (compression) and frame flag p (data length
+  indicator) are set, the data starts with the synchsafe size of the
+  uncompressed data, followed by the zlib data.
+* ID3v2.3: frame flag i (compression), the data starts with the size of
+  the uncompressed data (standard integer), followed by the zlib data.
+
+Long lyrics and subtitles (USLT, SYLT, XSRT) compress very well. Frames
+are compressed only, if they have at least a given number of bytes and if
+the compressed frame is smaller.
+
+Usage as a script: python id3v2FrameCompression.py FRAMEFILE.bin [THRESHOLD]
+Compresses the ID3v2.4 frame file (in place).
+
+J. Grätzer
+'''
+
+import sys
+import zlib
+
+from id3v2TagParser import (TagError, encodeSynchsafe, decodeFrameSize, decodeUnsync,
+                             globFrameFlagGroup, globFrameFlagCompression, globFrameFlagEncryption,
+                             globFrameFlagUnsync, globFrameFlagDataLength,
+                             globV3FlagCompression, globV3FlagEncryption, globV3FlagGroup)
+
+
+# --- SETTINGS ---
+# The frame flags of ID3v2.4 and ID3v2.3 are defined in id3v2TagParser.py
+globCompressionLevel = 9   # zlib level, 9 is the smallest
+
+# --- FUNCTIONS ---
+def getExtraDataSize(myFlags2, myId3Vers) :
+    ''' Returns the number of bytes between the frame header and the frame data,
+        announced by the second flag byte (group, encryption, data length)
+    '''
+    if myId3Vers == 4 :
+        return ((1 if myFlags2 & globFrameFlagGroup else 0) + (1 if myFlags2 & globFrameFlagEncryption else 0)
+                + (4 if myFlags2 & globFrameFlagDataLength else 0))
+    return ((4 if myFlags2 & globV3FlagCompression else 0) + (1 if myFlags2 & globV3FlagEncryption else 0)
+            + (1 if myFlags2 & globV3FlagGroup else 0))
+
+def isCompressed(myFrame, myId3Vers) :
+    ''' True, if the compression flag of the frame (header and data) is set
+    '''
+    return (myFrame[9] & (globFrameFlagCompression if myId3Vers == 4 else globV3FlagCompression)) != 0
+
+def decompressData(myData, myFrameName="") :
+    ''' Returns the decompressed zlib data, raises TagError on broken data
+    '''
+    try :
+        return zlib.decompress(myData)
+    except zlib.error as e :
+        raise TagError("compressed frame " + myFrameName + " can't be decompressed: " + str(e))
+
+def compressFrame(myFrame, myThreshold=0) :
+    ''' ID3v2.4: Returns the frame myFrame (header and data) compressed,
+        if the frame data has at least myThreshold bytes and the compressed
+        frame is smaller. Else returns the frame unchanged (as bytes).
+        Frames already compressed, encrypted or unsynchronised stay unchanged.
+    '''
+    flags2 = myFrame[9]
+    if flags2 & (globFrameFlagCompression | globFrameFlagEncryption | globFrameFlagUnsync | globFrameFlagDataLength) :
+        return bytes(myFrame)
+    groupBytes = bytes(myFrame[10:11]) if flags2 & globFrameFlagGroup else b""
+    data = myFrame[10 + len(groupBytes):]
+    if len(data) < myThreshold :
+        return bytes(myFrame)
+    compressed = zlib.compress(data, globCompressionLevel)
+    size = len(groupBytes) + 4 + len(compressed)
+    if size >= len(myFrame) - 10 :
+        return bytes(myFrame)   # no gain
+    return (bytes(myFrame[0:4]) + encodeSynchsafe(size)
+            + bytes([myFrame[8], flags2 | globFrameFlagCompression | globFrameFlagDataLength])
+            + groupBytes + encodeSynchsafe(len(data)) + compressed)
+
+def decompressFrame(myFrame, myId3Vers) :
+    ''' Returns the frame myFrame (header and data) with the compression removed:
+        the flags are cleared, the size is updated. ID3v2.4: the unsynchronisation
+        and the data length indicator are removed, too.
+        Uncompressed and encrypted frames are returned unchanged (as bytes).
+    '''
+    flags2 = myFrame[9]
+    frameName = bytes(myFrame[0:4]).decode("latin-1")
+    if not isCompressed(myFrame, myId3Vers) :
+        return bytes(myFrame)
+    if myId3Vers == 4 :
+        if flags2 & globFrameFlagEncryption :
+            return bytes(myFrame)
+        groupBytes = bytes(myFrame[10:11]) if flags2 & globFrameFlagGroup else b""
+        data = myFrame[10 + getExtraDataSize(flags2, 4):]
+        if flags2 & globFrameFlagUnsync :
+            data = decodeUnsync(data)
+        data = decompressData(data, frameName)
+        newFlags2 = flags2 & ~(globFrameFlagCompression | globFrameFlagUnsync | globFrameFlagDataLength)
+        return (bytes(myFrame[0:4]) + encodeSynchsafe(len(groupBytes) + len(data))
+                + bytes([myFrame[8], newFlags2]) + groupBytes + data)
+    # ID3v2.3: size of the uncompressed data, [encryption method], [group], zlib data
+    if flags2 & globV3FlagEncryption :
+        return bytes(myFrame)
+    groupBytes = bytes(myFrame[14:15]) if flags2 & globV3FlagGroup else b""
+    data = decompressData(myFrame[10 + getExtraDataSize(flags2, 3):], frameName)
+    return (bytes(myFrame[0:4]) + (len(groupBytes) + len(data)).to_bytes(4, "big")
+            + bytes([myFrame[8], flags2 & ~globV3FlagCompression]) + groupBytes + data)
+
+
+# --- MAIN SCRIPT ---
+if __name__ == "__main__" :
+    if len(sys.argv) < 2 :
+        print("Usage: python id3v2FrameCompression.py FRAMEFILE.bin [THRESHOLD]")
+        sys.exit(1)
+    with open(sys.argv[1], "rb") as f :  # read in binary mode
+        frame = f.read()
+    if len(frame) < 10 or decodeFrameSize(frame[4:8], 4) != len(frame) - 10 :
+        print("PROBLEM: " + sys.argv[1] + " is no ID3v2.4 frame file")
+        sys.exit(1)
+    newFrame = compressFrame(frame, int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    if newFrame == frame :
+        print("Not compressed (too small, no gain, or compressed already): " + sys.argv[1])
+        sys.exit(0)
+    with open(sys.argv[1], "wb") as f :
+        f.write(newFrame)
+    print("OK, " + str(len(frame)) + " -> " + str(len(newFrame)) + " bytes: " + sys.argv[1])
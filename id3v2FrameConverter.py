@@ -0,0 +1,326 @@
+'''
+ID3v2.3 to ID3v2.4 Frame Converter
+----------------------------------
+Converts ID3v2.3 frames into ID3v2.4 frames:
+* The frame size becomes a synchsave integer (ID3v2.3: standard integer)
+* The flag bytes get the ID3v2.4 layout, the data behind the frame header
+  (group id, encryption method, decompressed size) gets the ID3v2.4 order
+* Deprecated frames are renamed: TORY -> TDOR, IPLS -> TIPL,
+  and TYER, TDAT, TIME are merged into one TDRC frame. Date frames, that
+  can't be merged (e.g. no valid year, or a TDRC frame exists), are kept
+  and reported
+* Frames without a ID3v2.4 counterpart (TRDA, TSIZ, EQUA, RVAD) are dropped
+
+Usage:
+  python id3v2FrameConverter.py frames [DIR]
+      Converts the .bin frames files XXX_N*.bin in DIR (default: current
+      directory), if XXX_header.bin tells, that they come from a ID3v2.3 tag.
+  python id3v2FrameConverter.py library [-o OUTDIR] [-j JOBS] [--padding POLICY] PATH [PATH ...]
+      Converts the ID3v2.3 tags of all MP3 files found in PATH (files or
+      directories) in parallel. Without -o, the files are changed: the new tag
+      is written into the old tag, if it fits, else the file is rewritten
+      with the padding of --padding POLICY (see id3v2TagReassembler.py).
+      With -o, new files are written into OUTDIR. MP3 files with a ID3v2.4
+      tag are skipped.
+
+J. Grätzer
+'''
+
+from sys import exit
+import os
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from id3v2TagParser import Id3v2Tag, TagError, decodeInteger, encodeSynchsafe, writeFileAtomic
+from id3v2TagExtractor import findMp3Files
+from id3v2TagReassembler import makeTagHeaderBytes, writePadding, copyBytes, getPaddingSize, globPaddingPolicy
+
+
+# --- SETTINGS ---
+globBinFilePrefix = "XXX_"
+globFrameFilePrefix = globBinFilePrefix + "N"  # "XXX_N"
+globHeaderFilename = globBinFilePrefix + "header.bin"
+
+# ID3v2.3 frames with a new name in ID3v2.4
+globRenamedFrames = {"TORY": "TDOR", "IPLS": "TIPL"}
+# ID3v2.3 frames merged into TDRC
+globDateFrames = ("TYER", "TDAT", "TIME")
+# ID3v2.3 frames without a ID3v2.4 counterpart
+globDroppedFrames = ("TRDA", "TSIZ", "EQUA", "RVAD")
+
+# --- FUNCTIONS ---
+def convertFrameHeader(myFrame, myNewFrameName=None) :
+    ''' Converts a single ID3v2.3 frame (header and data) into a ID3v2.4 frame.
+        Returns the new frame bytes.
+    '''
+    frameName = myNewFrameName if myNewFrameName else bytes(myFrame[0:4]).decode("latin-1")
+    flags1 = myFrame[8]
+    flags2 = myFrame[9]
+    data = myFrame[10:]
+
+    # Status flags: ID3v2.3 abc00000 -> ID3v2.4 0abc0000
+    newFlags1 = (flags1 >> 1) & 0b01110000
+    newFlags2 = 0
+    # Format flags: ID3v2.3 ijk00000, followed by the data in this order:
+    # decompressed size (4 bytes), encryption method (1 byte), group id (1 byte)
+    decompressedSize = None
+    encryptionMethod = b''
+    groupId = b''
+    if flags2 & 0b10000000 :
+        decompressedSize = decodeInteger(data[0:4])
+        data = data[4:]
+    if flags2 & 0b01000000 :
+        encryptionMethod = bytes(data[0:1])
+        data = data[1:]
+        newFlags2 = newFlags2 | 0b00000100
+    if flags2 & 0b00100000 :
+        groupId = bytes(data[0:1])
+        data = data[1:]
+        newFlags2 = newFlags2 | 0b01000000
+
+    # ID3v2.4 order: group id, encryption method, data length indicator
+    extraBytes = groupId + encryptionMethod
+    if decompressedSize is not None :
+        # Compression needs the data length indicator in ID3v2.4
+        newFlags2 = newFlags2 | 0b00001000 | 0b00000001
+        extraBytes = extraBytes + encodeSynchsafe(decompressedSize)
+
+    size = len(extraBytes) + len(data)
+    return (bytes(frameName, "latin-1") + encodeSynchsafe(size) + bytes([newFlags1, newFlags2])
+            + extraBytes + bytes(data))
+
+def decodeTextFrame(myFrame) :
+    ''' Returns the text of a ID3v2.3 text frame (T***), without trailing 00H
+    '''
+    encoding = myFrame[10]
+    data = bytes(myFrame[11:])
+    if encoding == 1 :
+        text = data.decode("utf-16")
+    elif encoding == 2 :
+        text = data.decode("utf-16-be")
+    elif encoding == 3 :
+        text = data.decode("utf-8")
+    else :
+        text = data.decode("latin-1")
+    return text.split("\x00")[0].strip()
+
+def makeDateFrame(myDateFrames) :
+    ''' Merges the ID3v2.3 frames TYER (YYYY), TDAT (DDMM) and TIME (HHMM)
+        into the bytes of one ID3v2.4 TDRC frame (YYYY-MM-DDTHH:MM).
+        myDateFrames is a dict: frame name -> frame bytes.
+        Returns a tuple (TDRC frame bytes, names of the frames merged),
+        or (None, ()), if there is no valid year.
+    '''
+    year = decodeTextFrame(myDateFrames["TYER"]) if "TYER" in myDateFrames else ""
+    if len(year) != 4 or not year.isdigit() :
+        return None, ()
+    timestamp = year
+    merged = ("TYER",)
+    date = decodeTextFrame(myDateFrames["TDAT"]) if "TDAT" in myDateFrames else ""
+    if len(date) == 4 and date.isdigit() :
+        timestamp = timestamp + "-" + date[2:4] + "-" + date[0:2]
+        merged = merged + ("TDAT",)
+        time = decodeTextFrame(myDateFrames["TIME"]) if "TIME" in myDateFrames else ""
+        if len(time) == 4 and time.isdigit() :
+            timestamp = timestamp + "T" + time[0:2] + ":" + time[2:4]
+            merged = merged + ("TIME",)
+    data = b'\x03' + bytes(timestamp, "utf-8")   # 03H: text encoding UTF-8
+    return b'TDRC' + encodeSynchsafe(len(data)) + b'\x00\x00' + data, merged
+
+def convertFrames(myFrames) :
+    ''' Converts a list of ID3v2.3 frames (tuples: frame name, frame bytes)
+        into a list of ID3v2.4 frames (tuples: frame name, frame bytes or None).
+        None marks a frame dropped, so the list keeps the positions of the frames.
+        The TDRC frame takes the position of the first date frame merged.
+        Date frames not merged keep their name (see getKeptDateFrames()).
+    '''
+    dateFrames = {}
+    for frameName, frame in myFrames :
+        if frameName in globDateFrames :
+            dateFrames[frameName] = frame
+    hasTdrc = any(frameName == "TDRC" for frameName, frame in myFrames)
+    dateFrame, merged = (None, ()) if hasTdrc else makeDateFrame(dateFrames)
+
+    result = []
+    dateDone = False
+    for frameName, frame in myFrames :
+        if frameName in globDroppedFrames :
+            result.append((frameName, None))
+        elif frameName in merged :
+            result.append(("TDRC", None if dateDone else dateFrame))
+            dateDone = True
+        elif frameName in globDateFrames :
+            # No TDRC for it: keep the data, the frame is not deleted
+            result.append((frameName, convertFrameHeader(frame)))
+        else :
+            newName = globRenamedFrames.get(frameName, frameName)
+            result.append((newName, convertFrameHeader(frame, newName)))
+    return result
+
+def getKeptDateFrames(myNewFrames) :
+    ''' Returns the names of the date frames (TYER, TDAT, TIME) of a result
+        of convertFrames(), that are not merged into the TDRC frame.
+    '''
+    return [newName for newName, newFrame in myNewFrames if newName in globDateFrames]
+
+def convertFrameFiles(myDir) :
+    ''' Converts the .bin frames files XXX_N*.bin of the directory myDir,
+        if XXX_header.bin tells, that they come from a ID3v2.3 tag.
+        Renamed frames get new filenames, dropped frames are deleted.
+        A frames file is replaced or deleted only after its new frame is written.
+        Returns the number of frames files written.
+    '''
+    headerFileName = os.path.join(myDir, globHeaderFilename)
+    try :
+        with open(headerFileName, "rb") as f :
+            headerBytes = f.read(10)
+    except FileNotFoundError :
+        print("convertFrameFiles() PROBLEM: " + headerFileName + " is missing.")
+        return 0
+    if headerBytes[3] != 3 :
+        print("convertFrameFiles() OK: The frames are not ID3v2.3 frames, nothing to do.")
+        return 0
+
+    fileList = glob.glob(os.path.join(glob.escape(myDir), globFrameFilePrefix + "*.bin"))
+    fileList.sort(reverse=False)  # make sure the list is sorted
+    frames = []
+    for filePath in fileList :
+        with open(filePath, "rb") as f :  # read in binary mode
+            frame = f.read()
+        frames.append((frame[0:4].decode("latin-1"), frame))
+    try :
+        newFrames = convertFrames(frames)
+    except (ValueError, IndexError) as e :
+        # e.g. a date frame without text, or broken UTF-16 text
+        print("convertFrameFiles() PROBLEM: The frames can't be converted: " + repr(e))
+        return 0
+
+    for frameName in getKeptDateFrames(newFrames) :
+        print("convertFrameFiles() PROBLEM: " + frameName + " is not merged into a TDRC frame, it is kept.")
+
+    written = 0
+    try :
+        for filePath, (newName, newFrame) in zip(fileList, newFrames) :
+            if newFrame is None :
+                print("convertFrameFiles() dropped " + filePath)
+                os.remove(filePath)
+                continue
+            # e.g. XXX_N004_TYER.bin -> XXX_N004_TDRC.bin
+            baseName = os.path.basename(filePath)
+            newFilePath = os.path.join(os.path.dirname(filePath), baseName[0:baseName.rindex("_") + 1] + newName + ".bin")
+            writeFileAtomic(newFilePath, newFrame)
+            if newFilePath != filePath :
+                os.remove(filePath)   # the new frame is written, the old file can go
+            print("convertFrameFiles() " + newFilePath)
+            written = written + 1
+
+        # The header tells the version of the frames
+        writeFileAtomic(headerFileName, headerBytes[0:3] + b'\x04' + headerBytes[4:10])
+    except OSError as e :
+        print("convertFrameFiles() PROBLEM: " + repr(e) + ", " + str(written) + " frames files written, "
+              + headerFileName + " still tells ID3v2.3.")
+    return written
+
+def convertFile(myfile, myTargetFile=None, myPaddingPolicy=globPaddingPolicy) :
+    ''' Converts the ID3v2.3 tag of a MP3 file into a ID3v2.4 tag.
+        Writes myTargetFile, or changes myfile, if myTargetFile is None:
+        in place, if the new tag fits into the old tag, else the file is rewritten.
+        A new tag gets the padding of myPaddingPolicy.
+        Returns a tuple (myfile, ok, message).
+    '''
+    try :
+        with Id3v2Tag(myfile) as tag :
+            if tag.header.version != 3 :
+                return myfile, True, "skipped, ID3v2." + str(tag.header.version)
+            oldTagSize = tag.header.bruttoSize
+            audioStart = tag.audioStart()
+            frames = []
+            for frame in tag.frames() :
+                frames.append((frame.frameName, bytes(frame.frame)))
+                frame.frame.release()
+    except (OSError, TagError) as e :
+        return myfile, False, "ERROR: " + str(e)
+
+    targetFile = None
+    try :
+        # e.g. a date frame without text, or broken UTF-16 text: ValueError, IndexError
+        newFrames = convertFrames(frames)
+        tagBody = b''.join([newFrame for newName, newFrame in newFrames if newFrame is not None])
+        keptDateFrames = getKeptDateFrames(newFrames)
+        note = ", kept " + "/".join(keptDateFrames) + " (no TDRC)" if keptDateFrames else ""
+
+        if myTargetFile is None and 10 + len(tagBody) <= oldTagSize :
+            # The new tag fits: overwrite the old tag, fill the rest with padding
+            with open(myfile, "r+b", buffering=0) as fileTarget :
+                fileTarget.write(makeTagHeaderBytes(oldTagSize - 10, 4))
+                fileTarget.write(tagBody)
+                writePadding(fileTarget, oldTagSize - 10 - len(tagBody))
+            return myfile, True, "OK, in place" + note
+
+        # Write a new file: tag, than the audio data of the old file
+        paddingSize = getPaddingSize(len(tagBody), myPaddingPolicy)
+        targetFile = myTargetFile if myTargetFile else myfile + ".tmp" + str(os.getpid())
+        os.makedirs(os.path.dirname(os.path.abspath(targetFile)), exist_ok=True)
+        with open(myfile, "rb") as f, open(targetFile, "wb", buffering=0) as fileTarget :
+            fileTarget.write(makeTagHeaderBytes(len(tagBody) + paddingSize, 4))
+            fileTarget.write(tagBody)
+            writePadding(fileTarget, paddingSize)
+            copyBytes(f, fileTarget, audioStart, os.fstat(f.fileno()).st_size - audioStart)
+        if myTargetFile is None :
+            os.replace(targetFile, myfile)
+            return myfile, True, "OK, rewritten" + note
+        return myfile, True, "OK, written " + targetFile + note
+    except (OSError, ValueError, IndexError) as e :
+        # Don't leave a half-written file (myfile is replaced only at the end)
+        if targetFile is not None :
+            try :
+                os.remove(targetFile)
+            except OSError :
+                pass
+        return myfile, False, "ERROR: " + repr(e)
+
+def convertLibrary(myPaths, myOutputRoot=None, myJobs=None, myPaddingPolicy=globPaddingPolicy) :
+    ''' Converts all MP3 files found in myPaths (files or directories)
+        using a pool of worker processes. Returns the number of files failed.
+    '''
+    failed = 0
+    mp3Files = findMp3Files(myPaths)
+    with ProcessPoolExecutor(max_workers=myJobs) as pool :
+        futures = []
+        for fileName, relName in mp3Files :
+            targetFile = os.path.join(myOutputRoot, relName + ".mp3") if myOutputRoot else None
+            futures.append(pool.submit(convertFile, fileName, targetFile, myPaddingPolicy))
+        for future in as_completed(futures) :
+            fileName, ok, message = future.result()
+            if not ok :
+                failed = failed + 1
+            print(("OK     " if ok else "FAILED ") + fileName + " ... " + message)
+    print("Files: {0} ok, {1} failed".format(len(mp3Files) - failed, failed))
+    return failed
+
+
+# --- MAIN SCRIPT ---
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description="Converts ID3v2.3 frames into ID3v2.4 frames.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    cmdFrames = commands.add_parser("frames", help="convert the .bin frames files of a directory")
+    cmdFrames.add_argument("dir", nargs="?", default=".")
+    cmdLibrary = commands.add_parser("library", help="convert the tags of MP3 files")
+    cmdLibrary.add_argument("paths", nargs="+", metavar="PATH", help="MP3 file or directory")
+    cmdLibrary.add_argument("-o", "--output", default=None, help="write new files into this directory")
+    cmdLibrary.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: CPUs)")
+    cmdLibrary.add_argument("--padding", default=globPaddingPolicy, metavar="POLICY",
+                            help="padding of new tags (default: " + globPaddingPolicy + ", see id3v2TagReassembler.py)")
+    args = parser.parse_args()
+
+    if args.command == "frames" :
+        convertFrameFiles(args.dir)
+        print("OK, ready.")
+    else :
+        try :
+            getPaddingSize(0, args.padding)   # check the policy before writing
+        except (OSError, ValueError) as e :
+            print("ERROR: " + str(e))
+            exit(1) # Exit with error code 1
+        exit(1 if convertLibrary(args.paths, args.output, args.jobs, args.padding) > 0 else 0)
@@ -3,6 +3,8 @@ ID3v2 Frame Creator: APIC
 -------------------------
 Builds a new binary file with a ID3v2.4 APIC frame,
 containing a picture. Attention: Use ASCII character encoding in picture filenames!
+The picture (JPEG, PNG, WebP or GIF, found by its magic bytes) is copied
+straight into the frame file, so even large pictures need little memory.
 
 Steps/Strategy:
 1) Select a image file
@@ -15,14 +17,25 @@ Jens Grätzer
 '''
 
 from sys import exit
-from tkinter import *
-from tkinter.filedialog import askopenfilename
+import os
+import ntpath
+
+from id3v2TagParser import encodeSynchsafe
+from id3v2TagReassembler import copyFileInto
 
 # --- SETTINGS ---
 # Prefix of frame bin files
 globBinFilePrefix = "XXX_"  # files starting with this prefix will be deleted at the beginning
 # Target filename (BIN file)
 globTargetFileName = "XXX_N999_APIC.BIN"
+# Magic bytes of the supported image files: (offset, bytes, MIME type)
+globMimeSignatures = ((0, b'\xff\xd8\xff', "image/jpeg"),
+                      (0, b'\x89PNG\r\n\x1a\n', "image/png"),
+                      (8, b'WEBP', "image/webp"),   # after RIFF and the chunk size
+                      (0, b'GIF87a', "image/gif"),
+                      (0, b'GIF89a', "image/gif"))
+# Largest frame data, the frame size is a synchsave integer with 28 bits
+globMaxFrameSize = 0x0FFFFFFF
 
 # --- INTERNAL GLOBALS ---
 # none
@@ -31,31 +44,47 @@ globTargetFileName = "XXX_N999_APIC.BIN"
 def selectImageFile(pickerTitle) :
     ''' Calls a file picker window, that asks for picking a MP3 file
     '''
-    # Filepicker menue
+    # Filepicker menue (tkinter is imported here only, so importing this module is fast)
+    from tkinter import Tk
+    from tkinter.filedialog import askopenfilename
     root = Tk()
-    myFilename =  askopenfilename(title = pickerTitle, filetypes = (("image files",".png .jpg .jpeg"),("all files",".*")))
+    myFilename =  askopenfilename(title = pickerTitle, filetypes = (("image files",".png .jpg .jpeg .webp .gif"),("all files",".*")))
     root.withdraw()  # Close the Tk window
     return myFilename
 
-def makeFrameCoreBytes(myImageFileName) :
+def sniffMimeType(myImageFileName) :
+    ''' Returns the MIME type of an image file, found by the magic bytes
+        at the beginning of the file (not by the filename extension).
+        Returns "" for unknown file types.
+    '''
+    with open(myImageFileName, "rb") as f :  # read in binary mode
+        magic = f.read(12)
+    for offset, signature, mimeType in globMimeSignatures :
+        if magic[offset:offset + len(signature)] == signature :
+            if mimeType != "image/webp" or magic[0:4] == b'RIFF' :
+                return mimeType
+    return ""
+
+def makeFrameHeadBytes(myImageFileName) :
+    ''' Returns the APIC frame data in front of the picture:
+        text encoding, MIME type, picture type and description
+    '''
     # Find the MIME-type of the image
-    fileExtension = myImageFileName[-4:].upper()
-    print("makeFrameCoreBytes() fileExtension=" + fileExtension)
-    mimeType = ""
-    if fileExtension == ".PNG" :
-        mimeType = "image/png"
-    elif fileExtension == ".JPG" or fileExtension == "JPEG" :
-        mimeType = "image/jpeg"
-    else :
-        print('writeTempFrameCore() FATAL ERROR - not supported ' + fileExtension)
+    try :
+        mimeType = sniffMimeType(myImageFileName)
+    except OSError :
+        print('makeFrameHeadBytes() FATAL ERROR on reading ' + myImageFileName)
         exit(1) # Exit with error code 1
-    
+    if mimeType == "" :
+        print('makeFrameHeadBytes() FATAL ERROR - not supported image file ' + myImageFileName)
+        exit(1) # Exit with error code 1
+
     # Start the bytes object with the first byte 00H - sets text encoding to ASCII
     frameBytes = b'\x00'
-    
+
     # Append MIME type
     frameBytes = frameBytes + bytes(mimeType, 'utf-8') + bytes([0])
-    
+
     # Append 00H for picture type  "other" <--- OK for enhanced podcasts
     frameBytes = frameBytes + b'\x00'
 
@@ -63,7 +92,14 @@ def makeFrameCoreBytes(myImageFileName) :
     #  ... This is OK for enhanced podcasts
     fileNameOnly = ntpath.basename(myImageFileName)
     frameBytes = frameBytes + bytes(fileNameOnly, 'utf-8') + bytes([0])
-    
+    return frameBytes
+
+def makeFrameCoreBytes(myImageFileName) :
+    ''' Returns the complete APIC frame data, including the picture.
+        For large pictures better use writeFrameStreamed().
+    '''
+    frameBytes = makeFrameHeadBytes(myImageFileName)
+
     # Append image bytes from file myImageFileName
     try :
         with open(myImageFileName, "rb") as f:  # read in binary mode
@@ -76,6 +112,27 @@ def makeFrameCoreBytes(myImageFileName) :
     # Return the result
     return frameBytes
 
+def writeFrameStreamed(myTargetFileName, myImageFileName, myFrameName="APIC") :
+    ''' Writes the APIC frame file without loading the picture: the frame size
+        is computed from the file size, than the picture is copied from the
+        image file straight into the target file. Returns the frame size.
+    '''
+    headBytes = makeFrameHeadBytes(myImageFileName)
+    myCoreSize = len(headBytes) + os.path.getsize(myImageFileName)
+    if myCoreSize > globMaxFrameSize :
+        print('writeFrameStreamed() FATAL ERROR - image too large for a frame: ' + myImageFileName)
+        exit(1) # Exit with error code 1
+
+    # Frame header: name, synchsave size, 2 flag bytes
+    headerBytes = bytes(myFrameName, 'utf-8') + encodeSynchsafe(myCoreSize) + b'\x00\x00'
+    with open(myTargetFileName, "wb", buffering=0) as fileTarget :  # unbuffered, see copyBytes()
+        fileTarget.write(headerBytes + headBytes)
+        copiedSize = copyFileInto(fileTarget, myImageFileName)
+    if len(headBytes) + copiedSize != myCoreSize :
+        print('writeFrameStreamed() FATAL ERROR - image file changed while copying: ' + myImageFileName)
+        exit(1) # Exit with error code 1
+    return myCoreSize + 10
+
 
 def writeFrame(myTargetFileName, myFrameCoreBytes, myFrameName) :
     # Get the frame data size
@@ -114,18 +171,16 @@ def writeFrame(myTargetFileName, myFrameCoreBytes, myFrameName) :
 
 
 # --- MAIN SCRIPT ---
-# Chose an image file
-imgFileName = selectImageFile("Choose an Image File")
+if __name__ == "__main__" :
+    # Chose an image file
+    imgFileName = selectImageFile("Choose an Image File")
 
-if imgFileName == "" :
-    print ("Nothing selected")    
-    exit(0) # Successful exit
+    if imgFileName == "" :
+        print ("Nothing selected")    
+        exit(0) # Successful exit
     
-# Make the APIC frame core content bytes
-frameCoreBytes = makeFrameCoreBytes(imgFileName)
-
-# Store the APIC frame in BIN file
-writeFrame(globTargetFileName, frameCoreBytes, "APIC")
+    # Store the APIC frame in BIN file, the picture is streamed from the image file
+    writeFrameStreamed(globTargetFileName, imgFileName, "APIC")
 
-# Finish
-print("OK, ready: " + globTargetFileName)
+    # Finish
+    print("OK, ready: " + globTargetFileName)
@@ -2,6 +2,8 @@
 ID3v2 Frame Creator: SYLT
 -------------------------
 Builds a new binary file with a ID3v2.4 SYLT frame from a LRC file.
+Lines may have more than one timestamp, [mm:ss.xx] or [mm:ss.xxx],
+and word timestamps <mm:ss.xx> (enhanced LRC).
 
 Steps/Strategy:
 1) Select a LRC file
@@ -13,8 +15,9 @@ Jens Grätzer
 '''
 
 from sys import exit
-from tkinter import *
-from tkinter.filedialog import askopenfilename
+import re
+
+from id3v2FrameCompression import compressFrame
 
 # --- SETTINGS ---
 # Prefix of frame bin files
@@ -23,8 +26,14 @@ globBinFilePrefix = "XXX_"  # files starting with this prefix will be deleted at
 globTargetFileName = "XXX_N999_SYLT.BIN"
 globTargetLanguage = 'eng'  # 3 characters, e.g. "eng"
 globTargetDescription = ''  # Content description
+# Compress frames with at least this number of bytes (zlib), e.g. 1024. None: no compression
+globCompressThreshold = None
 globContentType = b'\x08'    # SYLT content type b'\x08' for "image url" or b'\x00' for "other"
 
+# LRC timestamps: [mm:ss.xx] at the beginning of a line, <mm:ss.xx> in front of a word (enhanced LRC)
+globLineTimestampPattern = re.compile(r"\[(\d+):(\d{1,2})(?:[.:](\d{1,3}))?\]")
+globWordTimestampPattern = re.compile(r"<(\d+):(\d{1,2})(?:[.:](\d{1,3}))?>")
+
 # --- INTERNAL GLOBALS ---
 # none
 
@@ -32,86 +41,138 @@ globContentType = b'\x08'    # SYLT content type b'\x08' for "image url" or b'\x
 def selectImageFile(pickerTitle) :
     ''' Calls a file picker window, that asks for picking a LRC file
     '''
-    # Filepicker menue
+    # Filepicker menue (tkinter is imported here only, so importing this module is fast)
+    from tkinter import Tk
+    from tkinter.filedialog import askopenfilename
     root = Tk()
     myFilename =  askopenfilename(title = pickerTitle, filetypes = (("lrc files",".lrc"),("all files",".*")))
     root.withdraw()  # Close the Tk window
     return myFilename
 
-def makeFrameCoreBytes(myInputFileName, myLanguage, myContentDescription, myContentType) :  
+def parseTimestamp(myMinutes, mySeconds, myFraction) :
+    ''' Returns the milliseconds of a LRC timestamp mm:ss.xx (or mm:ss.xxx, mm:ss)
+    '''
+    ms = (int(myMinutes) * 60 + int(mySeconds)) * 1000
+    if myFraction :
+        # 1 digit: tenths, 2 digits: hundredths, 3 digits: milliseconds
+        ms = ms + int(myFraction) * 10 ** (3 - len(myFraction))
+    return ms
+
+def parseLrcLine(myLine) :
+    ''' Parses a line of a LRC file.
+        Returns a list of tuples (milliseconds, text, continues the line).
+        The list is empty, if the line doesn't start with a timestamp
+        (e.g. tags like [ar:Artist]).
+
+        [mm:ss.xx]text                one entry
+        [mm:ss.xx][mm:ss.xx]text      the same text at more than one time
+        [mm:ss.xx]~text               the text continues the last line
+        [mm:ss.xx]<mm:ss.xx>word <mm:ss.xx>word
+                                      enhanced LRC: an entry per word, the words
+                                      after the first one continue the line
+    '''
+    # The line timestamps at the beginning of the line
+    lineTimes = []
+    pos = 0
+    while True :
+        match = globLineTimestampPattern.match(myLine, pos)
+        if not match :
+            break
+        lineTimes.append(parseTimestamp(*match.groups()))
+        pos = match.end()
+    if not lineTimes :
+        return []
+    text = myLine[pos:]
+
+    continues = False
+    if text.startswith('~') :
+        # Our definition for the LRC file: First letter '~' indicates, that
+        # the letters following continue at the last line, but not at a new line.
+        continues = True
+        text = text[1:]
+
+    # Enhanced LRC: word timestamps <mm:ss.xx> within the text
+    parts = globWordTimestampPattern.split(text)
+    if len(parts) == 1 :
+        return [(ms, text, continues) for ms in lineTimes]
+
+    # parts: text before the first word timestamp, than 3 timestamp groups and a word, ...
+    entries = []
+    if parts[0].strip() :
+        entries.append((lineTimes[0], parts[0], continues))
+    for k in range(1, len(parts), 4) :
+        word = parts[k + 3]
+        if word :
+            entries.append((parseTimestamp(parts[k], parts[k + 1], parts[k + 2]), word, continues or len(entries) > 0))
+    return entries
+
+def makeFrameCoreBytes(myInputFileName, myLanguage, myContentDescription, myContentType) :
+    ''' Returns the SYLT frame data (without the frame header) from a LRC file.
+        The LRC file is read line by line, the entries are appended to a
+        bytearray, so the time needed grows linear with the file size.
+        The entries are sorted by time, if the file isn't (e.g. lines with
+        more than one timestamp).
+    '''
     # Start the bytes object with the first byte 03H - sets text encoding to UTF-8
-    frameBytes = b'\x03'
-    
+    frameBytes = bytearray(b'\x03')
+
     # Append language code, e.g. 'eng'
-    frameBytes = frameBytes + bytes(myLanguage, 'utf-8')
+    frameBytes += bytes(myLanguage, 'utf-8')
 
     # Append time format - always 02H for miliseconds
-    frameBytes = frameBytes + b'\x02'
-    
+    frameBytes += b'\x02'
+
     # Append content type - 00H for 'other' or 08H for 'image url'
-    frameBytes = frameBytes + myContentType
+    frameBytes += myContentType
 
     # Append content description
-    frameBytes = frameBytes + bytes(myContentDescription, 'utf-8') + b'\x00' 
+    frameBytes += bytes(myContentDescription, 'utf-8') + b'\x00'
+    headerSize = len(frameBytes)
 
-    # Append text bytes from file myInputFileName
-    '''
-    try :
-        with open(myImageFileName, "rb") as f:  # read in binary mode
-            bytesObject = f.read()
-            frameBytes = frameBytes + bytesObject
-    except FileNotFoundError :
-        print('writeTempFrameCore() FATAL ERROR on reading ' + myImageFileName)
-        exit(1) # Exit with error code 1
-    '''
-
-    # Read TXT file into array of strings (lines)
+    # Append every entry: text, 00H for "end of textpart", 4 bytes timestamp
+    entryStarts = []   # (milliseconds, start address of the entry)
+    inOrder = True
+    lastMs = -1
     with open(myInputFileName, "r", encoding="utf-8-sig") as file :   # "utf-8-sig" removes BOM
-        linesArray = file.readlines()
-
-    # append every line to the result bytes
-    for line in linesArray:
-        line = line.strip()
-
-        # if it is a correct LRC line only, it looks like [mm:ss.xx]
-        if len(line) >= 10 and line[0] == '[' and line[3] == ':' and line[9] == ']' :
-            min = int(line[1:3])
-            sek = int(line[4:6])
-            ms = int(line[7:9]) * 10
-            ms = (min * 60 + sek) * 1000 + ms
-            textpart = line[10:]
-            print(str(ms) + 'ms\t ' + textpart)  # Test
-            if textpart.startswith('~') :
-                # Our definition for the LRC file: First letter '~' indicates, that 
-                # the letters following continue at the last line, but not at a new line.
-                textpart = line[11:]
-                frameBytes = frameBytes + bytes(textpart, 'utf-8')
-            else :
-                # New text, that does not start with a space, must
-                # be text on a new line, rather a next word at a given line.
-                # So write a 0AH (newline) byte before the textpart
-                frameBytes = frameBytes + b'\x0a' + bytes(textpart, 'utf-8')
-            # Write 00H for "end of textpart"
-            frameBytes = frameBytes + b'\x00'
-            # Calculate the four bytes of the timestamp (in milliseconds) of this textpart
-            b0 = ms & 0b11111111
-            tmp = ms >> 8
-            b1 = tmp & 0b11111111
-            tmp = tmp >> 8
-            b2 = tmp & 0b11111111    
-            tmp = tmp >> 8
-            b3 = tmp & 0b11111111 
-            # Append the four bytes of the timestamp to the output bytes
-            frameBytes = frameBytes + bytes([b3]) + bytes([b2]) + bytes([b1]) + bytes([b0])
-    
-    ## Append the 00H byte at the end of the text
-    #frameBytes = frameBytes + b'\x00'
-    
+        for line in file :
+            for ms, textpart, continues in parseLrcLine(line.strip()) :
+                if ms < lastMs :
+                    inOrder = False
+                lastMs = ms
+                entryStarts.append((ms, len(frameBytes)))
+                if not continues :
+                    # New text, that does not continue the last line, must
+                    # be text on a new line, rather a next word at a given line.
+                    # So write a 0AH (newline) byte before the textpart
+                    frameBytes += b'\x0a'
+                frameBytes += bytes(textpart, 'utf-8')
+                frameBytes += b'\x00'
+                # Append the four bytes of the timestamp (in milliseconds) of this textpart
+                frameBytes += ms.to_bytes(4, 'big')
+
+    if not inOrder :
+        # Sort the entries by time (stable: equal times keep their order)
+        view = memoryview(frameBytes)
+        entryEnds = [start for ms, start in entryStarts[1:]] + [len(frameBytes)]
+        entries = sorted(zip(entryStarts, entryEnds), key=lambda entry: entry[0][0])
+        sortedBytes = bytearray(view[0:headerSize])
+        for (ms, start), end in entries :
+            sortedBytes += view[start:end]
+        view.release()
+        frameBytes = sortedBytes
+
+    maxMs = max([ms for ms, start in entryStarts], default=-1)   # the file may be out of order
+    print(str(len(entryStarts)) + ' entries, ' + str(maxMs) + 'ms last timestamp')
+
     # Return the result
     return frameBytes
 
 
-def writeFrame(myTargetFileName, myFrameCoreBytes, myFrameName) :
+def writeFrame(myTargetFileName, myFrameCoreBytes, myFrameName, myCompressThreshold=None) :
+    ''' Writes the frame header and myFrameCoreBytes into the file myTargetFileName.
+        myCompressThreshold: compress the frame data with zlib, if it has at
+        least this number of bytes (None: no compression)
+    '''
     # Get the frame data size
     myCoreSize = len(myFrameCoreBytes)
 
@@ -138,28 +199,30 @@ def writeFrame(myTargetFileName, myFrameCoreBytes, myFrameName) :
     # Append 2 flag bytes:    
     headerBytes = headerBytes + b'\x00\x00'
     
-    # Write the headerBytes data to destination file with "wb". Overides old file.
+    # Compress the frame (zlib), if it is large enough
+    frameBytes = headerBytes + bytes(myFrameCoreBytes)
+    if myCompressThreshold is not None :
+        frameBytes = compressFrame(frameBytes, myCompressThreshold)
+
+    # Write the frame to destination file with "wb". Overides old file.
     with open(myTargetFileName, "wb") as fileTarget:
-        fileTarget.write(headerBytes)
-        
-    # Append the myFrameCoreBytes
-    with open(myTargetFileName, "ab") as fileTarget:
-        fileTarget.write(myFrameCoreBytes)
+        fileTarget.write(frameBytes)
 
 
 # --- MAIN SCRIPT ---
-# Choose the SRT File
-srtFileName = selectImageFile("Choose the LRC file")
+if __name__ == "__main__" :
+    # Choose the SRT File
+    srtFileName = selectImageFile("Choose the LRC file")
 
-if srtFileName == "" :
-    print ("Nothing selected")    
-    exit(0) # Successful exit
+    if srtFileName == "" :
+        print ("Nothing selected")    
+        exit(0) # Successful exit
     
-# Make the SYLT frame core content bytes
-frameCoreBytes = makeFrameCoreBytes(srtFileName, globTargetLanguage, globTargetDescription, globContentType)
+    # Make the SYLT frame core content bytes
+    frameCoreBytes = makeFrameCoreBytes(srtFileName, globTargetLanguage, globTargetDescription, globContentType)
 
-# Store the USLT frame in BIN file
-writeFrame(globTargetFileName, frameCoreBytes, "SYLT")
+    # Store the USLT frame in BIN file
+    writeFrame(globTargetFileName, frameCoreBytes, "SYLT", globCompressThreshold)
 
-# Finish
-print("OK, ready: " + globTargetFileName)
\ No newline at end of file
+    # Finish
+    print("OK, ready: " + globTargetFileName)
\ No newline at end of file
@@ -16,8 +16,8 @@ Jens Grätzer
 '''
 
 from sys import exit
-from tkinter import *
-from tkinter.filedialog import askopenfilename
+
+from id3v2FrameCompression import compressFrame
 
 # --- SETTINGS ---
 # Prefix of frame bin files
@@ -26,6 +26,8 @@ globBinFilePrefix = "XXX_"  # files starting with this prefix will be deleted at
 globTargetFileName = "XXX_N999_XSRT.BIN"
 globTargetLanguage = 'eng'  # 3 characters, e.g. 'eng'
 globTargetDescription = ''  # Content description
+# Compress frames with at least this number of bytes (zlib), e.g. 1024. None: no compression
+globCompressThreshold = None
 
 # --- INTERNAL GLOBALS ---
 # none
@@ -34,7 +36,9 @@ globTargetDescription = ''  # Content description
 def selectImageFile(pickerTitle) :
     ''' Calls a file picker window, that asks for picking a SRT file
     '''
-    # Filepicker menue
+    # Filepicker menue (tkinter is imported here only, so importing this module is fast)
+    from tkinter import Tk
+    from tkinter.filedialog import askopenfilename
     root = Tk()
     myFilename =  askopenfilename(title = pickerTitle, filetypes = (("srt files",".srt"),("all files",".*")))
     root.withdraw()  # Close the Tk window
@@ -77,7 +81,11 @@ def makeFrameCoreBytes(mySrtFileName, myLanguage, myContentDescription) :
     return frameBytes
 
 
-def writeFrame(myTargetFileName, myFrameCoreBytes, myFrameName) :
+def writeFrame(myTargetFileName, myFrameCoreBytes, myFrameName, myCompressThreshold=None) :
+    ''' Writes the frame header and myFrameCoreBytes into the file myTargetFileName.
+        myCompressThreshold: compress the frame data with zlib, if it has at
+        least this number of bytes (None: no compression)
+    '''
     # Get the frame data size
     myCoreSize = len(myFrameCoreBytes)
 
@@ -104,28 +112,30 @@ def writeFrame(myTargetFileName, myFrameCoreBytes, myFrameName) :
     # Append 2 flag bytes:    
     headerBytes = headerBytes + b'\x00\x00'
     
-    # Write the headerBytes data to destination file with "wb". Overides old file.
+    # Compress the frame (zlib), if it is large enough
+    frameBytes = headerBytes + bytes(myFrameCoreBytes)
+    if myCompressThreshold is not None :
+        frameBytes = compressFrame(frameBytes, myCompressThreshold)
+
+    # Write the frame to destination file with "wb". Overides old file.
     with open(myTargetFileName, "wb") as fileTarget:
-        fileTarget.write(headerBytes)
-        
-    # Append the myFrameCoreBytes
-    with open(myTargetFileName, "ab") as fileTarget:
-        fileTarget.write(myFrameCoreBytes)
+        fileTarget.write(frameBytes)
 
 
 # --- MAIN SCRIPT ---
-# Choose the SRT File
-srtFileName = selectImageFile("Choose the SRT File")
+if __name__ == "__main__" :
+    # Choose the SRT File
+    srtFileName = selectImageFile("Choose the SRT File")
 
-if srtFileName == "" :
-    print ("Nothing selected")    
-    exit(0) # Successful exit
+    if srtFileName == "" :
+        print ("Nothing selected")    
+        exit(0) # Successful exit
     
-# Make the XSRT frame core content bytes
-frameCoreBytes = makeFrameCoreBytes(srtFileName, globTargetLanguage, globTargetDescription)
+    # Make the XSRT frame core content bytes
+    frameCoreBytes = makeFrameCoreBytes(srtFileName, globTargetLanguage, globTargetDescription)
 
-# Store the XSRT frame in BIN file
-writeFrame(globTargetFileName, frameCoreBytes, "XSRT")
+    # Store the XSRT frame in BIN file
+    writeFrame(globTargetFileName, frameCoreBytes, "XSRT", globCompressThreshold)
 
-# Finish
-print("OK, ready.")
+    # Finish
+    print("OK, ready.")
@@ -0,0 +1,282 @@
+'''
+ID3v2 Frame Model
+-----------------
+A parsed tag as a lightweight sequence of frame records.
+
+* Parsing a tag makes one small record per frame: name, offset, size, flags
+  (the frame bytes are not copied, they stay in the mapped file)
+* The typed value of a frame is decoded only, when frame.value is accessed,
+  and it is cached in the frame record
+* Typed values: text frames (T***), TXXX, COMM, USLT, SYLT, APIC, PRIV, CHAP.
+  Other frames have the payload (memoryview) as value.
+
+So reading TIT2 of a file with a 20 MB APIC frame touches the TIT2 bytes
+only. The APIC value holds a memoryview of the picture, not a copy.
+
+    with Id3v2TagModel("song.mp3") as tag :
+        title = tag.get("TIT2")
+        print(title.value if title else "no title")
+
+Values are memoryviews into the mapped file, use them before the tag is
+closed, or copy them with bytes().
+
+Usage as a script: python id3v2FrameModel.py FILE.mp3 [FRAME ...]
+Prints the decoded values of the frames (default: all frames).
+
+J. Grätzer
+'''
+
+import sys
+from collections import namedtuple
+
+from id3v2TagParser import Id3v2Tag, TagError, decodeFrameSize
+from id3v2Unsync import getFramePayload
+from id3v2LyricsDecoder import globTextEncodings, findTerminator, decodeText, decodeSylt
+
+
+# --- SETTINGS ---
+globNotDecoded = object()   # marks a value not decoded yet
+globHeadSize = 4096         # APIC, PRIV: bytes searched for the texts in front of the binary data
+
+# --- TYPES ---
+# Typed values of frames
+UserTextValue = namedtuple("UserTextValue", ["description", "text"])                        # TXXX
+CommentValue = namedtuple("CommentValue", ["language", "description", "text"])             # COMM, USLT
+PictureValue = namedtuple("PictureValue", ["mimeType", "pictureType", "description", "picture"])  # APIC
+PrivateValue = namedtuple("PrivateValue", ["owner", "data"])                               # PRIV
+ChapterValue = namedtuple("ChapterValue", ["elementId", "startTime", "endTime",
+                                           "startOffset", "endOffset", "subFrames"])        # CHAP
+
+# --- FUNCTIONS ---
+def splitText(myData, myEncoding) :
+    ''' Returns the strings of text data, separated by terminators
+        (ID3v2.4 text frames may have more than one value)
+    '''
+    terminator = globTextEncodings.get(myEncoding, globTextEncodings[0])[1]
+    strings = []
+    pos = 0
+    while pos < len(myData) :
+        end = findTerminator(myData, pos, terminator)
+        strings.append(decodeText(myData[pos:end], myEncoding))
+        pos = end + len(terminator)
+    return strings
+
+def readTerminatedText(myData, myStart, myEncoding) :
+    ''' Returns a tuple (text starting at myStart, address behind the terminator)
+    '''
+    terminator = globTextEncodings.get(myEncoding, globTextEncodings[0])[1]
+    end = findTerminator(myData, myStart, terminator)
+    return decodeText(myData[myStart:end], myEncoding), end + len(terminator)
+
+def decodeTextValue(myData) :
+    ''' T***: Returns the text, several values are joined by "/"
+    '''
+    return "/".join(splitText(myData[1:], myData[0]))
+
+def decodeUserTextValue(myData) :
+    ''' TXXX: Returns a UserTextValue
+    '''
+    description, pos = readTerminatedText(myData, 1, myData[0])
+    return UserTextValue(description, "/".join(splitText(myData[pos:], myData[0])))
+
+def decodeCommentValue(myData) :
+    ''' COMM, USLT: Returns a CommentValue
+    '''
+    description, pos = readTerminatedText(myData, 4, myData[0])
+    text = decodeText(myData[pos:], myData[0]).rstrip("\x00")
+    return CommentValue(bytes(myData[1:4]).decode("latin-1"), description, text)
+
+def decodePictureValue(myData) :
+    ''' APIC: Returns a PictureValue, the picture is a memoryview (no copy)
+    '''
+    head = bytes(myData[:globHeadSize])   # MIME type, picture type and description
+    while True :
+        mimeType, pos = readTerminatedText(head, 1, 0)   # the MIME type is always ISO-8859-1
+        pictureType = head[pos] if pos < len(head) else 0
+        description, pos = readTerminatedText(head, pos + 1, head[0])
+        if pos <= len(head) or len(head) == len(myData) :
+            break
+        head = bytes(myData)   # a very long description
+    return PictureValue(mimeType, pictureType, description, memoryview(myData)[pos:])
+
+def decodePrivateValue(myData) :
+    ''' PRIV: Returns a PrivateValue, the data is a memoryview (no copy)
+    '''
+    head = bytes(myData[:globHeadSize])
+    owner, pos = readTerminatedText(head, 0, 0)
+    if pos > len(head) and len(head) < len(myData) :
+        owner, pos = readTerminatedText(bytes(myData), 0, 0)   # a very long owner
+    return PrivateValue(owner, memoryview(myData)[pos:])
+
+def decodeChapterValue(myData, myId3Vers) :
+    ''' CHAP: Returns a ChapterValue, the embedded frames (e.g. TIT2) are Frame records
+    '''
+    elementId, pos = readTerminatedText(bytes(myData[:globHeadSize]), 0, 0)
+    times = [int.from_bytes(myData[pos + 4 * i:pos + 4 * i + 4], "big") for i in range(4)]
+    subFrames = []
+    view = memoryview(myData)
+    pos = pos + 16
+    while pos + 10 <= len(view) and view[pos] != 0x00 :
+        size = decodeFrameSize(view[pos + 4:pos + 8], myId3Vers)
+        if pos + 10 + size > len(view) :
+            raise TagError("frame in CHAP " + elementId + " exceeds the CHAP frame")
+        subFrames.append(Frame(view, myId3Vers, bytes(view[pos:pos + 4]).decode("latin-1"),
+                               pos, size, (view[pos + 8] << 8) | view[pos + 9]))
+        pos = pos + 10 + size
+    return ChapterValue(elementId, times[0], times[1], times[2], times[3], subFrames)
+
+def decodeValue(myFrameName, myData, myId3Vers) :
+    ''' Returns the typed value of the frame data myData,
+        or myData itself for frames without a typed value
+    '''
+    if len(myData) == 0 :
+        return myData
+    if myFrameName == "TXXX" :
+        return decodeUserTextValue(bytes(myData))
+    elif myFrameName[0] == "T" :
+        return decodeTextValue(bytes(myData))
+    elif myFrameName == "COMM" or myFrameName == "USLT" :
+        return decodeCommentValue(bytes(myData))
+    elif myFrameName == "SYLT" :
+        return decodeSylt(bytes(myData))   # a LyricsIndex, see id3v2LyricsDecoder.py
+    elif myFrameName == "APIC" :
+        return decodePictureValue(myData)
+    elif myFrameName == "PRIV" :
+        return decodePrivateValue(myData)
+    elif myFrameName == "CHAP" :
+        return decodeChapterValue(myData, myId3Vers)
+    return myData
+
+
+# --- CLASSES ---
+class Frame :
+    ''' Record of one frame: name, offset, size (without the 10 header bytes)
+        and flags. The value is decoded on the first access and cached.
+    '''
+    __slots__ = ("frameName", "offset", "size", "flags", "_buffer", "_version", "_value")
+
+    def __init__(self, myBuffer, myId3Vers, myFrameName, myOffset, mySize, myFlags) :
+        self.frameName = myFrameName
+        self.offset = myOffset
+        self.size = mySize
+        self.flags = myFlags
+        self._buffer = myBuffer
+        self._version = myId3Vers
+        self._value = globNotDecoded
+
+    def __repr__(self) :
+        return "Frame(" + self.frameName + " at " + hex(self.offset) + ", size " + str(self.size) + ")"
+
+    @property
+    def raw(self) :
+        ''' The complete frame (header and data) as memoryview
+        '''
+        return self._buffer[self.offset:self.offset + 10 + self.size]
+
+    @property
+    def payload(self) :
+        ''' The frame data without the header, with the frame unsynchronisation removed
+        '''
+        return getFramePayload(self.raw, self._version)
+
+    @property
+    def value(self) :
+        ''' The typed value, decoded on the first access
+        '''
+        if self._value is globNotDecoded :
+            self._value = decodeValue(self.frameName, self.payload, self._version)
+        return self._value
+
+
+class Id3v2TagModel :
+    ''' The frames of a MP3 file's tag as a sequence of Frame records.
+        Use it in a with statement, the file stays mapped until the end of it.
+    '''
+
+    def __init__(self, myfile) :
+        self.tag = Id3v2Tag(myfile)
+        self.header = self.tag.header
+        self.frames = []
+        try :
+            for frame in self.tag.frames() :
+                self.frames.append(Frame(self.tag.tagView, self.header.version, frame.frameName,
+                                         frame.offset, frame.size, frame.flags))
+                frame.frame.release()
+        except BaseException :
+            self.tag.close()
+            raise
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, excType, excValue, traceback) :
+        self.close()
+
+    def close(self) :
+        self.frames = []
+        self.tag.close()
+
+    def __len__(self) :
+        return len(self.frames)
+
+    def __getitem__(self, myIndex) :
+        return self.frames[myIndex]
+
+    def __iter__(self) :
+        return iter(self.frames)
+
+    def get(self, myFrameName) :
+        ''' Returns the first frame named myFrameName, or None
+        '''
+        for frame in self.frames :
+            if frame.frameName == myFrameName :
+                return frame
+        return None
+
+    def getAll(self, myFrameName) :
+        ''' Returns all frames named myFrameName
+        '''
+        return [frame for frame in self.frames if frame.frameName == myFrameName]
+
+
+def loadFrameFile(myFileName, myId3Vers=4) :
+    ''' Returns a Frame record of a .bin frame file (e.g. XXX_N001_TIT2.bin)
+    '''
+    with open(myFileName, "rb") as f :  # read in binary mode
+        data = f.read()
+    if len(data) < 10 :
+        raise TagError("the frame file is too short: " + myFileName)
+    return Frame(memoryview(data), myId3Vers, data[0:4].decode("latin-1"), 0,
+                 decodeFrameSize(data[4:8], myId3Vers), (data[8] << 8) | data[9])
+
+def formatValue(myValue) :
+    ''' Returns a short text of a frame value for the console
+    '''
+    if isinstance(myValue, PictureValue) :
+        return myValue.mimeType + ", type " + str(myValue.pictureType) + ", " + repr(myValue.description) + ", " + str(len(myValue.picture)) + " bytes"
+    if isinstance(myValue, PrivateValue) :
+        return myValue.owner + ", " + str(len(myValue.data)) + " bytes"
+    if isinstance(myValue, ChapterValue) :
+        return (myValue.elementId + ", " + str(myValue.startTime) + "-" + str(myValue.endTime) + " ms, "
+                + ", ".join(frame.frameName + "=" + formatValue(frame.value) for frame in myValue.subFrames))
+    if isinstance(myValue, memoryview) :
+        return str(len(myValue)) + " bytes"
+    if hasattr(myValue, "timeUnit") :   # SYLT, see id3v2LyricsDecoder.py
+        return str(len(myValue)) + " entries, time unit " + myValue.timeUnit
+    text = str(myValue)
+    return text if len(text) <= 70 else text[:67] + "..."
+
+
+# --- MAIN SCRIPT ---
+if __name__ == "__main__" :
+    if len(sys.argv) < 2 :
+        print("Usage: python id3v2FrameModel.py FILE.mp3 [FRAME ...]")
+        sys.exit(1)
+    try :
+        with Id3v2TagModel(sys.argv[1]) as tag :
+            for frame in tag :
+                if len(sys.argv) == 2 or frame.frameName in sys.argv[2:] :
+                    print(frame.frameName + ": " + formatValue(frame.value))
+    except (OSError, TagError, ValueError, IndexError) as e :
+        print("ERROR: " + str(e))
+        sys.exit(1)
@@ -0,0 +1,208 @@
+'''
+ID3v2 Frame Pack
+----------------
+One pack file per MP3 file instead of one .bin file per frame.
+
+With hundreds of thousands of MP3 files the .bin frames files XXX_N*.bin
+are millions of tiny files. A pack file XXX_frames.pack holds the same:
+the tag header, an index of the frames and the frames, so it is read with
+one open, and a frame is found by its offset in the index.
+
+Layout of a pack file (integers big endian):
+* 8 bytes "ID3PACK" and the pack version 01H
+* 10 bytes: the ID3v2 tag header of the MP3 file (like XXX_header.bin)
+* 4 bytes: number of frames
+* the index, 12 bytes per frame: frame name (4 bytes), offset (4 bytes,
+  from the start of the pack file), size of the frame (4 bytes, header and data)
+* the frames (header and data, like the .bin frames files), in tag order
+  and without gaps, so all frames are copied by a single copy
+
+id3v2TagExtractor.py --pack writes pack files, id3v2TagReassembler.py --pack
+and id3v2TagFramesSizeCheck.py --pack read them.
+
+Usage:
+  python id3v2FramePack.py pack [DIR] [--delete]   # XXX_header.bin, XXX_N*.bin -> XXX_frames.pack
+  python id3v2FramePack.py unpack [DIR]            # XXX_frames.pack -> XXX_header.bin, XXX_N*.bin
+  python id3v2FramePack.py list PACKFILE
+
+J. Grätzer
+'''
+
+from sys import exit
+import os
+import glob
+import struct
+import argparse
+from collections import namedtuple
+
+from id3v2TagParser import TagError, parseTagHeader
+
+
+# --- SETTINGS ---
+globBinFilePrefix = "XXX_"
+globFrameFilePrefix = globBinFilePrefix + "N"  # "XXX_N"
+globHeaderFilename = globBinFilePrefix + "header.bin"
+globPackFilename = globBinFilePrefix + "frames.pack"
+
+globPackMagic = b"ID3PACK\x01"      # "ID3PACK", pack version 1
+globPackHead = struct.Struct(">8s10sI")   # magic, tag header, number of frames
+globPackEntry = struct.Struct(">4sII")    # frame name, offset, size
+
+# --- TYPES ---
+# A frame of the index: offset and size (header and data) within the pack file
+PackEntry = namedtuple("PackEntry", ["frameName", "offset", "size"])
+
+# --- FUNCTIONS ---
+def writePack(myPackFileName, myHeaderBytes, myFrames) :
+    ''' Writes a pack file. myHeaderBytes is the ID3v2 tag header (10 bytes),
+        myFrames is a list of frames (bytes, header and data) in tag order.
+        Returns the number of bytes written.
+    '''
+    offset = globPackHead.size + globPackEntry.size * len(myFrames)
+    index = []
+    for frame in myFrames :
+        index.append(globPackEntry.pack(bytes(frame[0:4]), offset, len(frame)))
+        offset = offset + len(frame)
+    with open(myPackFileName, "wb") as f :
+        f.write(globPackHead.pack(globPackMagic, bytes(myHeaderBytes[0:10]), len(myFrames)))
+        f.write(b"".join(index))
+        for frame in myFrames :
+            f.write(frame)
+    return offset
+
+
+class FramePack :
+    ''' A pack file, opened for reading. The head and the index are read
+        by the constructor, the frames are read on demand.
+        Use it in a with statement:
+
+            with FramePack("XXX_frames.pack") as pack :
+                for entry in pack.entries :
+                    print(entry.frameName, entry.size)
+    '''
+
+    def __init__(self, myPackFileName) :
+        self.fileName = myPackFileName
+        self.file = open(myPackFileName, "rb", buffering=0)
+        try :
+            head = self.file.read(globPackHead.size)
+            if len(head) < globPackHead.size or head[0:7] != globPackMagic[0:7] :
+                raise TagError("this is no pack file: " + myPackFileName)
+            if head[7:8] != globPackMagic[7:8] :
+                raise TagError("unknown pack version " + str(head[7]) + ": " + myPackFileName)
+            magic, self.headerBytes, count = globPackHead.unpack(head)
+            self.header = parseTagHeader(self.headerBytes)
+            index = self.file.read(globPackEntry.size * count)
+            if len(index) < globPackEntry.size * count :
+                raise TagError("the index exceeds the pack file: " + myPackFileName)
+            self.entries = [PackEntry(name.decode("latin-1"), offset, size)
+                            for name, offset, size in globPackEntry.iter_unpack(index)]
+            # The frames follow the index without gaps
+            self.framesStart = globPackHead.size + len(index)
+            self.framesSize = 0
+            for entry in self.entries :
+                if entry.offset != self.framesStart + self.framesSize :
+                    raise TagError("frame " + entry.frameName + " is not in place: " + myPackFileName)
+                self.framesSize = self.framesSize + entry.size
+        except BaseException :
+            self.file.close()
+            raise
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, excType, excValue, traceback) :
+        self.close()
+
+    def close(self) :
+        self.file.close()
+
+    def __len__(self) :
+        return len(self.entries)
+
+    def find(self, myFrameName) :
+        ''' Returns the entries of the frames named myFrameName
+        '''
+        return [entry for entry in self.entries if entry.frameName == myFrameName]
+
+    def readFrame(self, myEntry) :
+        ''' Returns the frame (header and data) of the index entry myEntry
+        '''
+        self.file.seek(myEntry.offset)
+        frame = self.file.read(myEntry.size)
+        if len(frame) < myEntry.size :
+            raise TagError("frame " + myEntry.frameName + " exceeds the pack file: " + self.fileName)
+        return frame
+
+    def readFrames(self) :
+        ''' Returns all frames (a list of bytes), read at once
+        '''
+        self.file.seek(self.framesStart)
+        data = self.file.read(self.framesSize)
+        if len(data) < self.framesSize :
+            raise TagError("the frames exceed the pack file: " + self.fileName)
+        return [data[entry.offset - self.framesStart:entry.offset - self.framesStart + entry.size]
+                for entry in self.entries]
+
+
+def packFrameFiles(myDir=".", myDelete=False) :
+    ''' Writes the pack file of the .bin files XXX_header.bin and XXX_N*.bin
+        of the directory myDir. myDelete: delete the .bin files afterwards.
+        Returns the number of frames packed.
+    '''
+    with open(os.path.join(myDir, globHeaderFilename), "rb") as f :  # read in binary mode
+        headerBytes = f.read(10)
+    fileList = glob.glob(os.path.join(glob.escape(myDir), globFrameFilePrefix + "*.bin"))
+    fileList.sort(reverse=False)  # make sure the list is sorted
+    frames = []
+    for filePath in fileList :
+        with open(filePath, "rb") as f :
+            frames.append(f.read())
+    writePack(os.path.join(myDir, globPackFilename), headerBytes, frames)
+    if myDelete :
+        for filePath in fileList + [os.path.join(myDir, globHeaderFilename)] :
+            os.remove(filePath)
+    return len(frames)
+
+def unpackFrameFiles(myDir=".") :
+    ''' Writes the .bin files XXX_header.bin and XXX_N*.bin of the pack file
+        of the directory myDir, e.g. for editing frames with a hex editor.
+        Returns the number of frames unpacked.
+    '''
+    with FramePack(os.path.join(myDir, globPackFilename)) as pack :
+        with open(os.path.join(myDir, globHeaderFilename), "wb") as f :
+            f.write(pack.headerBytes)
+        for i, frame in enumerate(pack.readFrames()) :
+            fileName = globFrameFilePrefix + "{0:03d}".format(i + 1) + "_" + pack.entries[i].frameName + ".bin"
+            with open(os.path.join(myDir, fileName), "wb") as f :
+                f.write(frame)
+        return len(pack)
+
+
+# --- MAIN SCRIPT ---
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description="Converts the .bin frames files into a pack file and back.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    cmdPack = commands.add_parser("pack", help="write " + globPackFilename + " from the .bin files")
+    cmdPack.add_argument("dir", nargs="?", default=".")
+    cmdPack.add_argument("--delete", action="store_true", help="delete the .bin files afterwards")
+    cmdUnpack = commands.add_parser("unpack", help="write the .bin files from " + globPackFilename)
+    cmdUnpack.add_argument("dir", nargs="?", default=".")
+    cmdList = commands.add_parser("list", help="print the index of a pack file")
+    cmdList.add_argument("pack")
+    args = parser.parse_args()
+
+    try :
+        if args.command == "pack" :
+            print("OK, " + str(packFrameFiles(args.dir, args.delete)) + " frames packed.")
+        elif args.command == "unpack" :
+            print("OK, " + str(unpackFrameFiles(args.dir)) + " frames unpacked.")
+        else :
+            with FramePack(args.pack) as pack :
+                print("ID3v2." + str(pack.header.version) + "." + str(pack.header.revision)
+                      + ", " + str(len(pack)) + " frames, " + str(pack.framesSize) + " bytes")
+                for entry in pack.entries :
+                    print("  " + entry.frameName + " at " + hex(entry.offset) + ", size " + str(entry.size))
+    except (OSError, TagError) as e :
+        print("ERROR: " + str(e))
+        exit(1) # Exit with error code 1
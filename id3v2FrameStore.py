@@ -0,0 +1,183 @@
+'''
+ID3v2 Frame Store
+-----------------
+Extracts the frames of MP3 files into a content-addressed store.
+Equal frames, e.g. the same APIC cover picture in every track of an album,
+are stored only once.
+
+Layout of the store directory:
+* STORE/objects/ab/cdef...      # a frame (header and data), the filename is
+                                # the SHA-256 hash of the frame bytes
+* STORE/manifests/album/track01.json
+                                # one manifest per MP3 file: the tag header,
+                                # the hashes of the frames (in tag order)
+                                # and where the pure audio data is found
+
+Existing objects are not written again, so the extraction of unchanged
+frames is a no-op. id3v2TagReassembler.py --manifest rebuilds a MP3 file
+from a manifest.
+
+Usage:
+  python id3v2FrameStore.py store STORE PATH [PATH ...]   # MP3 files or directories
+  python id3v2FrameStore.py stats STORE
+
+J. Grätzer
+'''
+
+from sys import exit
+import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from id3v2TagParser import Id3v2Tag, TagError, writeFileAtomic
+from id3v2TagExtractor import findMp3Files
+
+
+# --- SETTINGS ---
+globObjectsDirName = "objects"
+globManifestsDirName = "manifests"
+globManifestVersion = 1
+
+# --- FUNCTIONS ---
+def getObjectPath(myStoreDir, myDigest) :
+    ''' Returns the filename of the object with the hash myDigest (hex string)
+    '''
+    return os.path.join(myStoreDir, globObjectsDirName, myDigest[0:2], myDigest[2:])
+
+def findStoreDir(myManifestFileName) :
+    ''' Returns the store directory of a manifest file: the directory
+        above the manifests directory, that contains the manifest.
+    '''
+    path = os.path.dirname(os.path.abspath(myManifestFileName))
+    while True :
+        if os.path.basename(path) == globManifestsDirName :
+            return os.path.dirname(path)
+        parent = os.path.dirname(path)
+        if parent == path :
+            raise ValueError("the manifest is not inside a " + globManifestsDirName + " directory: " + myManifestFileName)
+        path = parent
+
+def storeObject(myStoreDir, myData) :
+    ''' Stores myData (bytes or memoryview) as an object, if it is not stored yet.
+        Returns a tuple (hash as hex string, True if the object was new).
+    '''
+    digest = hashlib.sha256(myData).hexdigest()
+    objectPath = getObjectPath(myStoreDir, digest)
+    if os.path.exists(objectPath) :
+        return digest, False
+    writeFileAtomic(objectPath, myData)
+    return digest, True
+
+def storeFile(myfile, myStoreDir, myManifestName) :
+    ''' Stores the frames of a MP3 file and writes its manifest
+        STORE/manifests/<myManifestName>.json
+        Returns a tuple (myfile, ok, message, number of frames, number of new objects).
+    '''
+    try :
+        st = os.stat(myfile)
+        frames = []
+        newObjects = 0
+        with Id3v2Tag(myfile) as tag :
+            for frame in tag.frames() :
+                digest, isNew = storeObject(myStoreDir, frame.frame)
+                if isNew :
+                    newObjects = newObjects + 1
+                frames.append({"frameName": frame.frameName, "sha256": digest, "size": len(frame.frame)})
+                frame.frame.release()
+            manifest = {
+                "manifestVersion": globManifestVersion,
+                "source": os.path.abspath(myfile),
+                "sourceSize": st.st_size,
+                "sourceMtimeNs": st.st_mtime_ns,
+                "header": bytes(tag.view[0:10]).hex(),
+                "frames": frames,
+                "audioStart": tag.audioStart(),
+                "audioEnd": tag.audioEnd(),
+            }
+    except (OSError, TagError) as e :
+        return myfile, False, "ERROR: " + str(e), 0, 0
+
+    # Write the manifest only, if it has changed
+    manifestPath = os.path.join(myStoreDir, globManifestsDirName, myManifestName + ".json")
+    manifestBytes = json.dumps(manifest, indent=1).encode("utf-8")
+    try :
+        with open(manifestPath, "rb") as f :
+            unchanged = f.read() == manifestBytes
+    except FileNotFoundError :
+        unchanged = False
+    if not unchanged :
+        writeFileAtomic(manifestPath, manifestBytes)
+    return myfile, True, "OK", len(frames), newObjects
+
+def storeFiles(myPaths, myStoreDir, myJobs=None) :
+    ''' Stores all MP3 files found in myPaths (files or directories)
+        using a pool of worker processes. Returns the number of files failed.
+    '''
+    failed = 0
+    framesCount = 0
+    newObjectsCount = 0
+    mp3Files = findMp3Files(myPaths)
+    with ProcessPoolExecutor(max_workers=myJobs) as pool :
+        futures = [pool.submit(storeFile, fileName, myStoreDir, relName) for fileName, relName in mp3Files]
+        for future in as_completed(futures) :
+            fileName, ok, message, frameCount, newObjects = future.result()
+            if ok :
+                framesCount = framesCount + frameCount
+                newObjectsCount = newObjectsCount + newObjects
+            else :
+                failed = failed + 1
+                print("FAILED " + fileName + " ... " + message)
+    print("OK, " + str(len(mp3Files) - failed) + " files stored, " + str(framesCount) + " frames, "
+          + str(newObjectsCount) + " new objects, " + str(failed) + " failed.")
+    return failed
+
+def readManifest(myManifestFileName) :
+    ''' Reads a manifest file, returns it as a dict
+    '''
+    with open(myManifestFileName, "r", encoding="utf-8") as f :
+        manifest = json.load(f)
+    if manifest.get("manifestVersion") != globManifestVersion :
+        raise ValueError("unknown manifest version in " + myManifestFileName)
+    return manifest
+
+def printStoreStats(myStoreDir) :
+    ''' Prints the size of the frames referenced by all manifests
+        and the size of the objects really stored.
+    '''
+    referencedBytes = 0
+    manifestCount = 0
+    for dirPath, dirNames, fileNames in os.walk(os.path.join(myStoreDir, globManifestsDirName)) :
+        for fileName in fileNames :
+            if fileName.endswith(".json") :
+                manifestCount = manifestCount + 1
+                for frame in readManifest(os.path.join(dirPath, fileName))["frames"] :
+                    referencedBytes = referencedBytes + frame["size"]
+    storedBytes = 0
+    objectCount = 0
+    for dirPath, dirNames, fileNames in os.walk(os.path.join(myStoreDir, globObjectsDirName)) :
+        for fileName in fileNames :
+            objectCount = objectCount + 1
+            storedBytes = storedBytes + os.path.getsize(os.path.join(dirPath, fileName))
+    print("Manifests: " + str(manifestCount) + ", objects: " + str(objectCount))
+    print("Frames referenced: " + str(referencedBytes) + " bytes, stored: " + str(storedBytes) + " bytes")
+    if storedBytes > 0 :
+        print("Deduplication ratio: {0:.1f}".format(referencedBytes / storedBytes))
+
+
+# --- MAIN SCRIPT ---
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description="Content-addressed store of ID3v2 frames.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    cmdStore = commands.add_parser("store", help="store the frames of MP3 files")
+    cmdStore.add_argument("store")
+    cmdStore.add_argument("paths", nargs="+", metavar="PATH", help="MP3 file or directory")
+    cmdStore.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: CPUs)")
+    cmdStats = commands.add_parser("stats", help="print the deduplication statistics of a store")
+    cmdStats.add_argument("store")
+    args = parser.parse_args()
+
+    if args.command == "store" :
+        exit(1 if storeFiles(args.paths, args.store, args.jobs) > 0 else 0)
+    printStoreStats(args.store)
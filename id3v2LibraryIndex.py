@@ -0,0 +1,300 @@
+'''
+ID3v2 Library Index
+-------------------
+Builds and queries a SQLite database of the ID3v2 tags of a MP3 library.
+
+* Walks a library directory recursively and finds all *.mp3 files
+* Records for every file: tag version, flags, tag size, padding size, and
+  for every frame: name, position, offset, size and flags
+* Updates incrementally: files with unchanged size and modification time
+  are skipped, files removed from the library are removed from the index
+* The changed files are parsed by a pool of worker processes
+* Finds files with the same audio data, but different tags: the hash of
+  the audio data only (without the ID3v2 tag and the blocks at the end
+  of the file) is stored in the index, it is computed again only for
+  changed files
+
+Usage:
+  python id3v2LibraryIndex.py index LIBRARY        # build or update the index
+  python id3v2LibraryIndex.py with APIC --min-size 500000
+  python id3v2LibraryIndex.py without USLT
+  python id3v2LibraryIndex.py sql "SELECT path FROM files WHERE version = 3"
+  python id3v2LibraryIndex.py duplicates LIBRARY   # update the index, print groups of equal audio
+The queries print one filename per line, e.g. as input of
+id3v2TagExtractor.py batch mode.
+
+Option --db FILE selects the database (default: id3v2index.sqlite).
+
+J. Grätzer
+'''
+
+from sys import exit
+import os
+import mmap
+import hashlib
+import argparse
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+from id3v2TagParser import probeTag, TagError, Id3v2Tag, findTrailingTags
+
+
+# --- SETTINGS ---
+globDatabaseFilename = "id3v2index.sqlite"
+globChunkSize = 64   # files per task of a worker process
+globHashBlockSize = 8 * 1024 * 1024   # bytes per update of the audio hash
+
+globSchema = '''
+CREATE TABLE IF NOT EXISTS files (
+    id          INTEGER PRIMARY KEY,
+    path        TEXT UNIQUE NOT NULL,
+    fileSize    INTEGER NOT NULL,
+    mtimeNs     INTEGER NOT NULL,
+    version     INTEGER,            -- 3 or 4, NULL if there is no valid tag
+    revision    INTEGER,
+    flags       INTEGER,            -- byte 5 of the tag header
+    tagSize     INTEGER,            -- including the header and the footer
+    paddingSize INTEGER,
+    error       TEXT,               -- why the tag could not be parsed
+    audioHash   TEXT                -- SHA-256 of the audio data, NULL if not computed yet
+);
+CREATE TABLE IF NOT EXISTS frames (
+    fileId      INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    position    INTEGER NOT NULL,   -- 1 for the first frame, like XXX_N001_*.bin
+    frameName   TEXT NOT NULL,
+    offset      INTEGER NOT NULL,   -- address of the frame header in the file (also for unsynchronised tags)
+    size        INTEGER NOT NULL,   -- frame size without the 10 header bytes (ID3v2.3 unsync: decoded size)
+    flags       INTEGER NOT NULL,   -- the two flag bytes
+    PRIMARY KEY (fileId, position)
+);
+CREATE INDEX IF NOT EXISTS framesByName ON frames (frameName, size);
+CREATE INDEX IF NOT EXISTS filesByAudioHash ON files (audioHash);
+'''
+
+# --- FUNCTIONS ---
+def openDatabase(myDatabaseFilename=globDatabaseFilename) :
+    ''' Opens (and creates, if needed) the index database
+    '''
+    db = sqlite3.connect(myDatabaseFilename)
+    db.execute("PRAGMA foreign_keys = ON")
+    db.execute("PRAGMA journal_mode = WAL")
+    # Databases of older versions have no column audioHash
+    if db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'files'").fetchone() :
+        if "audioHash" not in [row[1] for row in db.execute("PRAGMA table_info(files)")] :
+            db.execute("ALTER TABLE files ADD COLUMN audioHash TEXT")
+    db.executescript(globSchema)
+    return db
+
+def scanLibrary(myLibraryDir) :
+    ''' Walks myLibraryDir recursively.
+        Returns a dict: filename -> (file size, modification time in ns) of all *.mp3 files.
+    '''
+    found = {}
+    for dirPath, dirNames, fileNames in os.walk(myLibraryDir) :
+        for fileName in fileNames :
+            if fileName.lower().endswith(".mp3") :
+                fullName = os.path.abspath(os.path.join(dirPath, fileName))
+                try :
+                    st = os.stat(fullName)
+                except OSError :
+                    continue  # removed while walking
+                found[fullName] = (st.st_size, st.st_mtime_ns)
+    return found
+
+def parseFile(myfile) :
+    ''' Worker: parses the tag of a file.
+        Returns a tuple (tag values or None, list of frame tuples, error message or None).
+    '''
+    try :
+        probe = probeTag(myfile)   # reads the frame headers only, not the frame data
+        h = probe.header
+        return (h.version, h.revision, h.flags, h.bruttoSize, probe.paddingSize), probe.frames, None
+    except (OSError, TagError) as e :
+        return None, [], str(e)
+
+def parseFiles(myFileList) :
+    ''' Worker: parses a chunk of files, returns a list of parseFile() results
+    '''
+    return [parseFile(fileName) for fileName in myFileList]
+
+def updateIndex(db, myLibraryDir, myJobs=None) :
+    ''' Brings the index up to date with the files of myLibraryDir.
+        Returns a tuple (number of files parsed, skipped, removed).
+    '''
+    found = scanLibrary(myLibraryDir)
+    root = os.path.join(os.path.abspath(myLibraryDir), "")
+
+    # Compare with the index: which files are new or changed, which are gone?
+    known = {}
+    for fileId, path, fileSize, mtimeNs in db.execute(
+            "SELECT id, path, fileSize, mtimeNs FROM files WHERE substr(path, 1, ?) = ?", (len(root), root)) :
+        known[path] = (fileId, fileSize, mtimeNs)
+    changed = sorted(path for path, stat in found.items()
+                     if path not in known or known[path][1:] != stat)
+    removed = [known[path][0] for path in known if path not in found]
+
+    # Parse the changed files in parallel, in chunks of globChunkSize files
+    chunks = [changed[i:i + globChunkSize] for i in range(0, len(changed), globChunkSize)]
+    with db :
+        db.executemany("DELETE FROM files WHERE id = ?", [(fileId,) for fileId in removed])
+        if chunks :
+            with ProcessPoolExecutor(max_workers=myJobs) as pool :
+                for chunk, results in zip(chunks, pool.map(parseFiles, chunks)) :
+                    for path, (tagValues, frames, error) in zip(chunk, results) :
+                        storeFile(db, path, found[path], tagValues, frames, error)
+    return len(changed), len(found) - len(changed), len(removed)
+
+def storeFile(db, myPath, myStat, myTagValues, myFrames, myError) :
+    ''' Replaces the index entries of a single file
+    '''
+    db.execute("DELETE FROM files WHERE path = ?", (myPath,))
+    if myTagValues is None :
+        myTagValues = (None, None, None, None, None)
+    cursor = db.execute("INSERT INTO files (path, fileSize, mtimeNs, version, revision, flags, tagSize, paddingSize, error) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (myPath,) + tuple(myStat) + tuple(myTagValues) + (myError,))
+    fileId = cursor.lastrowid
+    db.executemany("INSERT INTO frames (fileId, position, frameName, offset, size, flags) VALUES (?, ?, ?, ?, ?, ?)",
+                   [(fileId, position) + frame for position, frame in enumerate(myFrames, 1)])
+
+def hashAudio(myfile) :
+    ''' Worker: returns the SHA-256 hash (hex) of the audio data of a file:
+        from the end of the ID3v2 tag to the first block at the end of the file
+        (appended tag, Lyrics3, ID3v1). Returns None, if the file can't be read.
+        If the tag header is valid, but a frame is not, the audio starts behind
+        the tag all the same, only the SEEK frame is not used.
+    '''
+    try :
+        try :
+            tag = Id3v2Tag(myfile)
+        except TagError :
+            tag = None  # no valid ID3v2 tag: the audio starts at the beginning of the file
+        if tag is not None :
+            with tag :
+                audioStart = tag.header.bruttoSize
+                try :
+                    audioEnd = tag.audioEnd()
+                except TagError :
+                    # A broken frame (e.g. while looking for the SEEK frame)
+                    audioEnd = findTrailingTags(tag.view, audioStart).audioEnd
+                return hashBuffer(tag.view, audioStart, audioEnd)
+        with open(myfile, "rb") as f :
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer :
+                view = memoryview(buffer)
+                try :
+                    return hashBuffer(view, 0, findTrailingTags(view).audioEnd)
+                finally :
+                    view.release()
+    except (OSError, ValueError) :
+        return None   # ValueError: mmap of an empty file
+
+def hashBuffer(myBuffer, myStart, myEnd) :
+    ''' Returns the SHA-256 hash (hex) of myBuffer[myStart:myEnd], hashed in
+        blocks of globHashBlockSize bytes (no copies of the mapped file)
+    '''
+    digest = hashlib.sha256()
+    for pos in range(myStart, myEnd, globHashBlockSize) :
+        block = myBuffer[pos:min(pos + globHashBlockSize, myEnd)]
+        digest.update(block)
+        block.release()
+    return digest.hexdigest()
+
+def hashAudioFiles(myFileList) :
+    ''' Worker: hashes a chunk of files, returns a list of hashAudio() results
+    '''
+    return [hashAudio(fileName) for fileName in myFileList]
+
+def updateAudioHashes(db, myLibraryDir, myJobs=None) :
+    ''' Computes the missing audio hashes of the files of myLibraryDir.
+        (The hash of a changed file is missing, because updateIndex()
+        replaced its entry.) Returns the number of files hashed.
+    '''
+    root = os.path.join(os.path.abspath(myLibraryDir), "")
+    rows = db.execute("SELECT id, path FROM files WHERE audioHash IS NULL AND substr(path, 1, ?) = ?",
+                      (len(root), root)).fetchall()
+    chunks = [rows[i:i + globChunkSize] for i in range(0, len(rows), globChunkSize)]
+    if chunks :
+        with db :
+            with ProcessPoolExecutor(max_workers=myJobs) as pool :
+                for chunk, digests in zip(chunks, pool.map(hashAudioFiles, [[path for fileId, path in chunk] for chunk in chunks])) :
+                    db.executemany("UPDATE files SET audioHash = ? WHERE id = ?",
+                                   [(digest, fileId) for (fileId, path), digest in zip(chunk, digests)])
+    return len(rows)
+
+def findDuplicateAudio(db, myLibraryDir) :
+    ''' Returns the groups of files of myLibraryDir with the same audio data
+        (a list of lists of filenames)
+    '''
+    root = os.path.join(os.path.abspath(myLibraryDir), "")
+    groups = {}
+    for audioHash, path in db.execute(
+            "SELECT audioHash, path FROM files WHERE audioHash IN "
+            "(SELECT audioHash FROM files WHERE audioHash IS NOT NULL AND substr(path, 1, ?) = ? "
+            "GROUP BY audioHash HAVING count(*) > 1) AND substr(path, 1, ?) = ? ORDER BY audioHash, path",
+            (len(root), root, len(root), root)) :
+        groups.setdefault(audioHash, []).append(path)
+    return list(groups.values())
+
+def findFilesWithFrame(db, myFrameName, myMinSize=0) :
+    ''' Returns the files having a frame myFrameName with at least myMinSize bytes
+    '''
+    return [row[0] for row in db.execute(
+        "SELECT DISTINCT files.path FROM frames JOIN files ON files.id = frames.fileId "
+        "WHERE frames.frameName = ? AND frames.size >= ? ORDER BY files.path", (myFrameName, myMinSize))]
+
+def findFilesWithoutFrame(db, myFrameName) :
+    ''' Returns the files having no frame myFrameName (including files without a tag)
+    '''
+    return [row[0] for row in db.execute(
+        "SELECT path FROM files WHERE NOT EXISTS "
+        "(SELECT 1 FROM frames WHERE frames.fileId = files.id AND frames.frameName = ?) ORDER BY path", (myFrameName,))]
+
+
+# --- MAIN SCRIPT ---
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description="SQLite index of the ID3v2 tags of a MP3 library.")
+    parser.add_argument("--db", default=globDatabaseFilename, help="database file (default: " + globDatabaseFilename + ")")
+    commands = parser.add_subparsers(dest="command", required=True)
+    cmdIndex = commands.add_parser("index", help="build or update the index of a library directory")
+    cmdIndex.add_argument("library")
+    cmdIndex.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: CPUs)")
+    cmdWith = commands.add_parser("with", help="files having a frame")
+    cmdWith.add_argument("frameName")
+    cmdWith.add_argument("--min-size", type=int, default=0, dest="minSize", help="minimum frame size in bytes")
+    cmdWithout = commands.add_parser("without", help="files lacking a frame")
+    cmdWithout.add_argument("frameName")
+    cmdSql = commands.add_parser("sql", help="any SQL query on the tables files and frames")
+    cmdSql.add_argument("query")
+    cmdDuplicates = commands.add_parser("duplicates", help="update the index, print groups of files with equal audio data")
+    cmdDuplicates.add_argument("library")
+    cmdDuplicates.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: CPUs)")
+    args = parser.parse_args()
+
+    database = openDatabase(args.db)
+    try :
+        if args.command == "index" :
+            parsedCount, skippedCount, removedCount = updateIndex(database, args.library, args.jobs)
+            print("OK, " + str(parsedCount) + " files parsed, " + str(skippedCount) + " unchanged, "
+                  + str(removedCount) + " removed.")
+        elif args.command == "with" :
+            for path in findFilesWithFrame(database, args.frameName, args.minSize) :
+                print(path)
+        elif args.command == "duplicates" :
+            updateIndex(database, args.library, args.jobs)
+            hashedCount = updateAudioHashes(database, args.library, args.jobs)
+            duplicateGroups = findDuplicateAudio(database, args.library)
+            for group in duplicateGroups :
+                for path in group :
+                    print(path)
+                print("")
+            print("OK, " + str(hashedCount) + " files hashed, " + str(len(duplicateGroups)) + " groups of files with equal audio.")
+        elif args.command == "without" :
+            for path in findFilesWithoutFrame(database, args.frameName) :
+                print(path)
+        else :
+            for row in database.execute(args.query) :
+                print("\t".join(str(value) for value in row))
+    except sqlite3.Error as e :
+        print("ERROR: " + str(e))
+        exit(1) # Exit with error code 1
+    finally :
+        database.close()
@@ -0,0 +1,235 @@
+'''
+ID3v2 Lyrics Decoder: SYLT and XSRT
+-----------------------------------
+Reads back the synchronised lyrics of a SYLT frame (id3v2FrameCreator_SYLT.py)
+or the SRT subtitles of the experimental XSRT frame (id3v2FrameCreator_XSRT.py).
+
+The frame is read from a .bin frame file, e.g. XXX_N999_SYLT.BIN, or
+directly from the tag of a MP3 file. It is decoded once into a compact
+timestamp index: sorted arrays of the start times (and end times), and all
+texts in a single string with an array of offsets. So the questions
+"which lyric is active at t ms" and "all entries from t1 to t2 ms"
+are answered by a binary search, without scanning the frame again.
+
+Usage:
+  python id3v2LyricsDecoder.py FILE [--at MS] [--from MS --to MS]
+FILE is a .bin frame file or a MP3 file (first SYLT, else first XSRT frame).
+
+J. Grätzer
+'''
+
+from sys import exit
+import re
+import argparse
+from array import array
+from bisect import bisect_left, bisect_right
+
+from id3v2TagParser import Id3v2Tag, TagError
+from id3v2Unsync import getFramePayload
+
+
+# --- SETTINGS ---
+# Text encodings of ID3v2 frames: (codec, terminator)
+globTextEncodings = {0: ("latin-1", b'\x00'), 1: ("utf-16", b'\x00\x00'),
+                     2: ("utf-16-be", b'\x00\x00'), 3: ("utf-8", b'\x00')}
+# SRT time line: 00:00:01,000 --> 00:00:04,000
+globSrtTimePattern = re.compile(r"(\d+):(\d{2}):(\d{2})[,.](\d{3})\s*-->\s*(\d+):(\d{2}):(\d{2})[,.](\d{3})")
+
+# --- FUNCTIONS ---
+def findTerminator(myData, myStart, myTerminator) :
+    ''' Returns the address of the terminator (00H, or 00H 00H at an even
+        distance from myStart for UTF-16) behind myStart, or len(myData).
+    '''
+    pos = myData.find(myTerminator, myStart)
+    while len(myTerminator) == 2 and pos >= 0 and (pos - myStart) % 2 == 1 :
+        pos = myData.find(myTerminator, pos + 1)
+    return len(myData) if pos < 0 else pos
+
+def decodeText(myData, myEncoding) :
+    ''' Decodes text bytes of a frame with the ID3v2 text encoding byte myEncoding
+    '''
+    codec = globTextEncodings.get(myEncoding, globTextEncodings[0])[0]
+    return bytes(myData).decode(codec, errors="replace")
+
+
+class LyricsIndex :
+    ''' Timestamp index of decoded lyrics or subtitles.
+        times: array of the start times, ends: array of the end times
+        (SRT) or None (SYLT: an entry is active until the next one starts).
+        timeUnit is "ms", or "frames" for SYLT timestamps in MPEG frames.
+    '''
+    __slots__ = ("frameName", "language", "description", "timeUnit", "times", "ends", "textOffsets", "textPool")
+
+    def __init__(self, myFrameName, myLanguage, myDescription, myTimeUnit, myEntries, myHasEnds) :
+        ''' myEntries: list of tuples (start, end, text), sorted here by start
+        '''
+        self.frameName = myFrameName
+        self.language = myLanguage
+        self.description = myDescription
+        self.timeUnit = myTimeUnit
+        myEntries.sort(key=lambda entry: entry[0])
+        self.times = array("L", [entry[0] for entry in myEntries])
+        self.ends = array("L", [entry[1] for entry in myEntries]) if myHasEnds else None
+        texts = [entry[2] for entry in myEntries]
+        self.textOffsets = array("L", [0])
+        for text in texts :
+            self.textOffsets.append(self.textOffsets[-1] + len(text))
+        self.textPool = "".join(texts)
+
+    def __len__(self) :
+        return len(self.times)
+
+    def text(self, myIndex) :
+        ''' Returns the text of entry myIndex
+        '''
+        return self.textPool[self.textOffsets[myIndex]:self.textOffsets[myIndex + 1]]
+
+    def entry(self, myIndex) :
+        ''' Returns entry myIndex as tuple (start, end or None, text)
+        '''
+        end = self.ends[myIndex] if self.ends is not None else None
+        return self.times[myIndex], end, self.text(myIndex)
+
+    def activeIndexAt(self, myTime) :
+        ''' Returns the index of the entry active at myTime, or -1
+        '''
+        i = bisect_right(self.times, myTime) - 1
+        if i < 0 :
+            return -1
+        if self.ends is not None and myTime >= self.ends[i] :
+            return -1  # between two subtitles
+        return i
+
+    def activeAt(self, myTime) :
+        ''' Returns the entry active at myTime as tuple (start, end, text), or None
+        '''
+        i = self.activeIndexAt(myTime)
+        return self.entry(i) if i >= 0 else None
+
+    def between(self, myFromTime, myToTime) :
+        ''' Returns the entries starting from myFromTime to myToTime (both included)
+        '''
+        return [self.entry(i) for i in range(bisect_left(self.times, myFromTime), bisect_right(self.times, myToTime))]
+
+
+def decodeSylt(myData) :
+    ''' Decodes the data of a SYLT frame (without the frame header).
+        Returns a LyricsIndex.
+    '''
+    encoding = myData[0]
+    codec, terminator = globTextEncodings.get(encoding, globTextEncodings[0])
+    language = bytes(myData[1:4]).decode("latin-1")
+    timeUnit = "frames" if myData[4] == 1 else "ms"   # 01H: MPEG frames, 02H: milliseconds
+    end = findTerminator(myData, 6, terminator)
+    description = decodeText(myData[6:end], encoding)
+
+    entries = []
+    pos = end + len(terminator)
+    while pos < len(myData) :
+        end = findTerminator(myData, pos, terminator)
+        if end + len(terminator) + 4 > len(myData) :
+            break  # no complete timestamp behind the text
+        timeAddress = end + len(terminator)
+        entries.append((int.from_bytes(myData[timeAddress:timeAddress + 4], "big"), 0,
+                        decodeText(myData[pos:end], encoding)))
+        pos = timeAddress + 4
+    return LyricsIndex("SYLT", language, description, timeUnit, entries, False)
+
+def decodeXsrt(myData) :
+    ''' Decodes the data of a XSRT frame (like USLT: encoding, language,
+        description, than the text of a SRT file). Returns a LyricsIndex.
+    '''
+    encoding = myData[0]
+    codec, terminator = globTextEncodings.get(encoding, globTextEncodings[0])
+    language = bytes(myData[1:4]).decode("latin-1")
+    end = findTerminator(myData, 4, terminator)
+    description = decodeText(myData[4:end], encoding)
+    textStart = end + len(terminator)
+    srtText = decodeText(myData[textStart:findTerminator(myData, textStart, terminator)], encoding)
+
+    entries = []
+    for block in re.split(r"\n\s*\n", srtText.replace("\r\n", "\n")) :
+        lines = block.strip().split("\n")
+        for k, line in enumerate(lines) :
+            match = globSrtTimePattern.search(line)
+            if match :
+                v = [int(x) for x in match.groups()]
+                start = ((v[0] * 60 + v[1]) * 60 + v[2]) * 1000 + v[3]
+                stop = ((v[4] * 60 + v[5]) * 60 + v[6]) * 1000 + v[7]
+                entries.append((start, stop, "\n".join(lines[k + 1:])))
+                break
+    return LyricsIndex("XSRT", language, description, "ms", entries, True)
+
+def decodeFrame(myFrame, myId3Vers=4) :
+    ''' Decodes a complete SYLT or XSRT frame (header and data). Returns a LyricsIndex.
+    '''
+    frameName = bytes(myFrame[0:4]).decode("latin-1")
+    data = getFramePayload(myFrame, myId3Vers)
+    if frameName == "SYLT" :
+        return decodeSylt(data)
+    if frameName == "XSRT" :
+        return decodeXsrt(data)
+    raise ValueError("not a SYLT or XSRT frame: " + frameName)
+
+def loadFromBinFile(myFileName) :
+    ''' Decodes the frame of a .bin frame file. Returns a LyricsIndex.
+    '''
+    with open(myFileName, "rb") as f :  # read in binary mode
+        return decodeFrame(f.read())
+
+def loadFromMp3(myfile, myFrameNames=("SYLT", "XSRT")) :
+    ''' Decodes the first frame of the MP3 file, named like the first name
+        of myFrameNames found. Returns a LyricsIndex, or None.
+    '''
+    with Id3v2Tag(myfile) as tag :
+        found = {}
+        for frame in tag.frames() :
+            if frame.frameName in myFrameNames and frame.frameName not in found :
+                found[frame.frameName] = bytes(frame.frame)
+            frame.frame.release()
+        for frameName in myFrameNames :
+            if frameName in found :
+                return decodeFrame(found[frameName], tag.header.version)
+    return None
+
+def formatEntry(myEntry) :
+    ''' Formats an entry (start, end, text) for the console
+    '''
+    start, end, text = myEntry
+    times = str(start) if end is None else str(start) + "-" + str(end)
+    return times + "\t" + text.strip().replace("\n", " / ")
+
+
+# --- MAIN SCRIPT ---
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description="Decodes SYLT and XSRT frames.")
+    parser.add_argument("file", help=".bin frame file or MP3 file")
+    parser.add_argument("--at", type=int, default=None, help="print the entry active at this time")
+    parser.add_argument("--from", type=int, default=None, dest="fromTime", help="print the entries from this time")
+    parser.add_argument("--to", type=int, default=None, dest="toTime", help="... to this time")
+    args = parser.parse_args()
+
+    try :
+        if args.file.lower().endswith(".mp3") :
+            lyrics = loadFromMp3(args.file)
+        else :
+            lyrics = loadFromBinFile(args.file)
+    except (OSError, TagError, ValueError) as e :
+        print("ERROR: " + str(e))
+        exit(1) # Exit with error code 1
+    if lyrics is None :
+        print("There is no SYLT or XSRT frame.")
+        exit(1) # Exit with error code 1
+
+    print(lyrics.frameName + ", language " + lyrics.language + ", " + str(len(lyrics)) + " entries, time unit " + lyrics.timeUnit)
+    if args.at is not None :
+        entry = lyrics.activeAt(args.at)
+        print(formatEntry(entry) if entry else "Nothing active at " + str(args.at))
+    elif args.fromTime is not None or args.toTime is not None :
+        fromTime = args.fromTime if args.fromTime is not None else 0
+        toTime = args.toTime if args.toTime is not None else 0xFFFFFFFF
+        for entry in lyrics.between(fromTime, toTime) :
+            print(formatEntry(entry))
+    else :
+        for i in range(len(lyrics)) :
+            print(formatEntry(lyrics.entry(i)))
@@ -0,0 +1,222 @@
+'''
+ID3v2 Metrics
+-------------
+Lightweight instrumentation of the stages of the scripts: wall time,
+bytes read and written, file opens and frames, per stage and per run.
+
+* A function becomes a stage by the decorator @timedStage, a block of code
+  by "with stage(name) :". The seconds of a stage include the stages called
+  inside of it. The counters are added to the innermost stage running.
+* The metrics are off by default. Then a stage costs one test of a global
+  variable, count() costs one function call, nothing is recorded.
+* The metrics of a run are written as JSON, and as a Prometheus textfile
+  (e.g. for the textfile collector of the node exporter).
+
+id3v2TagExtractor.py and id3v2TagReassembler.py have the options
+--metrics FILE.json and --metrics-prom FILE.prom:
+
+    python id3v2TagExtractor.py -o OUTDIR --metrics run.json --metrics-prom id3v2.prom /path/to/library
+
+J. Grätzer
+'''
+
+import json
+import time
+import functools
+import contextlib
+
+from id3v2TagParser import writeFileAtomic
+
+
+# --- SETTINGS ---
+globCounterNames = ("bytesRead", "bytesWritten", "opens", "frames")
+globOtherStageName = "other"   # counters outside of any stage
+globPrometheusPrefix = "id3v2_"
+
+# --- INTERNAL GLOBALS ---
+# The Metrics of the run, None: the metrics are off
+globMetrics = None
+globNullStage = contextlib.nullcontext()
+
+# --- CLASSES ---
+class StageCounters :
+    ''' The values of one stage: calls, seconds and the counters
+    '''
+    __slots__ = ("calls", "seconds") + globCounterNames
+
+    def __init__(self) :
+        self.calls = 0
+        self.seconds = 0.0
+        for name in globCounterNames :
+            setattr(self, name, 0)
+
+    def asDict(self) :
+        values = {"calls": self.calls, "seconds": self.seconds}
+        for name in globCounterNames :
+            values[name] = getattr(self, name)
+        return values
+
+
+class Metrics :
+    ''' The metrics of a run of a script
+    '''
+
+    def __init__(self, myScriptName) :
+        self.scriptName = myScriptName
+        self.startTime = time.time()
+        self.startCounter = time.perf_counter()
+        self.stages = {}
+        self.running = []   # names of the stages running, the innermost last
+
+    def getStage(self, myStageName) :
+        stage = self.stages.get(myStageName)
+        if stage is None :
+            stage = self.stages[myStageName] = StageCounters()
+        return stage
+
+    def begin(self, myStageName) :
+        ''' Starts a stage. Returns the start time for end().
+        '''
+        self.running.append(myStageName)
+        return time.perf_counter()
+
+    def end(self, myStartTime) :
+        ''' Ends the innermost stage running
+        '''
+        stage = self.getStage(self.running.pop())
+        stage.calls = stage.calls + 1
+        stage.seconds = stage.seconds + time.perf_counter() - myStartTime
+
+    def add(self, myCounterName, myValue) :
+        ''' Adds myValue to a counter of the innermost stage running
+        '''
+        stage = self.getStage(self.running[-1] if self.running else globOtherStageName)
+        setattr(stage, myCounterName, getattr(stage, myCounterName) + myValue)
+
+    def merge(self, mySnapshot) :
+        ''' Adds the stages of a snapshot(), e.g. of a worker process
+        '''
+        for stageName, values in mySnapshot["stages"].items() :
+            stage = self.getStage(stageName)
+            for name, value in values.items() :
+                setattr(stage, name, getattr(stage, name) + value)
+
+    def snapshot(self) :
+        ''' Returns the metrics as a dict (JSON)
+        '''
+        stages = {name: stage.asDict() for name, stage in sorted(self.stages.items())}
+        totals = {name: sum(stage[name] for stage in stages.values()) for name in globCounterNames}
+        return {"script": self.scriptName, "start": self.startTime,
+                "seconds": time.perf_counter() - self.startCounter,
+                "totals": totals, "stages": stages}
+
+
+# --- FUNCTIONS ---
+def enableMetrics(myScriptName) :
+    ''' Turns the metrics on, for a new run of the script myScriptName
+    '''
+    global globMetrics
+    globMetrics = Metrics(myScriptName)
+    return globMetrics
+
+def disableMetrics() :
+    ''' Turns the metrics off. Returns the snapshot() of the run, or None.
+    '''
+    global globMetrics
+    snapshot = globMetrics.snapshot() if globMetrics is not None else None
+    globMetrics = None
+    return snapshot
+
+def timedStage(myStageName=None) :
+    ''' Decorator: every call of the function is a stage, named myStageName
+        or like the function
+    '''
+    def decorate(myFunction) :
+        stageName = myStageName or myFunction.__name__
+
+        @functools.wraps(myFunction)
+        def wrapper(*args, **kwargs) :
+            metrics = globMetrics
+            if metrics is None :
+                return myFunction(*args, **kwargs)
+            startTime = metrics.begin(stageName)
+            try :
+                return myFunction(*args, **kwargs)
+            finally :
+                metrics.end(startTime)
+        return wrapper
+    return decorate
+
+class _Stage :
+    ''' Context manager of stage()
+    '''
+    __slots__ = ("metrics", "stageName", "startTime")
+
+    def __init__(self, myMetrics, myStageName) :
+        self.metrics = myMetrics
+        self.stageName = myStageName
+
+    def __enter__(self) :
+        self.startTime = self.metrics.begin(self.stageName)
+        return self
+
+    def __exit__(self, excType, excValue, traceback) :
+        self.metrics.end(self.startTime)
+
+def stage(myStageName) :
+    ''' Returns a context manager: the block of the with statement is a stage
+    '''
+    if globMetrics is None :
+        return globNullStage
+    return _Stage(globMetrics, myStageName)
+
+def count(myCounterName, myValue=1) :
+    ''' Adds myValue to a counter (bytesRead, bytesWritten, opens, frames)
+        of the innermost stage running
+    '''
+    if globMetrics is not None :
+        globMetrics.add(myCounterName, myValue)
+
+def mergeMetrics(mySnapshot) :
+    ''' Adds a snapshot of a worker process to the metrics of this run
+    '''
+    if globMetrics is not None and mySnapshot is not None :
+        globMetrics.merge(mySnapshot)
+
+def formatPrometheus(mySnapshot) :
+    ''' Returns a snapshot in the Prometheus text format
+    '''
+    script = mySnapshot["script"].replace("\\", "\\\\").replace('"', '\\"')
+    lines = []
+
+    def addMetric(myName, myHelp, mySamples) :
+        name = globPrometheusPrefix + myName
+        lines.append("# HELP " + name + " " + myHelp)
+        lines.append("# TYPE " + name + " gauge")
+        for labels, value in mySamples :
+            lines.append(name + "{script=\"" + script + "\"" + labels + "} " + repr(value))
+
+    addMetric("run_seconds", "Wall time of the last run", [("", mySnapshot["seconds"])])
+    addMetric("run_start_timestamp_seconds", "Start of the last run (Unix time)", [("", mySnapshot["start"])])
+    for counterName, metricName, helpText in (
+            ("calls", "stage_calls", "Calls of the stage in the last run"),
+            ("seconds", "stage_seconds", "Wall time of the stage in the last run, including inner stages"),
+            ("bytesRead", "stage_read_bytes", "Bytes read by the stage in the last run"),
+            ("bytesWritten", "stage_written_bytes", "Bytes written by the stage in the last run"),
+            ("opens", "stage_opens", "Files opened by the stage in the last run"),
+            ("frames", "stage_frames", "Frames handled by the stage in the last run")) :
+        addMetric(metricName, helpText, [(",stage=\"" + stageName + "\"", values[counterName])
+                                        for stageName, values in mySnapshot["stages"].items()])
+    return "\n".join(lines) + "\n"
+
+def writeMetrics(myJsonFileName=None, myPrometheusFileName=None) :
+    ''' Writes the metrics of this run as JSON and/or as Prometheus textfile.
+        The files are written atomically, so a collector never reads a half-written file.
+    '''
+    if globMetrics is None :
+        return
+    snapshot = globMetrics.snapshot()
+    if myJsonFileName :
+        writeFileAtomic(myJsonFileName, (json.dumps(snapshot, indent=1) + "\n").encode("utf-8"))
+    if myPrometheusFileName :
+        writeFileAtomic(myPrometheusFileName, formatPrometheus(snapshot).encode("utf-8"))
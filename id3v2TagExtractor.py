@@ -5,18 +5,45 @@ ID3v2 Tag Extractor
 * Reads the MP3 file selected. Makes shure, that it contains a ID3v2.3 or ID3v2.4 tag.
 * Deletes all older files XXX_*.*
 * Writes the pure audio data (without ID3v2 tag) into file XXX_audio.mp3
-* Writes the ID3v2 header into file XXX_header.bin
+  (without appended tags, Lyrics3 and ID3v1 at the end of the file, too)
+* Writes the ID3v2 header into file XXX_header.bin (ID3v2.3: without the
+  unsynchronisation flag, the frames are written decoded)
 * Writes every ID3v2 frame into an own file,
   e.g. file XXX_01_TIT2.bin (01 is the position of the frame within the tag)
 
+Batch mode (no file picker):
+  python id3v2TagExtractor.py [-o OUTDIR] [-j JOBS] [--decompress] [--pack] [--metrics FILE.json] PATH [PATH ...]
+* PATH is a MP3 file or a directory, directories are searched recursively
+* The files are processed in parallel by a pool of worker processes
+* Every MP3 file gets its own output directory below OUTDIR,
+  e.g. OUTDIR/album/track01/XXX_N001_TIT2.bin for PATH/album/track01.mp3
+* Prints success or failure per file, and files/s and MB/s at the end
+* --decompress writes compressed frames (zlib) decompressed, else the
+  frames are written as they are
+* --pack writes one pack file XXX_frames.pack (header, index and frames,
+  see id3v2FramePack.py) instead of XXX_header.bin and the XXX_N*.bin files
+* --metrics FILE.json and --metrics-prom FILE.prom write the time, bytes,
+  file opens and frames of every stage (see id3v2Metrics.py)
+
 J. Grätzer, 2020-06-07
 '''
 
 from sys import exit
 import os
 import glob
-from tkinter import *
-from tkinter.filedialog import askopenfilename
+import io
+import time
+import atexit
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from id3v2Unsync import decodeTagUnsync
+from id3v2TagParser import Id3v2Tag, TagError, parseTagHeader, getFirstFrameAddress
+from id3v2FrameCompression import isCompressed, decompressFrame
+from id3v2FramePack import writePack
+import id3v2Metrics
+from id3v2Metrics import timedStage, stage, count
 
 # --- SETTINGS ---
 # Prefix of frame bin files
@@ -25,6 +52,8 @@ globBinFilePrefix = "XXX_"
 # --- INTERNAL GLOBALS ---
 # Frame counter
 globFrameCounter = 0
+# Frames collected for the pack file (--pack), None: write .bin files
+globPackFrames = None
 
 # --- FUNCTIONS ---
 def deleteFiles(myFileWildcard) :
@@ -50,13 +79,16 @@ def readSomeBytesFromFile(myfile, myN):
     try :
         with open(myfile, "rb") as f:  # read in binary mode
             bytesObject = f.read(myN)
+        count("opens")
+        count("bytesRead", len(bytesObject))
     except FileNotFoundError :
         print('ERROR: File does not exist')
         exit(0) # Successful exit
     #print("TEST: data type of bytesObject is: " + str(type(bytesObject)))
     return bytesObject
     
-def processFirst10Bytes(myfile) :
+@timedStage()
+def processFirst10Bytes(myfile, myBinFilePrefix=globBinFilePrefix, myWriteHeaderFile=True) :
     ''' Reads first 10 Bytes of a mp3 file, analyses ID3 tag header,
         returns bruttoSize, flagUnsync, flagExtendedHeader, flagFooter
     '''
@@ -92,7 +124,8 @@ def processFirst10Bytes(myfile) :
         exit(0) # Successful exit
         
     # Write a bin file of the header bytes
-    saveBytesInARange(bytesRead, 0, 9, globBinFilePrefix + "header.bin")
+    if myWriteHeaderFile :
+        saveBytesInARange(bytesRead, 0, 9, myBinFilePrefix + "header.bin")
     
     # Read the flags in byte 5 (starting with 0)
     # Bitwise Operators see: https://wiki.python.org/moin/BitwiseOperators
@@ -142,6 +175,7 @@ def processFirst10Bytes(myfile) :
 
     return myBruttoSize, myFlagUnsync, myFlagExtendedHeader, myFlagFooter, myId3Vers
 
+@timedStage()
 def readFullTag(myfile, myBruttoSize) :
     ''' Reads myBruttoSize bytes of a file,
         returns the number of bytes read.
@@ -150,27 +184,20 @@ def readFullTag(myfile, myBruttoSize) :
     bytesRead = readSomeBytesFromFile(myfile, myBruttoSize)
     return bytesRead
 
-def processExtendedHeader(myFullTag, myId3Vers) :
+def processExtendedHeader(myFullTag) :
     ''' Reads and analyses the extended header of an ID3 tag,
         returns the adress after that header
     '''
-    # Since the function is called, is assumed, the extended header exists:     
-    # Read the tag size in bytes 10 to 13 (starting with 0) of the tag.
-    # (Synchsave integers - see https://stackoverrun.com/de/q/1272468)
-    digitVal = 128  # Jede Stelle der Größe ist 128 wert - in ID3v2.4 Tag (synchsave)
-    if myId3Vers == 3 :
-        digitVal = 256  # Jede Stelle der Größe ist 256 wert - in ID3v2.3 Tag (nicht synchsave)
-    mySize = int(myFullTag[10])
-    mySize = mySize * digitVal + int(myFullTag[11])
-    mySize = mySize * digitVal + int(myFullTag[12])    
-    mySize = mySize * digitVal + int(myFullTag[13])
-    
-    print("OK, the extended header size is: " + str(mySize))
-    myNextDataByte = mySize + 10
+    # Since the function is called, is assumed, the extended header exists.
+    # ID3v2.3 and ID3v2.4 count the size of the extended header differently,
+    # see getFirstFrameAddress() in id3v2TagParser.py
+    myNextDataByte = getFirstFrameAddress(myFullTag, parseTagHeader(myFullTag[0:10]))
+    print("OK, the extended header size is: " + str(myNextDataByte - 10))
     # In this function there is no processing of the extended header data.
     # Instead, only the next data byte adress is returned.
     return myNextDataByte
 
+@timedStage()
 def processAFrame(myFullTag, sa, myFlagUnsync, myId3Vers) :
     ''' Reads and analyses the follwoing (at start adress sa) ID3 tag,
         returns the framename and the adress after that frame
@@ -195,6 +222,8 @@ def processAFrame(myFullTag, sa, myFlagUnsync, myId3Vers) :
     mySize = s + 10    # Adding the size of the frame header
     myFlag1 = myFullTag[sa + 8]  # Flag für status messages
     myFlag2 = myFullTag[sa + 9]
+    if isCompressed(myFullTag[sa:sa + 10], myId3Vers) :
+        print("   Compressed frame (zlib), flags " + "{0:02x}{1:02x}".format(myFlag1, myFlag2))
     
     myNextDataByte = sa + mySize
     print("   Next adress is " + str(myNextDataByte) + " = " + hex(myNextDataByte))
@@ -204,7 +233,9 @@ def processAFrame(myFullTag, sa, myFlagUnsync, myId3Vers) :
 def selectMp3File() :
     ''' Calls a file picker window, that asks for picking a MP3 file
     '''
-    # Filepicker menue
+    # Filepicker menue (tkinter is imported here only, so importing this module is fast)
+    from tkinter import Tk
+    from tkinter.filedialog import askopenfilename
     root = Tk()
     myFilename =  askopenfilename(title = "choose your file", filetypes = (("mp3 audio files","*.mp3"),("all files","*.*")))
     root.withdraw()  # Close the Tk window
@@ -219,9 +250,14 @@ def saveBytesInARange(myFullTag, myStartAdress, myLastAdress, myFileName) :
     with open(myFileName, "wb") as f:
         byteArray = myFullTag[myStartAdress:myLastAdress + 1]
         f.write(byteArray)
+    count("opens")
+    count("bytesWritten", len(byteArray))
 
-def exportFrame(myFullTag, myFrameName, myStartByteAddress, myLastByteAddress) :
-    ''' Check the different Frames
+@timedStage()
+def exportFrame(myFullTag, myFrameName, myStartByteAddress, myLastByteAddress, myBinFilePrefix=globBinFilePrefix,
+                myDecompress=False, myId3Vers=4) :
+    ''' Check the different Frames.
+        myDecompress: write compressed frames decompressed (see id3v2FrameCompression.py)
     '''
     if myStartByteAddress >= myLastByteAddress :
         print("   There is no next frame at " + hex(myStartByteAddress))
@@ -229,68 +265,269 @@ def exportFrame(myFullTag, myFrameName, myStartByteAddress, myLastByteAddress) :
 
     global globFrameCounter
     globFrameCounter = globFrameCounter + 1
+    count("frames")
     
     # Write the frame bytes into a bin file, e.g. XXX_N001_TIT2.bin
-    targetFileName = globBinFilePrefix + "N{0:03d}".format(globFrameCounter) + "_" + myFrameName + ".bin"
-    saveBytesInARange(myFullTag, myStartByteAddress, myLastByteAddress, targetFileName)
+    targetFileName = myBinFilePrefix + "N{0:03d}".format(globFrameCounter) + "_" + myFrameName + ".bin"
+    if myDecompress and isCompressed(myFullTag[myStartByteAddress:myStartByteAddress + 10], myId3Vers) :
+        frame = decompressFrame(myFullTag[myStartByteAddress:myLastByteAddress + 1], myId3Vers)
+        print("   Decompressed to " + str(len(frame)) + " bytes")
+    else :
+        frame = myFullTag[myStartByteAddress:myLastByteAddress + 1]
+    if globPackFrames is not None :
+        globPackFrames.append(frame)   # written by extractFile() into the pack file
+        return
+    saveBytesInARange(frame, 0, len(frame) - 1, targetFileName)
 
-def exportPureAudioStartingAt(myfile, myStartAdress) :
+@timedStage()
+def exportPureAudioStartingAt(myfile, myStartAdress, myBinFilePrefix=globBinFilePrefix, myEndAdress=None) :
+    ''' Writes the pure audio from myStartAdress to myEndAdress (excluded;
+        None: to the end of the file) into the file XXX_audio.mp3
+    '''
     print("Write pure audio to file starting at " + hex(myStartAdress))
     
-    targetFileName = globBinFilePrefix + "audio.mp3"
+    targetFileName = myBinFilePrefix + "audio.mp3"
     with open(targetFileName, "wb") as fTarget:
         # Because the original file may not exist - use try!
         try :
             with open(myfile, "rb") as f:  # read in binary mode
                 f.seek(myStartAdress)
-                while True:
-                    buf = f.read(1024)
+                remaining = -1 if myEndAdress is None else myEndAdress - myStartAdress
+                copied = 0
+                while remaining != 0:
+                    buf = f.read(1024 if remaining < 0 else min(1024, remaining))
                     if buf :
                         # n = fTarget.write(buf)
                         fTarget.write(buf)
+                        copied = copied + len(buf)
+                        if remaining > 0 :
+                            remaining = remaining - len(buf)
                     else:
                         break
+            count("opens", 2)
+            count("bytesRead", copied)
+            count("bytesWritten", copied)
 
         except FileNotFoundError :
             print('ERROR: File does not exist' + myfile)
             exit(1)  # exit with errorcode
-   
+
+@timedStage()
+def findAudioEnd(myfile) :
+    ''' Returns the address behind the pure audio data: in front of tags
+        appended to the file, Lyrics3 and ID3v1 (see id3v2TagParser.py).
+        Returns None, if the end of the audio data is the end of the file.
+    '''
+    try :
+        with Id3v2Tag(myfile) as tag :
+            count("opens")   # only, if the file could be opened
+            trailing = tag.trailingTags()
+    except (OSError, TagError) :
+        return None
+    for offset, header in trailing.appendedTags :
+        print("   Appended ID3v2." + str(header.version) + " tag at " + hex(offset) + " (not exported)")
+    if trailing.lyrics3Offset is not None :
+        print("   Lyrics3 at " + hex(trailing.lyrics3Offset) + " (not exported)")
+    if trailing.id3v1Offset is not None :
+        print("   ID3v1 at " + hex(trailing.id3v1Offset) + " (not exported)")
+    return trailing.audioEnd
+
+@timedStage()
+def extractFile(myfile, myBinFilePrefix=globBinFilePrefix, myDecompress=False, myPack=False) :
+    ''' Exports the header, all frames and the pure audio of a MP3 file
+        into files starting with myBinFilePrefix, e.g. "out/track01/XXX_".
+        myDecompress: write compressed frames decompressed.
+        myPack: write the header and the frames into one pack file XXX_frames.pack
+        Returns the number of frames exported.
+    '''
+    global globFrameCounter, globPackFrames
+    globFrameCounter = 0  # The frame numbers start at N001 for every file
+    globPackFrames = [] if myPack else None
+
+    # Analysing this MP3 file
+    print ("Analysing " + myfile)
+    print("Start reading first 10 bytes of the tag")
+    bruttoSize, flagUnsync, flagExtendedHeader, flagFooter, tagVers = processFirst10Bytes(myfile, myBinFilePrefix, not myPack)
+    print("Start reading all frames of the ID3v2 tag. Start from " + str(bruttoSize) + " = " + hex(bruttoSize))
+    fullTag = readFullTag(myfile, bruttoSize)
+    headerBytes = fullTag[0:10]
+    if flagUnsync and tagVers == 3 :
+        # ID3v2.3: the whole tag is unsynchronised, the frame sizes fit to the decoded tag
+        fullTag = decodeTagUnsync(fullTag)
+        tagEnd = len(fullTag)
+        print("OK, unsynchronisation removed, the decoded tag ends at " + hex(tagEnd))
+        # The frames exported are decoded, so the header must not tell the unsynchronisation
+        headerBytes = headerBytes[0:5] + bytes([headerBytes[5] & 0b01111111]) + headerBytes[6:10]
+        if not myPack :
+            saveBytesInARange(headerBytes, 0, 9, myBinFilePrefix + "header.bin")
+    elif flagFooter :
+        tagEnd = bruttoSize - 10   # The footer is no frame
+    else :
+        tagEnd = bruttoSize
+    if flagExtendedHeader :
+        nextDataByte = processExtendedHeader(fullTag)
+    else :
+        nextDataByte = 10   # Header is 10 bytes long
+
+    # Read all frames in a do while loop
+    with stage("frameLoop") :
+        while True:
+            startDataByte = nextDataByte
+            frameName, nextDataByte = processAFrame(fullTag, startDataByte, flagUnsync, tagVers)
+            exportFrame(fullTag, frameName, startDataByte, nextDataByte - 1, myBinFilePrefix, myDecompress, tagVers)
+            # fail_condition for leaving the loop
+            if nextDataByte <= 0 or nextDataByte >= tagEnd :
+                break
+
+    print("OK, end of the tag. Ignoring the footer, next adress is " + hex(bruttoSize))
+    if myPack :
+        with stage("writePack") :
+            packSize = writePack(myBinFilePrefix + "frames.pack", headerBytes, globPackFrames)
+            count("opens")
+            count("bytesWritten", packSize)
+        print("OK, " + str(len(globPackFrames)) + " frames written into " + myBinFilePrefix + "frames.pack")
+        globPackFrames = None
+
+    # Write the pure MP3 data, starting at bruttoSize, into new file.
+    # Tags and blocks at the end of the file are no audio data.
+    exportPureAudioStartingAt(myfile, bruttoSize, myBinFilePrefix, findAudioEnd(myfile))
+    return globFrameCounter
+
+def extractFileQuiet(myfile, myOutputDir, myDecompress=False, myPack=False, myMetrics=False) :
+    ''' Worker of the batch mode: runs extractFile() for one MP3 file,
+        writing into the directory myOutputDir. The console output is
+        captured, so the last line of it tells the reason of a failure.
+        myMetrics: record the metrics of this file (see id3v2Metrics.py)
+        Returns a tuple (myfile, ok, message, fileSize, frameCount, seconds,
+        metrics snapshot or None).
+    '''
+    if myMetrics :
+        id3v2Metrics.enableMetrics("id3v2TagExtractor")
+    startTime = time.perf_counter()
+    log = io.StringIO()
+    ok = False
+    frameCount = 0
+    try :
+        fileSize = os.path.getsize(myfile)
+        os.makedirs(myOutputDir, exist_ok=True)
+        with contextlib.redirect_stdout(log) :
+            # Delete old report files of this MP3 file only
+            deleteFiles(os.path.join(glob.escape(myOutputDir), globBinFilePrefix + "*.*"))
+            frameCount = extractFile(myfile, os.path.join(myOutputDir, globBinFilePrefix), myDecompress, myPack)
+        ok = True
+        message = "OK, " + str(frameCount) + " frames"
+    except SystemExit :
+        # processFirst10Bytes() and others exit() on files they can't handle
+        lines = log.getvalue().strip().splitlines()
+        message = lines[-1] if lines else "EXIT"
+        fileSize = 0
+    except Exception as e :
+        message = "ERROR: " + repr(e)
+        fileSize = 0
+    seconds = time.perf_counter() - startTime
+    return myfile, ok, message, fileSize, frameCount, seconds, id3v2Metrics.disableMetrics()
+
+def findMp3Files(myPaths) :
+    ''' Collects the MP3 files of myPaths. A path may be a file or a directory,
+        directories are searched recursively for *.mp3 files.
+        Returns a list of tuples (filename, relative output name).
+        The output names are unique, also ignoring the case: e.g. for
+        a/song.mp3 and b/song.mp3 given as PATHs, or song.mp3 and song.MP3,
+        the second one gets the output name song_2.
+    '''
+    mp3Files = []
+    for path in myPaths :
+        if os.path.isdir(path) :
+            for dirPath, dirNames, fileNames in os.walk(path) :
+                dirNames.sort()
+                for fileName in sorted(fileNames) :
+                    if fileName.lower().endswith(".mp3") :
+                        fullName = os.path.join(dirPath, fileName)
+                        relName = os.path.splitext(os.path.relpath(fullName, path))[0]
+                        mp3Files.append((fullName, relName))
+        else :
+            mp3Files.append((path, os.path.splitext(os.path.basename(path))[0]))
+
+    # Two files with the same output directory would mix their frames files
+    usedNames = set()
+    uniqueFiles = []
+    for fullName, relName in mp3Files :
+        uniqueName = relName
+        n = 1
+        while os.path.normcase(uniqueName).lower() in usedNames :
+            n = n + 1
+            uniqueName = relName + "_" + str(n)
+        if uniqueName != relName :
+            print("PROBLEM: output name " + relName + " is used twice, " + fullName + " gets " + uniqueName)
+        usedNames.add(os.path.normcase(uniqueName).lower())
+        uniqueFiles.append((fullName, uniqueName))
+    return uniqueFiles
+
+def batchExtract(myPaths, myOutputRoot, myJobs=None, myDecompress=False, myPack=False) :
+    ''' Extracts all MP3 files found in myPaths using a pool of myJobs
+        worker processes (default: number of CPUs). Every MP3 file gets its
+        own output directory myOutputRoot/<relative name without .mp3>.
+        Returns the number of files failed.
+    '''
+    mp3Files = findMp3Files(myPaths)
+    print("Batch extracting " + str(len(mp3Files)) + " files into " + myOutputRoot)
+
+    startTime = time.perf_counter()
+    failed = 0
+    totalBytes = 0
+    with ProcessPoolExecutor(max_workers=myJobs) as pool :
+        # The workers record metrics, if they are on in this process
+        metricsOn = id3v2Metrics.globMetrics is not None
+        futures = [pool.submit(extractFileQuiet, fileName, os.path.join(myOutputRoot, relName), myDecompress, myPack, metricsOn)
+                   for fileName, relName in mp3Files]
+        for future in as_completed(futures) :
+            fileName, ok, message, fileSize, frameCount, seconds, metrics = future.result()
+            id3v2Metrics.mergeMetrics(metrics)
+            if ok :
+                totalBytes = totalBytes + fileSize
+                print("OK     " + fileName + " ... " + message + " in {0:.3f}s".format(seconds))
+            else :
+                failed = failed + 1
+                print("FAILED " + fileName + " ... " + message)
+    elapsed = max(time.perf_counter() - startTime, 1e-9)
+
+    print("Files: {0} ok, {1} failed".format(len(mp3Files) - failed, failed))
+    print("Throughput: {0:.1f} files/s, {1:.2f} MB/s ({2:.2f}s)".format(
+        len(mp3Files) / elapsed, totalBytes / elapsed / 1e6, elapsed))
+    return failed
+
 # --- MAIN SCRIPT ---
-# select a MP3 file
-filename = selectMp3File()
-
-if filename == "" :
-    print ("Nothing selected")    
-    exit(0) # Successful exit
-
-#Delete old report files
-deleteFiles(globBinFilePrefix + "*.*")
-
-# Analysing this MP3 file
-print ("Analysing " + filename)
-print("Start reading first 10 bytes of the tag")
-bruttoSize, flagUnsync, flagExtendedHeader, flagFooter, tagVers = processFirst10Bytes(filename)
-print("Start reading all frames of the ID3v2 tag. Start from " + str(bruttoSize) + " = " + hex(bruttoSize))
-fullTag = readFullTag(filename, bruttoSize)
-if flagExtendedHeader :
-    nextDataByte = processExtendedHeader(fullTag, tagVers)
-else :
-    nextDataByte = 10   # Header is 10 bytes long
-
-# Read all frames in a do while loop
-while True:
-    startDataByte = nextDataByte
-    frameName, nextDataByte = processAFrame(fullTag, startDataByte, flagUnsync, tagVers)
-    exportFrame(fullTag, frameName, startDataByte, nextDataByte - 1)
-    # fail_condition for leaving the loop
-    if nextDataByte <= 0 or nextDataByte >= bruttoSize :
-        break
-    
-print("OK, end of the tag. Ignoring the footer, next adress is " + hex(bruttoSize))
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description="Exports the ID3v2 frames and the pure audio of MP3 files. "
+                                     "Without PATH a file picker opens.")
+    parser.add_argument("paths", nargs="*", metavar="PATH", help="MP3 file or directory (batch mode)")
+    parser.add_argument("-o", "--output", default=".", help="root directory of the output directories (default: .)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: CPUs)")
+    parser.add_argument("--decompress", action="store_true", help="write compressed frames decompressed")
+    parser.add_argument("--pack", action="store_true", help="write one pack file XXX_frames.pack instead of the .bin files")
+    parser.add_argument("--metrics", default=None, metavar="FILE.json", help="write the metrics of the stages as JSON")
+    parser.add_argument("--metrics-prom", default=None, dest="metricsProm", metavar="FILE.prom",
+                        help="write the metrics of the stages as Prometheus textfile")
+    args = parser.parse_args()
+    if args.metrics or args.metricsProm :
+        id3v2Metrics.enableMetrics("id3v2TagExtractor")
+        atexit.register(id3v2Metrics.writeMetrics, args.metrics, args.metricsProm)   # at every exit()
+
+    if args.paths :
+        failedCount = batchExtract(args.paths, args.output, args.jobs, args.decompress, args.pack)
+        exit(1 if failedCount > 0 else 0)
+
+    # select a MP3 file
+    filename = selectMp3File()
+
+    if filename == "" :
+        print ("Nothing selected")    
+        exit(0) # Successful exit
 
-# Write the pure MP3 data, starting at bruttoSize, into new file
-exportPureAudioStartingAt(filename, bruttoSize)
+    #Delete old report files
+    deleteFiles(globBinFilePrefix + "*.*")
 
-# Finish
-print("OK, ready. Data exported into files " + globBinFilePrefix + "*.BIN/MP3")
+    extractFile(filename, globBinFilePrefix, args.decompress, args.pack)
 
+    # Finish
+    print("OK, ready. Data exported into files " + globBinFilePrefix + "*.BIN/MP3")
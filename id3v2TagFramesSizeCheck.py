@@ -1,11 +1,8 @@
 '''
-UNCOMLETE ... 
-(UNFERTIG ... Alle Logik fehlt noch.)
-
 ID3v2 Tag Frames Size Check
 ---------------------------
-This script checks the frame size within ID3v2.4 frames, stored 
-in separate *.bin files.
+This script checks ID3v2 frames, stored in separate *.bin files,
+and the ID3v2 tags of whole MP3 files.
 
 This is useful becouse: ID3v2.4 frames thell their size using synchsave integers,
 but ID3v2.3 frames use standard integers instead. These numbers may be different.
@@ -22,9 +19,22 @@ Than run the script.
 
 This script checks the validity of the frame size value given in the frame.
 It outputs, weather the size given fits to ID3v2.4 and/or ID3v2.3 standard,
-or is a wrong value at all.
+or is a wrong value at all. It checks the frame name (A-Z, 0-9) and the
+flags as well.
 
-This script doesn't check the validity of other data than the size.
+MP3 files: python id3v2TagFramesSizeCheck.py [-o REPORT] [-j JOBS] PATH [PATH ...]
+PATH is a MP3 file or a directory (searched recursively). Every file is
+checked in one pass over its tag, by a pool of worker processes:
+* the tag header, the tag size against the file size
+* every frame: name, size, flags, frames running over the end of the tag
+* the padding: only 00H bytes, no padding together with a footer
+* the audio data behind the tag starts with a MPEG sync (or a further tag)
+The report has one JSON object per line (JSON lines), e.g.
+{"file": "a.mp3", "ok": false, "errors": ["..."], "warnings": [], ...}
+Option --json prints the report of the .bin files as JSON lines, too.
+Option --pack [PACKFILE] checks the frames of a pack file (id3v2FramePack.py,
+default: XXX_frames.pack) instead of the .bin files.
+The exit code is 1, if a file is not ok.
 
 J. Grätzer
 2020-07-21
@@ -32,106 +42,257 @@ J. Grätzer
 '''
 
 from sys import exit
-import os
+import sys
+import re
 import glob
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from id3v2TagParser import (Id3v2Tag, TagError, getFirstFrameAddress, decodeFrameSize,
+                            encodeSynchsafe, encodeInteger, globFrameFlagCompression, globFrameFlagDataLength)
+from id3v2FrameCompression import getExtraDataSize
+from id3v2TagExtractor import findMp3Files
+from id3v2FramePack import FramePack, globPackFilename
 
 
 # --- SETTINGS ---
 globBinFilePrefix = "XXX_"
 globFrameFilePrefix = globBinFilePrefix + "N"  # "XXX_N"
+globChunkSize = 32   # files per task of a worker process
+
+# A frame name has 4 characters A-Z or 0-9
+globFrameNamePattern = re.compile(b"[A-Z0-9]{4}")
+# Flag bits, that must be 0: (first flag byte, second flag byte)
+globUnusedFlagBits = {3: (0b00011111, 0b00011111), 4: (0b10001111, 0b10110000)}
 
 # --- FUNCTIONS ---
-def doAllFramesFile() :
-    ''' Writes a temporary binary file with all frames,
-        from the ID3 frames files. The frames wildcard is: XXX_N*.bin
-        Returns the length of the temporary binary file written.
-        Returns 0. if no temporary binary file has been written.
+def checkFrameSizeBytes(myFrame) :
+    ''' Checks the 4 size bytes of a complete frame (header and data).
+        Returns a tuple (valid as ID3v2.4, valid as ID3v2.3).
+    '''
+    dataSize = len(myFrame) - 10  # the size without 10 header bytes
+    sizeBytes = bytes(myFrame[4:8])
+    validV4 = dataSize < (1 << 28) and sizeBytes == encodeSynchsafe(dataSize)
+    validV3 = sizeBytes == encodeInteger(dataSize)
+    return validV4, validV3
+
+def checkFrameFlags(myFrame, myId3Vers, myErrors) :
+    ''' Checks the two flag bytes of a frame, appends the problems to myErrors
+    '''
+    frameName = bytes(myFrame[0:4]).decode("latin-1")
+    flags1 = myFrame[8]
+    flags2 = myFrame[9]
+    unused1, unused2 = globUnusedFlagBits[myId3Vers]
+    if flags1 & unused1 or flags2 & unused2 :
+        myErrors.append(frameName + ": unknown flags " + "{0:02x}{1:02x}".format(flags1, flags2))
+    if myId3Vers == 4 and flags2 & globFrameFlagCompression and not flags2 & globFrameFlagDataLength :
+        myErrors.append(frameName + ": compression without data length indicator")
+    # ID3v2.4: group id, encryption method, data length indicator
+    # ID3v2.3: decompressed size, encryption method, group id
+    if len(myFrame) - 10 < getExtraDataSize(flags2, myId3Vers) :
+        myErrors.append(frameName + ": frame too short for the data its flags announce")
+
+def validateFrameFile(myFilePath) :
+    ''' Checks a single .bin frames file. Returns the report as a dict.
+    '''
+    try :
+        with open(myFilePath, "rb") as f :  # read in binary mode
+            frame = f.read()
+    except OSError as e :
+        return {"file": myFilePath, "kind": "frame", "ok": False, "errors": [str(e)], "warnings": []}
+    return validateFrame(frame, myFilePath)
+
+def validateFrame(myFrame, myName) :
+    ''' Checks a single frame (header and data) of a .bin frames file or
+        a pack file. Returns the report as a dict.
+    '''
+    frame = myFrame
+    report = {"file": myName, "kind": "frame", "ok": False, "errors": [], "warnings": []}
+    if len(frame) < 10 :
+        report["errors"].append("shorter than a frame header")
+        return report
+
+    if not globFrameNamePattern.fullmatch(frame[0:4]) :
+        report["errors"].append("invalid frame name " + repr(frame[0:4]))
+    validV4, validV3 = checkFrameSizeBytes(frame)
+    report["sizeValidV4"] = validV4
+    report["sizeValidV3"] = validV3
+    if validV4 or validV3 :
+        checkFrameFlags(frame, 4 if validV4 else 3, report["errors"])
+    else :
+        report["errors"].append("wrong frame size")
+    report["ok"] = len(report["errors"]) == 0
+    return report
+
+def validateMp3File(myfile) :
+    ''' Checks the ID3v2 tag of a MP3 file in one pass over the tag.
+        Returns the report as a dict.
+    '''
+    report = {"file": myfile, "kind": "mp3", "ok": False, "errors": [], "warnings": []}
+    errors = report["errors"]
+    warnings = report["warnings"]
+    try :
+        with Id3v2Tag(myfile) as tag :
+            header = tag.header
+            report["version"] = header.version
+            report["tagSize"] = header.bruttoSize
+            report["fileSize"] = tag.fileSize
+            if header.flags & 0b00001111 :
+                errors.append("unknown tag header flags " + "{0:02x}".format(header.flags))
+            if not header.flagFooter and header.flags & 0b00010000 :
+                errors.append("footer flag in a ID3v2.3 tag")
+
+            view = tag.tagView
+            tagEnd = len(view)
+            sa = 10
+            if header.flagExtendedHeader :
+                sa = getFirstFrameAddress(view, header)
+                if sa > tagEnd :
+                    errors.append("the extended header runs over the end of the tag")
+                    sa = tagEnd
+
+            # Walk the frames, like processAFrame() of id3v2TagExtractor.py
+            frameCount = 0
+            while sa + 10 <= tagEnd and view[sa] != 0x00 and view[sa + 1] != 0x00 :
+                frameName = bytes(view[sa:sa + 4])
+                nextDataByte = sa + 10 + decodeFrameSize(view[sa + 4:sa + 8], header.version)
+                if not globFrameNamePattern.fullmatch(frameName) :
+                    errors.append("invalid frame name " + repr(frameName) + " at " + hex(sa))
+                if nextDataByte > tagEnd :
+                    errors.append(frameName.decode("latin-1") + " at " + hex(sa) + " runs over the end of the tag by "
+                                  + str(nextDataByte - tagEnd) + " bytes")
+                    break
+                if header.version == 4 and view[sa + 4:sa + 8].tobytes() != encodeSynchsafe(nextDataByte - sa - 10) :
+                    errors.append(frameName.decode("latin-1") + " at " + hex(sa) + ": size is no synchsave integer")
+                checkFrameFlags(view[sa:nextDataByte], header.version, errors)
+                frameCount = frameCount + 1
+                sa = nextDataByte
+            report["frames"] = frameCount
+
+            # The padding must be 00H bytes only
+            paddingSize = max(tagEnd - sa, 0)
+            report["paddingSize"] = paddingSize
+            if paddingSize > 0 :
+                if bytes(view[sa:tagEnd]).strip(b"\x00") :
+                    errors.append("padding at " + hex(sa) + " holds other bytes than 00H")
+                if header.flagFooter :
+                    errors.append("a tag with footer must not have padding")
+            if frameCount == 0 :
+                warnings.append("the tag has no frames")
+
+            if header.flagFooter :
+                footer = bytes(tag.view[header.bruttoSize - 10:header.bruttoSize])
+                if footer[0:3] != b"3DI" or footer[3:10] != bytes(tag.view[3:10]) :
+                    errors.append("the footer doesn't fit to the header")
+
+            # Behind the tag there must be MPEG audio (sync: 11 bits set) or a further tag
+            audio = bytes(tag.view[header.bruttoSize:header.bruttoSize + 3])
+            if len(audio) == 0 :
+                warnings.append("there is no audio data behind the tag")
+            elif not (len(audio) >= 2 and audio[0] == 0xFF and audio[1] & 0xE0 == 0xE0) and audio[0:3] not in (b"ID3", b"TAG") :
+                warnings.append("the data behind the tag doesn't start with a MPEG sync, the tag size may be wrong")
+    except TagError as e :
+        errors.append(str(e))
+    except OSError as e :
+        errors.append(str(e))
+    report["ok"] = len(errors) == 0
+    return report
+
+def validateMp3Files(myFileList) :
+    ''' Worker: checks a chunk of MP3 files, returns a list of reports
+    '''
+    return [validateMp3File(fileName) for fileName in myFileList]
+
+def validateLibrary(myPaths, myReportFile, myJobs=None) :
+    ''' Checks all MP3 files found in myPaths using a pool of worker processes,
+        writes a JSON line per file into myReportFile.
+        Returns the number of files not ok.
+    '''
+    fileList = [fileName for fileName, relName in findMp3Files(myPaths)]
+    chunks = [fileList[i:i + globChunkSize] for i in range(0, len(fileList), globChunkSize)]
+    failed = 0
+    with ProcessPoolExecutor(max_workers=myJobs) as pool :
+        for reports in pool.map(validateMp3Files, chunks) :
+            for report in reports :
+                if not report["ok"] :
+                    failed = failed + 1
+                myReportFile.write(json.dumps(report) + "\n")
+    return failed
+
+def validatePackFile(myPackFileName) :
+    ''' Checks the frames of a pack file, read with one open.
+        Returns a list of reports, named like the .bin files, e.g. XXX_frames.pack:N001_TIT2
     '''
-    print("doAllFramesFile() START")
-    
-    # get a list of file paths that matches pattern
-    myFileWildcard = globFrameFilePrefix + "*.bin"
-    fileList = glob.glob(myFileWildcard, recursive=False)
-    fileList.sort(reverse=False)  # make sure the list is sorted
-
-    # Iterate over the list of input files
-    for filePath in fileList:
+    try :
+        with FramePack(myPackFileName) as pack :
+            return [validateFrame(frame, myPackFileName + ":N{0:03d}_".format(i + 1) + pack.entries[i].frameName)
+                    for i, frame in enumerate(pack.readFrames())]
+    except (OSError, TagError) as e :
+        return [{"file": myPackFileName, "kind": "pack", "ok": False, "errors": [str(e)], "warnings": []}]
+
+def doAllFramesFile(myJsonLines=False, myPackFileName=None) :
+    ''' Checks all ID3 frames files. The frames wildcard is: XXX_N*.bin
+        Or the frames of the pack file myPackFileName, if it is given.
+        Prints the result of every file. Returns the number of files not ok.
+    '''
+    if not myJsonLines :
+        print("doAllFramesFile() START")
+
+    if myPackFileName :
+        reports = validatePackFile(myPackFileName)
+    else :
+        # get a list of file paths that matches pattern
+        myFileWildcard = globFrameFilePrefix + "*.bin"
+        fileList = glob.glob(myFileWildcard, recursive=False)
+        fileList.sort(reverse=False)  # make sure the list is sorted
+        reports = [validateFrameFile(filePath) for filePath in fileList]
+
+    # Iterate over the reports of the input files
+    failed = 0
+    for report in reports :
+        filePath = report["file"]
+        if not report["ok"] :
+            failed = failed + 1
+        if myJsonLines :
+            print(json.dumps(report))
+            continue
+
         print('--> ' + filePath)
+        if report.get("sizeValidV4") :
+            print('    Valid frame size - ID3v2.4')
+            if report["sizeValidV3"] :
+                print('    Valid frame size - ID3v2.3 as well')
+        elif report.get("sizeValidV3") :
+            print('    Valid frame size - ID3v2.3 only')
+        for error in report["errors"] :
+            print('    ERROR: ' + error)
 
-        # Read the actual file
-        try :
-            with open(filePath, "rb") as f:  # read in binary mode
-                bytesObject = f.read()
-                objectSize = len(bytesObject)
-                dataSize = objectSize - 10  # the size without 10 header bytes
-                
-                # calculate the frame size as synchsave integer (4 bytes with 7 bits)
-                siByte4 = dataSize & 0b01111111
-                tmp = dataSize >> 7
-                siByte3 = tmp & 0b01111111
-                tmp = tmp >> 7
-                siByte2 = tmp & 0b01111111    
-                tmp = tmp >> 7
-                siByte1 = tmp & 0b01111111
-                
-                # calculate the frame size as integer (4 bytes with 8 bits)
-                iByte4 = dataSize & 0b11111111
-                tmp = dataSize >> 8
-                iByte3 = tmp & 0b11111111
-                tmp = tmp >> 8
-                iByte2 = tmp & 0b11111111    
-                tmp = tmp >> 8
-                iByte1 = tmp & 0b11111111
-                
-                '''
-                # Test output
-                print('---' + filePath)
-                print(bytesObject[4])
-                print(bytesObject[5])
-                print(bytesObject[6])
-                print(bytesObject[7])
-                print('--')
-                print(siByte1)
-                print(siByte2)
-                print(siByte3)
-                print(siByte4)
-                print('--')
-                print(iByte1)
-                print(iByte2)
-                print(iByte3)
-                print(iByte4)
-                '''
-                
-                ok = False
-                if (bytesObject[4] == siByte1 and
-                    bytesObject[5] == siByte2 and
-                    bytesObject[6] == siByte3 and
-                    bytesObject[7] == siByte4) :
-                    print('    Valid frame size - ID3v2.4')
-                    ok = True
-                if (bytesObject[4] == iByte1 and
-                    bytesObject[5] == iByte2 and
-                    bytesObject[6] == iByte3 and
-                    bytesObject[7] == iByte4) :
-                    if ok :
-                        print('    Valid frame size - ID3v2.3 as well')
-                    else :
-                        print('    Valid frame size - ID3v2.3 only')
-                    ok = True
-                if ok == False :  
-                    print('    ERROR: Wrong frame size.')
-                    
-        except FileNotFoundError :
-            print('writeAllFramesFile() FATAL ERROR')
-            exit(1) # Exit with error code 1
-
-    return
+    return failed
 
 
 # --- MAIN SCRIPT ---
-# Get the file size of 
-doAllFramesFile()
-    
-# Finish
-print("OK, ready.")
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description="Checks the frames files XXX_N*.bin, or the tags of MP3 files.")
+    parser.add_argument("paths", nargs="*", metavar="PATH", help="MP3 file or directory")
+    parser.add_argument("-o", "--output", default=None, help="JSON lines report file (default: console)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: CPUs)")
+    parser.add_argument("--json", action="store_true", help="print the report of the .bin files as JSON lines")
+    parser.add_argument("--pack", nargs="?", const=globPackFilename, default=None, metavar="PACKFILE",
+                        help="check the frames of a pack file (default: " + globPackFilename + ")")
+    args = parser.parse_args()
+
+    if args.paths :
+        if args.output :
+            with open(args.output, "w", encoding="utf-8") as reportFile :
+                failedCount = validateLibrary(args.paths, reportFile, args.jobs)
+        else :
+            failedCount = validateLibrary(args.paths, sys.stdout, args.jobs)
+        exit(1 if failedCount > 0 else 0)
+
+    failedCount = doAllFramesFile(args.json, args.pack)
 
+    # Finish
+    if not args.json :
+        print("OK, ready.")
+    exit(1 if failedCount > 0 else 0)
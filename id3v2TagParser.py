@@ -0,0 +1,495 @@
+'''
+ID3v2 Tag Parser
+----------------
+Parses the ID3v2.3 or ID3v2.4 tag of a MP3 file without copying it.
+
+* Opens the MP3 file once and maps it into memory (mmap)
+* Analyses the ID3v2 header, like processFirst10Bytes() of id3v2TagExtractor.py
+* Yields a descriptor for every frame: name, offset, size, flags and a
+  memoryview of the frame bytes (no bytes copies are made)
+* Finds the start of the padding and the start of the pure audio data
+* Finds the end of the pure audio data: tags appended to the file
+  (ID3v2.4 with footer, or found by a SEEK frame), Lyrics3 and ID3v1
+* Writes files atomically (writeFileAtomic()), for the scripts of this project
+
+The memoryviews point into the mapped file. Use them before the tag is
+closed, or copy them with bytes(), if they have to live longer.
+An unsynchronised ID3v2.3 tag is decoded into memory first (see decodeUnsync()),
+than the frames are memoryviews of the decoded tag, and their offsets are
+addresses within the decoded tag.
+
+Usage as a script: python id3v2TagParser.py [--probe] FILE.mp3
+Lists the frames of the tag. With --probe the frame headers are read only
+(see probeTag()), the frame data is skipped.
+
+J. Grätzer
+'''
+
+import re
+import os
+import sys
+import mmap
+import bisect
+from collections import namedtuple
+
+
+# --- SETTINGS ---
+globProbeBufferSize = 256   # probeTag(): bytes per read, enough for some frame headers
+globLyrics3v1MaxSize = 5100 # Lyrics3 v1: most lyrics bytes between LYRICSBEGIN and LYRICSEND
+
+# Frame flags (second flag byte) of ID3v2.4: %0h00kmnp
+globFrameFlagGroup = 0b01000000
+globFrameFlagCompression = 0b00001000
+globFrameFlagEncryption = 0b00000100
+globFrameFlagUnsync = 0b00000010
+globFrameFlagDataLength = 0b00000001
+# Frame flags (second flag byte) of ID3v2.3: %ijk00000
+globV3FlagCompression = 0b10000000
+globV3FlagEncryption = 0b01000000
+globV3FlagGroup = 0b00100000
+
+# Unsynchronisation: an FFH byte, that needs a 00H byte behind it: followed by 00H or 111xxxxxb
+globFalseSyncPattern = re.compile(b"\xff(?=[\x00\xe0-\xff])")
+
+# --- TYPES ---
+class TagError(ValueError) :
+    ''' Raised, if a file has no valid ID3v2.3 or ID3v2.4 tag
+    '''
+
+# Result of parseTagHeader(). size is the tag-only size (header bytes 6 to 9),
+# bruttoSize is the size including the header and the footer.
+TagHeader = namedtuple("TagHeader", ["version", "revision", "flags", "size", "bruttoSize",
+                                     "flagUnsync", "flagExtendedHeader", "flagExperimental", "flagFooter"])
+
+# One frame of the tag. offset is the address of the 10 frame header bytes,
+# size is the frame size without the header (as given in the frame header),
+# flags are the two flag bytes as an integer, frame is a memoryview of the
+# complete frame (header and data).
+FrameDescriptor = namedtuple("FrameDescriptor", ["frameName", "offset", "size", "flags", "frame"])
+
+# Result of findTrailingTags(). audioEnd is the address behind the audio data,
+# appendedTags is a list of tuples (offset, TagHeader) of the tags behind the audio,
+# id3v1Offset and lyrics3Offset are addresses, or None.
+TrailingTags = namedtuple("TrailingTags", ["audioEnd", "appendedTags", "id3v1Offset", "lyrics3Offset"])
+
+# Result of probeTag(). frames is a list of tuples (frameName, offset, size, flags).
+TagProbe = namedtuple("TagProbe", ["header", "frames", "paddingSize"])
+
+# --- FUNCTIONS ---
+def decodeSynchsafe(myBytes) :
+    ''' Returns the value of a synchsafe integer (4 bytes with 7 bits each)
+    '''
+    return (myBytes[0] << 21) | (myBytes[1] << 14) | (myBytes[2] << 7) | myBytes[3]
+
+def encodeSynchsafe(myValue) :
+    ''' Returns 4 bytes: myValue as synchsafe integer (4 bytes with 7 bits each)
+    '''
+    if myValue < 0 or myValue >= 1 << 28 :
+        raise ValueError("value does not fit into a synchsafe integer: " + str(myValue))
+    return bytes([(myValue >> 21) & 0x7F, (myValue >> 14) & 0x7F, (myValue >> 7) & 0x7F, myValue & 0x7F])
+
+def decodeInteger(myBytes) :
+    ''' Returns the value of a standard big-endian integer (4 bytes with 8 bits each)
+    '''
+    return int.from_bytes(myBytes[0:4], "big")
+
+def encodeInteger(myValue) :
+    ''' Returns 4 bytes: myValue as standard big-endian integer
+    '''
+    return myValue.to_bytes(4, "big")
+
+def decodeUnsync(myData) :
+    ''' Removes the unsynchronisation: every FFH 00H becomes FFH.
+        Returns bytes. (The frame and tag functions are in id3v2Unsync.py.)
+    '''
+    return bytes(myData).replace(b"\xff\x00", b"\xff")
+
+def encodeUnsync(myData) :
+    ''' Applies the unsynchronisation: inserts 00H behind every FFH,
+        that is followed by 00H or 111xxxxxb, and behind a FFH at the end.
+        Returns bytes.
+    '''
+    data = globFalseSyncPattern.sub(b"\xff\x00", bytes(myData))
+    if data.endswith(b"\xff") :
+        data = data + b"\x00"
+    return data
+
+def findUnsyncBytes(myTag) :
+    ''' Returns the addresses of the FFH bytes within the decoded tag, behind
+        which decodeUnsync() removed a 00H byte. myTag is the unsynchronised tag,
+        starting at the header. The list is sorted, see getFileOffset().
+    '''
+    positions = []
+    pos = myTag.find(b"\xff\x00", 10)
+    while pos >= 0 :
+        positions.append(pos - len(positions))
+        pos = myTag.find(b"\xff\x00", pos + 2)
+    return positions
+
+def getFileOffset(myUnsyncBytes, myTagOffset) :
+    ''' Returns the address in the file of the address myTagOffset within the
+        decoded tag. myUnsyncBytes is the result of findUnsyncBytes().
+    '''
+    return myTagOffset + bisect.bisect_left(myUnsyncBytes, myTagOffset)
+
+def decodeFrameSize(myBytes, myId3Vers) :
+    ''' Returns the frame size of the 4 size bytes of a frame header.
+        ID3v2.4 frames use synchsafe integers, ID3v2.3 frames standard integers.
+    '''
+    if myId3Vers == 3 :
+        return decodeInteger(myBytes)
+    return decodeSynchsafe(myBytes)
+
+def encodeFrameSize(myValue, myId3Vers) :
+    ''' Returns the 4 size bytes of a frame header for the given ID3v2 version
+    '''
+    if myId3Vers == 3 :
+        return encodeInteger(myValue)
+    return encodeSynchsafe(myValue)
+
+def parseTagHeader(myHeaderBytes) :
+    ''' Analyses the first 10 bytes of a MP3 file.
+        Returns a TagHeader, raises TagError if there is no ID3v2.3 or ID3v2.4 tag.
+    '''
+    if len(myHeaderBytes) < 10 :
+        raise TagError("this file is too short")
+    if bytes(myHeaderBytes[0:3]) != b"ID3" :
+        raise TagError("this file has no ID3v2 tag")
+    version = myHeaderBytes[3]
+    revision = myHeaderBytes[4]
+    if version != 3 and version != 4 :
+        raise TagError("this version is other than 3 or 4: ID3v2." + str(version))
+
+    flags = myHeaderBytes[5]
+    flagFooter = version == 4 and (flags & 0b00010000) != 0
+    size = decodeSynchsafe(myHeaderBytes[6:10])
+    if flagFooter :
+        bruttoSize = 20 + size   # Header is 10 bytes, and footer is 10 bytes long
+    else :
+        bruttoSize = 10 + size   # Header is 10 bytes long, and there is no footer
+    return TagHeader(version, revision, flags, size, bruttoSize,
+                     (flags & 0b10000000) != 0, (flags & 0b01000000) != 0,
+                     (flags & 0b00100000) != 0, flagFooter)
+
+def getFirstFrameAddress(myBuffer, myHeader) :
+    ''' Returns the address of the first frame, behind the header
+        and - if there is one - behind the extended header.
+    '''
+    if not myHeader.flagExtendedHeader :
+        return 10
+    if myHeader.version == 3 :
+        # ID3v2.3: the size doesn't count its own 4 bytes
+        return 14 + decodeInteger(myBuffer[10:14])
+    # ID3v2.4: the synchsafe size is the size of the whole extended header
+    return 10 + decodeSynchsafe(myBuffer[10:14])
+
+def iterFrames(myBuffer, myHeader, myStart=None) :
+    ''' Yields a FrameDescriptor for every frame in myBuffer.
+        myBuffer holds the tag, starting at the tag header (offset 0),
+        e.g. a memoryview of a mapped file or the bytes of readFullTag().
+        The walk stops at the padding (00H bytes) or at the end of the tag.
+        The frames are memoryview slices of myBuffer.
+    '''
+    view = memoryview(myBuffer)
+    tagEnd = min(10 + myHeader.size, len(view))
+    sa = getFirstFrameAddress(view, myHeader) if myStart is None else myStart
+    while sa + 10 <= tagEnd :
+        # Break, if there is no frame name, but padding bytes instead
+        if view[sa] == 0x00 or view[sa + 1] == 0x00 :
+            return
+        frameName = bytes(view[sa:sa + 4]).decode("latin-1")
+        size = decodeFrameSize(view[sa + 4:sa + 8], myHeader.version)
+        nextDataByte = sa + 10 + size
+        if nextDataByte > tagEnd :
+            raise TagError("frame " + frameName + " at " + hex(sa) + " exceeds the tag")
+        yield FrameDescriptor(frameName, sa, size, (view[sa + 8] << 8) | view[sa + 9], view[sa:nextDataByte])
+        sa = nextDataByte
+
+def findPaddingStart(myBuffer, myHeader) :
+    ''' Returns the address behind the last frame, that is the start
+        of the padding. Equals 10 + tag size, if there is no padding.
+    '''
+    nextDataByte = getFirstFrameAddress(myBuffer, myHeader)
+    for frame in iterFrames(myBuffer, myHeader, nextDataByte) :
+        nextDataByte = frame.offset + 10 + frame.size
+    return nextDataByte
+
+def findTrailingTags(myBuffer, myAudioStart=0, mySeekOffset=None) :
+    ''' Looks for the blocks at the end of a MP3 file, behind the audio data:
+        ID3v1 ("TAG" 128 bytes before the end, and "TAG+"), Lyrics3 v1 and v2,
+        and ID3v2.4 tags appended to the file (found by their "3DI" footer).
+        mySeekOffset is the value of a SEEK frame of the first tag, if any:
+        a tag found there is listed, too.
+        myBuffer is the complete file (e.g. a memoryview of the mapped file),
+        only some bytes near the end of it are read. Returns a TrailingTags.
+    '''
+    end = len(myBuffer)
+    appendedTags = []
+    id3v1Offset = None
+    lyrics3Offset = None
+    while True :
+        # ID3v1: 128 bytes "TAG...", and the enhanced tag "TAG+..." (227 bytes) in front of it
+        if id3v1Offset is None and end - 128 >= myAudioStart and bytes(myBuffer[end - 128:end - 125]) == b"TAG" :
+            end = end - 128
+            if end - 227 >= myAudioStart and bytes(myBuffer[end - 227:end - 223]) == b"TAG+" :
+                end = end - 227
+            id3v1Offset = end
+            continue
+        tail = bytes(myBuffer[max(myAudioStart, end - 15):end])
+        # Lyrics3 v2: "LYRICSBEGIN" ... 6 digits size "LYRICS200"
+        if lyrics3Offset is None and len(tail) == 15 and tail[6:] == b"LYRICS200" and tail[0:6].isdigit() :
+            start = end - 15 - int(tail[0:6])
+            if start >= myAudioStart and bytes(myBuffer[start:start + 11]) == b"LYRICSBEGIN" :
+                lyrics3Offset = end = start
+                continue
+        # Lyrics3 v1: "LYRICSBEGIN" ... "LYRICSEND"
+        if lyrics3Offset is None and tail.endswith(b"LYRICSEND") :
+            searchStart = max(myAudioStart, end - 9 - globLyrics3v1MaxSize - 11)
+            pos = bytes(myBuffer[searchStart:end]).rfind(b"LYRICSBEGIN")
+            if pos >= 0 :
+                lyrics3Offset = end = searchStart + pos
+                continue
+        # ID3v2.4 tag with footer "3DI" appended to the file
+        if end - 20 >= myAudioStart and bytes(myBuffer[end - 10:end - 7]) == b"3DI" :
+            try :
+                footer = parseTagHeader(b"ID3" + bytes(myBuffer[end - 7:end]))
+            except TagError :
+                break
+            start = end - 20 - footer.size
+            if start >= myAudioStart and bytes(myBuffer[start:start + 3]) == b"ID3" :
+                appendedTags.insert(0, (start, parseTagHeader(myBuffer[start:start + 10])))
+                end = start
+                continue
+        break
+
+    # A tag found by the SEEK frame: the offset counts from the end of the first tag
+    if mySeekOffset is not None :
+        start = myAudioStart + mySeekOffset
+        if myAudioStart <= start < end and bytes(myBuffer[start:start + 3]) == b"ID3" :
+            try :
+                header = parseTagHeader(myBuffer[start:start + 10])
+                if start + header.bruttoSize == end :
+                    end = start   # directly in front of the blocks found above, so behind the audio
+                appendedTags.insert(0, (start, header))
+            except TagError :
+                pass
+    return TrailingTags(end, appendedTags, id3v1Offset, lyrics3Offset)
+
+def writeFileAtomic(myFileName, myData) :
+    ''' Writes myData (bytes) into a temporary file, than renames it to myFileName.
+        So other processes never see a half-written file. On an error the
+        temporary file is removed.
+    '''
+    if os.path.dirname(myFileName) :
+        os.makedirs(os.path.dirname(myFileName), exist_ok=True)
+    tmpFileName = myFileName + ".tmp" + str(os.getpid())
+    try :
+        with open(tmpFileName, "wb") as f :
+            f.write(myData)
+        os.replace(tmpFileName, myFileName)
+    except BaseException :
+        try :
+            os.remove(tmpFileName)
+        except OSError :
+            pass
+        raise
+
+def probeTag(myfile) :
+    ''' Reads the frame headers only: after the 10 bytes of the tag header,
+        the frame data is skipped by seeking to the next frame header.
+        So even for a tag with a large picture only a few hundred bytes are read.
+        Returns a TagProbe, raises TagError if there is no valid tag.
+        (An unsynchronised ID3v2.3 tag is read completely - the frame sizes
+        are sizes within the decoded tag, the offsets are addresses in the file.)
+    '''
+    with open(myfile, "rb", buffering=globProbeBufferSize) as f :
+        if hasattr(os, "posix_fadvise") :
+            try :
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_RANDOM)   # no read-ahead
+            except OSError :
+                pass
+        fileSize = os.fstat(f.fileno()).st_size
+        head = f.read(14)   # tag header and the size of an extended header
+        header = parseTagHeader(head)
+        if header.bruttoSize > fileSize :
+            raise TagError("the tag size exceeds the file size")
+        tagEnd = 10 + header.size
+
+        if header.flagUnsync and header.version == 3 :
+            rawTag = head + f.read(tagEnd - len(head))
+            tag = rawTag[0:10] + decodeUnsync(rawTag[10:])
+            unsyncBytes = findUnsyncBytes(rawTag)
+            frames = []
+            for frame in iterFrames(tag, header) :
+                frames.append((frame.frameName, getFileOffset(unsyncBytes, frame.offset), frame.size, frame.flags))
+                frame.frame.release()
+            return TagProbe(header, frames, len(tag) - findPaddingStart(tag, header))
+
+        frames = []
+        sa = getFirstFrameAddress(head, header)
+        while sa + 10 <= tagEnd :
+            f.seek(sa)
+            frameHeader = f.read(10)
+            # Break, if there is no frame name, but padding bytes instead
+            if len(frameHeader) < 10 or frameHeader[0] == 0x00 or frameHeader[1] == 0x00 :
+                break
+            frameName = frameHeader[0:4].decode("latin-1")
+            size = decodeFrameSize(frameHeader[4:8], header.version)
+            if sa + 10 + size > tagEnd :
+                raise TagError("frame " + frameName + " at " + hex(sa) + " exceeds the tag")
+            frames.append((frameName, sa, size, (frameHeader[8] << 8) | frameHeader[9]))
+            sa = sa + 10 + size
+        return TagProbe(header, frames, tagEnd - min(sa, tagEnd))
+
+
+class Id3v2Tag :
+    ''' The ID3v2 tag of a MP3 file, opened once and memory-mapped.
+        Use it in a with statement:
+
+            with Id3v2Tag("song.mp3") as tag :
+                for frame in tag.frames() :
+                    print(frame.frameName, frame.size)
+    '''
+
+    def __init__(self, myfile) :
+        self.fileName = myfile
+        self.file = open(myfile, "rb")
+        try :
+            self.fileSize = self.file.seek(0, 2)
+            if self.fileSize < 10 :
+                raise TagError("this file is too short")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException :
+            self.file.close()
+            raise
+        self.view = memoryview(self.map)
+        self.tagView = self.view[0:0]   # set below, when the header is valid
+        try :
+            self.header = parseTagHeader(self.view[0:10])
+        except BaseException :
+            self.close()
+            raise
+        if self.header.bruttoSize > self.fileSize :
+            self.close()
+            raise TagError("the tag size exceeds the file size")
+        if self.header.flagUnsync and self.header.version == 3 :
+            # ID3v2.3: the frames can be read from the decoded tag only
+            tagEnd = 10 + self.header.size
+            self.tagView = memoryview(bytes(self.view[0:10]) + decodeUnsync(self.view[10:tagEnd]))
+        else :
+            self.tagView = self.view[0:10 + self.header.size]
+        self.trailing = None   # see trailingTags()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, excType, excValue, traceback) :
+        self.close()
+
+    def close(self) :
+        ''' Releases the mapping and closes the file. If memoryviews of frames
+            are still alive, the mapping is released when they are gone.
+        '''
+        self.tagView.release()
+        self.view.release()
+        try :
+            self.map.close()
+        except BufferError :
+            pass  # frame memoryviews still exist - the mapping closes with them
+        self.file.close()
+
+    def frames(self, myTagOffset=0) :
+        ''' Yields a FrameDescriptor for every frame of the tag. myTagOffset
+            is the address of another tag, e.g. of trailingTags().appendedTags,
+            than the offsets are addresses within that tag.
+        '''
+        if myTagOffset == 0 :
+            return iterFrames(self.tagView, self.header)
+        header = parseTagHeader(self.view[myTagOffset:myTagOffset + 10])
+        return iterFrames(self.view[myTagOffset:myTagOffset + 10 + header.size], header)
+
+    def trailingTags(self) :
+        ''' Returns the TrailingTags of the file (tags behind the audio data)
+        '''
+        if self.trailing is None :
+            seekOffset = None
+            for frame in self.frames() :
+                if frame.frameName == "SEEK" and frame.size >= 4 :
+                    seekOffset = decodeInteger(frame.frame[10:14])
+                frame.frame.release()
+            self.trailing = findTrailingTags(self.view, self.header.bruttoSize, seekOffset)
+        return self.trailing
+
+    def tagBytes(self) :
+        ''' Returns a memoryview of the complete tag (header, frames, padding, footer)
+        '''
+        return self.view[0:self.header.bruttoSize]
+
+    def paddingStart(self) :
+        ''' Returns the address of the first padding byte
+        '''
+        return findPaddingStart(self.tagView, self.header)
+
+    def paddingSize(self) :
+        ''' Returns the number of padding bytes
+        '''
+        return len(self.tagView) - self.paddingStart()
+
+    def audioStart(self) :
+        ''' Returns the address of the pure audio data behind the tag
+        '''
+        return self.header.bruttoSize
+
+    def audioEnd(self) :
+        ''' Returns the address behind the pure audio data, that is in front
+            of appended tags, Lyrics3 and ID3v1 (see trailingTags())
+        '''
+        return self.trailingTags().audioEnd
+
+    def audioBytes(self) :
+        ''' Returns a memoryview of the pure audio data behind the tag
+        '''
+        return self.view[self.header.bruttoSize:self.audioEnd()]
+
+
+# --- MAIN SCRIPT ---
+if __name__ == "__main__" :
+    if len(sys.argv) < 2 :
+        print("Usage: python id3v2TagParser.py [--probe] FILE.mp3")
+        sys.exit(1)
+    if sys.argv[1] == "--probe" and len(sys.argv) > 2 :
+        try :
+            probe = probeTag(sys.argv[2])
+        except (OSError, TagError) as e :
+            print("ERROR: " + str(e))
+            sys.exit(1)
+        print("ID3v2." + str(probe.header.version) + "." + str(probe.header.revision)
+              + ", tag size " + str(probe.header.bruttoSize) + " = " + hex(probe.header.bruttoSize))
+        for frameName, offset, size, flags in probe.frames :
+            print("  " + frameName + " at " + hex(offset) + ", size " + str(size) + ", flags " + "{0:04x}".format(flags))
+        print("Padding " + str(probe.paddingSize) + " bytes")
+        sys.exit(0)
+    try :
+        with Id3v2Tag(sys.argv[1]) as tag :
+            print("ID3v2." + str(tag.header.version) + "." + str(tag.header.revision)
+                  + ", tag size " + str(tag.header.bruttoSize) + " = " + hex(tag.header.bruttoSize))
+            for frame in tag.frames() :
+                print("  " + frame.frameName + " at " + hex(frame.offset) + ", size " + str(frame.size)
+                      + ", flags " + "{0:04x}".format(frame.flags))
+                frame.frame.release()
+            print("Padding " + str(tag.paddingSize()) + " bytes, audio starts at " + hex(tag.audioStart())
+                  + ", ends at " + hex(tag.audioEnd()))
+            trailing = tag.trailingTags()
+            for offset, header in trailing.appendedTags :
+                print("Appended ID3v2." + str(header.version) + " tag at " + hex(offset) + ", tag size " + str(header.bruttoSize))
+                for frame in tag.frames(offset) :
+                    print("  " + frame.frameName + " at " + hex(offset + frame.offset) + ", size " + str(frame.size)
+                          + ", flags " + "{0:04x}".format(frame.flags))
+                    frame.frame.release()
+            if trailing.lyrics3Offset is not None :
+                print("Lyrics3 at " + hex(trailing.lyrics3Offset))
+            if trailing.id3v1Offset is not None :
+                print("ID3v1 at " + hex(trailing.id3v1Offset))
+    except (OSError, TagError) as e :
+        print("ERROR: " + str(e))
+        sys.exit(1)
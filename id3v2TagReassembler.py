@@ -2,7 +2,9 @@
 ID3v2.4 Tag Reassembler
 -----------------------
 This builds a new MP3 file from ID3v2.4 frames files and the pure MP3 data file.
-The tag version is 4, so the result is a MP3 with a ID3v2.4 tag.
+The tag version is the version of XXX_header.bin (the version of the frames),
+4 if there is no XXX_header.bin. So the result is a MP3 with a ID3v2.4 tag,
+if the frames are ID3v2.4 frames.
 
 The script assembles ID3 frames files and a MP3 file into a new MP3 file.
 Thus, at the beginning, there are these files:
@@ -14,14 +16,52 @@ Thus, at the beginning, there are these files:
 
 These files originate from the "ID3v2 Tag Exporter" (_id3v2TagExtractor.py).
 
-This script doesn't check the validity of the frames, found in the .bin frames files.
-So make sure, they are valid. Attention: ID3v2.4 frames thell their size using
-synchsave integers, but ID3v2.3 frames use standard integers instead.
+This script doesn't check the validity of the frames, found in the .bin frames files,
+but their size fields. Attention: ID3v2.4 frames thell their size using
+synchsave integers, but ID3v2.3 frames use standard integers instead. Nothing
+is written, if a frame size doesn't fit the version of the tag.
 
 Working Steps of this script:
-1) Writing a temporary binary file with all frames data, found in the .bin frames files.
+1) Calculating the tag size from the sizes of the .bin frames files.
 2) Createing a ID3 tag header, writing it into a new file "target.MP3".
 3) Appending the frames data, than the pure audio (MP3) data.
+   The files are copied by the kernel (os.copy_file_range or os.sendfile),
+   or in blocks of globCopyBlockSize bytes, where this is not possible.
+   So the memory used doesn't depend on the size of the audio data.
+
+In-place mode: python id3v2TagReassembler.py --in-place TARGET.mp3
+Replaces the ID3v2 tag of TARGET.mp3 by the frames of the .bin frames files,
+if they fit into the old tag (frames plus padding). Only the tag region
+of TARGET.mp3 is overwritten, the rest is filled with padding. The audio
+data is not touched. Nothing is written, if the frames don't fit, or if
+they have another version than the old tag (the version of the frames is
+the version of XXX_header.bin or of the pack). --unsync is honoured.
+
+Manifest mode: python id3v2TagReassembler.py --manifest MANIFEST.json [--store STORE]
+Builds XXX_newAudio.mp3 from a manifest of the frame store (id3v2FrameStore.py):
+the frames are copied from the store objects, the audio data from the
+original MP3 file, named in the manifest.
+
+Pack mode: python id3v2TagReassembler.py --pack [PACKFILE] [--in-place TARGET.mp3]
+The frames are read from the pack file XXX_frames.pack (id3v2FramePack.py)
+instead of the .bin frames files: one open, and the frames are copied by a
+single copy. The tag version is the version of the header in the pack.
+
+Padding: python id3v2TagReassembler.py --padding POLICY
+The new tag gets padding (00H bytes behind the frames), so later edits of
+the frames fit into the tag and can be written in place. POLICY is one of
+the rules below, or some of them joined by "+", e.g. "percent:10+block:4096":
+* none              no padding
+* fixed:N           N bytes
+* percent:P         P percent of the frames size
+* block:N           the tag (header, frames, padding) is rounded up to a multiple of N bytes
+* library:DB[:P]    the frames of the tag may grow to the size of the frames of
+                    P percent (default 90) of the tags in the library index DB
+                    (id3v2LibraryIndex.py)
+The default is globPaddingPolicy.
+
+Metrics: --metrics FILE.json and --metrics-prom FILE.prom write the time,
+bytes, file opens and frames of every stage (see id3v2Metrics.py).
 
 J. Grätzer
 2020-05-21
@@ -32,6 +72,16 @@ J. Grätzer
 from sys import exit
 import os
 import glob
+import errno
+import atexit
+import argparse
+
+from id3v2TagParser import Id3v2Tag, TagError, encodeSynchsafe, decodeFrameSize, parseTagHeader
+from id3v2FrameStore import readManifest, findStoreDir, getObjectPath
+from id3v2FramePack import FramePack, globPackFilename
+from id3v2Unsync import encodeUnsync, encodeFrameUnsync
+import id3v2Metrics
+from id3v2Metrics import timedStage, count
 
 
 # --- SETTINGS ---
@@ -40,61 +90,310 @@ globId3v2Version = 4    # 3 or 4 (4 is recommended)
 globBinFilePrefix = "XXX_"
 globFrameFilePrefix = globBinFilePrefix + "N"  # "XXX_N"
 globAudioFilename = globBinFilePrefix + "audio.mp3"  # "XXX_audio.mp3"
-globTempFramesFilename = globBinFilePrefix + "tempFrames.bin"
 globNewAudioFilename = globBinFilePrefix + "newAudio.mp3"
+globUnsync = False      # True: write an unsynchronised tag (option --unsync)
+globPaddingPolicy = "none"   # padding of new tags (option --padding), e.g. "fixed:1024"
 
 # --- INTERNAL GLOBALS ---
 # Frame counter
 #globFrameCounter = globBinFilePrefix = "XXX_"
 
+# Size of the 00H blocks, written as padding
+globPaddingBlockSize = 64 * 1024
+# Size of the blocks, if files are copied without kernel support
+globCopyBlockSize = 1024 * 1024
+# Errors of os.copy_file_range and os.sendfile, that mean: not supported here
+globCopyFallbackErrors = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF)
+# Padding rules of a policy
+globPaddingRules = ("none", "fixed", "percent", "block", "library")
+# Frames sizes of library indexes, queried once: (database, percent) -> bytes
+globLibraryFramesSizes = {}
+
 # --- FUNCTIONS ---
-def writeTheAllFramesTmpFile() :
-    ''' Writes a temporary binary file with all frames,
-        from the ID3 frames files. The frames wildcard is: XXX_N*.bin
-        Returns the length of the temporary binary file written.
-        Returns 0. if no temporary binary file has been written.
-    '''
-    print("writeTheAllFramesTmpFile() START")
-    
-    # Is there the "XXX_audio.mp3" file?
-    if os.path.exists(globAudioFilename) :
-        pass
-    else :
-        print("writeTheAllFramesTmpFile() PROBLEM: Audiofile is missing.")
-        return 0
-    
-    # get a list of file paths that matches pattern
+def getFrameFileList() :
+    ''' Returns the sorted list of the ID3 frames files. The frames wildcard is: XXX_N*.bin
+    '''
     myFileWildcard = globFrameFilePrefix + "*.bin"
     fileList = glob.glob(myFileWildcard, recursive=False)
     fileList.sort(reverse=False)  # make sure the list is sorted
-    
-    # Is there the "XXX_audio.mp3" file?
-    if len(fileList) == 0 :
-        print("writeTheAllFramesTmpFile() PROBLEM: Framefiles are missing.")
-        return 0
+    return fileList
+
+def makeTagHeaderBytes(myTagSize, myId3v2Version=None, myFlags=0) :
+    ''' Returns the 10 bytes of a ID3 tag header "ID3...".
+        myTagSize is the size of the tag without the header, myFlags is byte 5.
+        The version is globId3v2Version, if myId3v2Version is not given.
+    '''
+    if myId3v2Version is None :
+        myId3v2Version = globId3v2Version
+    # Start with 6 bytes 49 44 33 04 00 00 (last byte is "flags")
+    if myId3v2Version == 3 :
+        headerBytes = b'\x49\x44\x33\x03\x00' + bytes([myFlags])   # first bytes in ID3v2.3 tag
+    else :
+        headerBytes = b'\x49\x44\x33\x04\x00' + bytes([myFlags])   # first bytes in ID3v2.4 tag
+    # Append the next 4 bytes: Tag size as synchsave integer (4 bytes with 7 bits)
+    return headerBytes + encodeSynchsafe(myTagSize)
 
-    # Write the frame data to temp. destination file. "Open w" overrides the old file.
-    dataSize = 0
-    with open(globTempFramesFilename, "wb") as fileTarget:
-        # Iterate over the list of input files
-        for filePath in fileList:
-            print("writeTheAllFramesTmpFile() " + filePath)
+def parsePaddingPolicy(myPolicy) :
+    ''' Returns the rules of a padding policy, e.g. "percent:10+block:4096",
+        as a list of tuples (rule, values). Raises ValueError.
+    '''
+    rules = []
+    for part in myPolicy.split("+") :
+        fields = part.strip().split(":")
+        rule = fields[0].lower()
+        if rule not in globPaddingRules :
+            raise ValueError("unknown padding rule " + repr(part) + ", use " + ", ".join(globPaddingRules))
+        if rule == "library" :
+            if len(fields) < 2 or len(fields) > 3 :
+                raise ValueError("padding rule library needs a database: library:DB[:PERCENT]")
+            percent = float(fields[2]) if len(fields) == 3 else 90.0
+            if not 0 <= percent <= 100 :
+                raise ValueError("padding rule library: the percent must be 0 to 100")
+            rules.append((rule, (fields[1], percent)))
+        elif rule == "none" :
+            rules.append((rule, 0))
+        else :
+            if len(fields) != 2 or not fields[1].isdigit() :
+                raise ValueError("padding rule " + rule + " needs a number: " + rule + ":N")
+            if rule == "block" and int(fields[1]) == 0 :
+                raise ValueError("padding rule block needs a block size > 0")
+            rules.append((rule, int(fields[1])))
+    return rules
 
-            # Read the actual file
+def getLibraryFramesSize(myDatabaseFilename, myPercent) :
+    ''' Returns the frames size (tag without header and padding), that myPercent
+        percent of the tags in the library index don't exceed. 0 for an empty index.
+    '''
+    # Imported here, so importing this module (e.g. for copyFileInto()) stays fast
+    import sqlite3
+    from id3v2LibraryIndex import openDatabase
+
+    key = (myDatabaseFilename, myPercent)
+    if key not in globLibraryFramesSizes :
+        if not os.path.exists(myDatabaseFilename) :
+            raise ValueError("the library index does not exist: " + myDatabaseFilename)
+        try :
+            db = openDatabase(myDatabaseFilename)
             try :
-                with open(filePath, "rb") as f:  # read in binary mode
-                    bytesObject = f.read()
-                    dataSize = dataSize + len(bytesObject)                    
-            except FileNotFoundError :
-                print('writeTheAllFramesTmpFile() FATAL ERROR')
-                exit(1) # Exit with error code 1
+                sizes = [row[0] for row in db.execute(
+                    "SELECT tagSize - paddingSize - 10 FROM files WHERE version IS NOT NULL ORDER BY 1")]
+            finally :
+                db.close()
+        except sqlite3.Error as e :
+            raise ValueError("the library index can't be read: " + myDatabaseFilename + ": " + str(e))
+        globLibraryFramesSizes[key] = sizes[min(int(len(sizes) * myPercent / 100), len(sizes) - 1)] if sizes else 0
+    return globLibraryFramesSizes[key]
 
-            # write/append the actual data to temp. destination file
-            fileTarget.write(bytesObject)
-        print('writeTheAllFramesTmpFile() OK: Temporary file saved. dataSize=' + str(dataSize))
- 
-    return dataSize  # returns the number of bytes written into fileTarget 
+def getPaddingSize(myFramesSize, myPolicy=None) :
+    ''' Returns the padding size of a new tag with myFramesSize bytes frames.
+        myPolicy is a padding policy (see parsePaddingPolicy()), default globPaddingPolicy.
+        The sizes of the rules are added, the block rule rounds the whole tag up.
+    '''
+    paddingSize = 0
+    blockSize = 0
+    for rule, value in parsePaddingPolicy(myPolicy if myPolicy is not None else globPaddingPolicy) :
+        if rule == "fixed" :
+            paddingSize = paddingSize + value
+        elif rule == "percent" :
+            paddingSize = paddingSize + (myFramesSize * value + 99) // 100
+        elif rule == "library" :
+            paddingSize = paddingSize + max(getLibraryFramesSize(value[0], value[1]) - myFramesSize, 0)
+        elif rule == "block" :
+            blockSize = max(blockSize, value)
+    if blockSize > 0 :
+        tagSize = 10 + myFramesSize + paddingSize
+        paddingSize = paddingSize + (-tagSize) % blockSize
+    return paddingSize
+
+def writePadding(fileTarget, myPaddingSize) :
+    ''' Writes myPaddingSize 00H bytes into fileTarget, block by block
+    '''
+    zeroBlock = memoryview(bytes(min(myPaddingSize, globPaddingBlockSize)))
+    while myPaddingSize > 0 :
+        n = fileTarget.write(zeroBlock[:min(myPaddingSize, len(zeroBlock))])
+        myPaddingSize = myPaddingSize - n
 
+def copyBytes(fileSource, fileTarget, myOffset, myCount) :
+    ''' Copies myCount bytes, see copyBytesOnce(). Returns the number of bytes copied.
+    '''
+    copied = copyBytesOnce(fileSource, fileTarget, myOffset, myCount)
+    count("bytesRead", copied)
+    return copied
+
+def copyBytesOnce(fileSource, fileTarget, myOffset, myCount) :
+    ''' Copies myCount bytes, starting at myOffset of fileSource, to the current
+        position of fileTarget. fileTarget must be unbuffered (buffering=0).
+        Uses os.copy_file_range or os.sendfile, so the data is copied by the kernel.
+        Falls back to copying blocks of globCopyBlockSize bytes.
+        Returns the number of bytes copied (less than myCount at the end of fileSource).
+    '''
+    inFd = fileSource.fileno()
+    outFd = fileTarget.fileno()
+    copied = 0
+
+    # 1st choice: os.copy_file_range (Linux), may even share the blocks on the disk
+    if hasattr(os, "copy_file_range") :
+        try :
+            while copied < myCount :
+                n = os.copy_file_range(inFd, outFd, myCount - copied, myOffset + copied)
+                if n == 0 :
+                    return copied  # end of fileSource
+                copied = copied + n
+            return copied
+        except OSError as e :
+            if e.errno not in globCopyFallbackErrors :
+                raise
+
+    # 2nd choice: os.sendfile (Linux, macOS can't write into regular files)
+    if hasattr(os, "sendfile") :
+        try :
+            while copied < myCount :
+                n = os.sendfile(outFd, inFd, myOffset + copied, myCount - copied)
+                if n == 0 :
+                    return copied  # end of fileSource
+                copied = copied + n
+            return copied
+        except OSError as e :
+            if e.errno not in globCopyFallbackErrors :
+                raise
+
+    # Fallback: read and write blocks of bounded size
+    buf = bytearray(min(globCopyBlockSize, max(myCount - copied, 1)))
+    view = memoryview(buf)
+    fileSource.seek(myOffset + copied)
+    while copied < myCount :
+        n = fileSource.readinto(view[:min(len(buf), myCount - copied)])
+        if not n :
+            break  # end of fileSource
+        written = 0
+        while written < n :
+            written = written + fileTarget.write(view[written:n])
+        copied = copied + n
+    return copied
+
+def copyFileInto(fileTarget, mySourceFileName) :
+    ''' Appends the complete file mySourceFileName to fileTarget (see copyBytes()).
+        Returns the number of bytes copied.
+    '''
+    with open(mySourceFileName, "rb") as f :  # read in binary mode
+        count("opens")
+        return copyBytes(f, fileTarget, 0, os.fstat(f.fileno()).st_size)
+
+def readHeaderFileVersion(myFrameFileList) :
+    ''' Returns the ID3v2 version of XXX_header.bin, next to the frames files
+        of myFrameFileList, or None, if there is no header file.
+    '''
+    if not myFrameFileList :
+        return None
+    headerFileName = os.path.join(os.path.dirname(myFrameFileList[0]), globBinFilePrefix + "header.bin")
+    try :
+        with open(headerFileName, "rb") as f :  # read in binary mode
+            headerBytes = f.read(10)
+    except FileNotFoundError :
+        return None
+    count("opens")
+    return parseTagHeader(headerBytes).version
+
+def checkFrameSizes(myFrames, myId3v2Version) :
+    ''' Tests, whether the frames tell their size like myId3v2Version does:
+        myFrames is a list of tuples (name, first 10 bytes of the frame, size of the frame).
+        Returns a problem message, or None, if all frames are ok.
+    '''
+    for name, frameHeader, frameSize in myFrames :
+        if len(frameHeader) < 10 or 10 + decodeFrameSize(frameHeader[4:8], myId3v2Version) != frameSize :
+            return ("frame " + name + " is no ID3v2." + str(myId3v2Version) + " frame (its size field doesn't fit "
+                    + str(frameSize) + " bytes)")
+    return None
+
+@timedStage()
+def rewriteTagInPlace(myMp3FileName, myFileList, myPackFileName=None) :
+    ''' Overwrites the ID3v2 tag of myMp3FileName with the frames files in myFileList,
+        or with the frames of the pack file myPackFileName, if they fit into the
+        old tag (old frames plus padding, and the footer, if any).
+        The version of the frames is the version of the pack, or of XXX_header.bin,
+        else the version of the old tag. It must be the version of the old tag.
+        With globUnsync, the new tag is unsynchronised.
+        The rest of the old tag is filled with padding, the audio data is not touched.
+        Returns the number of bytes written. Returns 0, if the frames don't fit.
+    '''
+    print("rewriteTagInPlace() START " + myMp3FileName)
+
+    try :
+        with Id3v2Tag(myMp3FileName) as tag :
+            oldHeader = tag.header
+    except (OSError, TagError) as e :
+        print("rewriteTagInPlace() PROBLEM: " + str(e))
+        return 0
+
+    # The new tag has no footer, so the old footer bytes become padding, too
+    newTagSize = oldHeader.bruttoSize - 10
+    try :
+        pack = FramePack(myPackFileName) if myPackFileName else None
+        framesVersion = pack.header.version if pack else readHeaderFileVersion(myFileList)
+    except (OSError, TagError) as e :
+        if pack :
+            pack.close()
+        print("rewriteTagInPlace() PROBLEM: " + str(e))
+        return 0
+    if framesVersion is None :
+        framesVersion = oldHeader.version
+    try :
+        # The frames and the old tag must have the same version,
+        # else the frame sizes would be read the wrong way
+        if framesVersion != oldHeader.version :
+            print("rewriteTagInPlace() PROBLEM: The frames are ID3v2." + str(framesVersion) + " frames, the tag of "
+                  + myMp3FileName + " is ID3v2." + str(oldHeader.version) + ". Nothing written.")
+            return 0
+        frames = None
+        if pack :
+            frames = pack.readFrames()
+            frameSizes = [(entry.frameName, frame[0:10], entry.size) for entry, frame in zip(pack.entries, frames)]
+        else :
+            frameSizes = []
+            for filePath in myFileList :
+                with open(filePath, "rb") as f :  # read in binary mode
+                    frameSizes.append((filePath, f.read(10), os.fstat(f.fileno()).st_size))
+        problem = checkFrameSizes(frameSizes, framesVersion)
+        if problem :
+            print("rewriteTagInPlace() PROBLEM: " + problem + ". Nothing written.")
+            return 0
+
+        tagBody = None
+        if globUnsync :
+            # The unsynchronisation changes the size, so the tag is built in memory
+            tagBody = makeUnsyncTagBody(myFileList, frames, framesVersion)
+            framesSize = len(tagBody)
+        else :
+            framesSize = sum([frameSize for name, frameHeader, frameSize in frameSizes])
+        if framesSize > newTagSize :
+            print("rewriteTagInPlace() PROBLEM: Frames need " + str(framesSize) + " bytes, the old tag has "
+                  + str(newTagSize) + " bytes only.")
+            return 0
+
+        with open(myMp3FileName, "r+b", buffering=0) as fileTarget :
+            if tagBody is not None :
+                fileTarget.write(makeTagHeaderBytes(newTagSize, framesVersion, 0b10000000))
+                fileTarget.write(tagBody)
+            elif pack :
+                fileTarget.write(makeTagHeaderBytes(newTagSize, framesVersion))
+                print("rewriteTagInPlace() " + myPackFileName)
+                fileTarget.write(b''.join(frames))
+            else :
+                fileTarget.write(makeTagHeaderBytes(newTagSize, framesVersion))
+                for filePath in myFileList :
+                    print("rewriteTagInPlace() " + filePath)
+                    copyFileInto(fileTarget, filePath)
+            writePadding(fileTarget, newTagSize - framesSize)
+        count("frames", len(frameSizes))
+        count("opens", 2 + (1 if pack else len(myFileList)))   # the MP3 file is opened twice
+        count("bytesWritten", 10 + newTagSize)
+    finally :
+        if pack :
+            pack.close()
+
+    print("rewriteTagInPlace() OK: Tag rewritten, " + str(framesSize) + " bytes frames, "
+          + str(newTagSize - framesSize) + " bytes padding.")
+    return 10 + newTagSize
 
 def testCopyAFrameFile(myFileNam) :
     # Read the file
@@ -113,71 +412,276 @@ def testCopyAFrameFile(myFileNam) :
     print('testCopyAFrameFile() OK: Temp. frames file saved.')
 
 
-def writeAudioFileWithHeaderAndFrames(myAudioFileName, myFrameSize, myAllFramesFileName) :
+def makeUnsyncTagBody(myFrameFileList, myFrames=None, myId3v2Version=None) :
+    ''' Returns the frames of myFrameFileList (or the frames bytes myFrames)
+        unsynchronised (see id3v2Unsync.py): ID3v2.4 frame by frame, ID3v2.3 as a whole.
+    '''
+    if myFrames is None :
+        myFrames = []
+        for filePath in myFrameFileList :
+            with open(filePath, "rb") as f :  # read in binary mode
+                myFrames.append(f.read())
+    if (myId3v2Version or globId3v2Version) == 3 :
+        return encodeUnsync(b''.join(myFrames))
+    return b''.join([encodeFrameUnsync(frame) for frame in myFrames])
+
+@timedStage()
+def writeAudioFileWithHeaderAndFrames(myAudioFileName, myFrameFileList, myId3v2Version=None) :
+    ''' Writes the new MP3 file in a single pass: the tag header, the frames
+        files of myFrameFileList, than the pure audio data of XXX_audio.mp3.
+        The tag size is calculated from the file sizes before writing.
+        The tag version is myId3v2Version (the version of the frames), default globId3v2Version.
+        Nothing is written, if a frame doesn't tell its size like this version does.
+        Returns the number of bytes written, 0 if nothing has been written.
+    '''
+    print("writeAudioFileWithHeaderAndFrames() START")
+
+    # Is there the "XXX_audio.mp3" file?
+    if not os.path.exists(globAudioFilename) :
+        print("writeAudioFileWithHeaderAndFrames() PROBLEM: Audiofile is missing.")
+        return 0
+
+    # Are there frames files?
+    if len(myFrameFileList) == 0 :
+        print("writeAudioFileWithHeaderAndFrames() PROBLEM: Framefiles are missing.")
+        return 0
+
+    # Calculate the tag size from the sizes of the frames files
+    if myId3v2Version is None :
+        myId3v2Version = globId3v2Version
+    try :
+        frameSize = 0
+        frameSizes = []
+        for filePath in myFrameFileList :
+            with open(filePath, "rb") as f :  # read in binary mode
+                frameSizes.append((filePath, f.read(10), os.fstat(f.fileno()).st_size))
+            frameSize = frameSize + frameSizes[-1][2]
+        count("opens", len(frameSizes))
+    except OSError :
+        print('writeAudioFileWithHeaderAndFrames() FATAL ERROR on reading the frames files.')
+        exit(1) # Exit with error code 1
+
+    # ID3v2.3 frames in a ID3v2.4 tag (or a mixed set) can't be read
+    problem = checkFrameSizes(frameSizes, myId3v2Version)
+    if problem :
+        print("writeAudioFileWithHeaderAndFrames() PROBLEM: " + problem + ". Nothing written.")
+        return 0
+
     # Write the data to destination file with "wb". Overides old file.
+    # The file is unbuffered, so the kernel copies go straight into it.
+    with open(myAudioFileName, "wb", buffering=0) as fileTarget:
+        if globUnsync :
+            # The unsynchronisation changes the size, so the tag is built in memory
+            tagBody = makeUnsyncTagBody(myFrameFileList, None, myId3v2Version)
+            frameSize = len(tagBody)
+            paddingSize = getPaddingSize(frameSize)
+            written = fileTarget.write(makeTagHeaderBytes(frameSize + paddingSize, myId3v2Version, 0b10000000))
+            written = written + fileTarget.write(tagBody)
+        else :
+            # First: the bytes object "ID3..." (10 Bytes)
+            paddingSize = getPaddingSize(frameSize)
+            written = fileTarget.write(makeTagHeaderBytes(frameSize + paddingSize, myId3v2Version))
 
-    # First: create bytes object "ID3..." (10 Bytes)
-    # Bytes object - see:
-    #   https://en.wikiversity.org/wiki/Python_Concepts/Bytes_objects_and_Bytearrays#bytes_objects        
-    # Start with 6 bytes 49 44 33 04 00 00 (last byte is "flags")
-    if globId3v2Version == 3 :
-        headerBytes = b'\x49\x44\x33\x03\x00\x00'   # first bytes in ID3v2.3 tag
-    else :
-        headerBytes = b'\x49\x44\x33\x04\x00\x00'   # first bytes in ID3v2.4 tag
-    
-    # calculate the next 4 bytes: Frame size as synchsave integer (4 bytes with 7 bits)
-    byte9 = myFrameSize & 0b01111111
-    tmp = myFrameSize >> 7
-    byte8 = tmp & 0b01111111
-    tmp = tmp >> 7
-    byte7 = tmp & 0b01111111    
-    tmp = tmp >> 7
-    byte6 = tmp & 0b01111111      
-    
-    # Append the next 4 bytes (Mind the [] brackets!)
-    headerBytes = headerBytes + bytes([byte6]) + bytes([byte7]) + bytes([byte8]) + bytes([byte9])
-    
-    # Write this bytes object (10 bytes) into a new file 
-    with open(myAudioFileName, "wb") as f:
-        f.write(headerBytes)
-        
-    # Append the AllFramesFile bytes to that new file
-    with open(myAudioFileName, "ab") as fileTarget:
+            # Append the frames files
+            for filePath in myFrameFileList :
+                print("writeAudioFileWithHeaderAndFrames() " + filePath)
+                written = written + copyFileInto(fileTarget, filePath)
+
+        # The padding behind the frames
+        writePadding(fileTarget, paddingSize)
+        written = written + paddingSize
+
+        # Append the AudioFile bytes
+        written = written + copyFileInto(fileTarget, globAudioFilename)
+
+    count("opens")
+    count("bytesWritten", written)
+    count("frames", len(myFrameFileList))
+    print('writeAudioFileWithHeaderAndFrames() OK: New file saved. frameSize=' + str(frameSize)
+          + ', paddingSize=' + str(paddingSize))
+    return written
+
+@timedStage()
+def writeAudioFileFromPack(myPackFileName, myAudioFileName) :
+    ''' Writes the new MP3 file from the pack file myPackFileName (the tag header
+        with the version of the pack, the frames) and the pure audio data of
+        XXX_audio.mp3. Returns the number of bytes written, 0 if nothing has been written.
+    '''
+    print("writeAudioFileFromPack() START " + myPackFileName)
+
+    # Is there the "XXX_audio.mp3" file?
+    if not os.path.exists(globAudioFilename) :
+        print("writeAudioFileFromPack() PROBLEM: Audiofile is missing.")
+        return 0
+    try :
+        pack = FramePack(myPackFileName)
+    except (OSError, TagError) as e :
+        print("writeAudioFileFromPack() PROBLEM: " + str(e))
+        return 0
+
+    if len(pack) == 0 :
+        pack.close()
+        print("writeAudioFileFromPack() PROBLEM: The pack has no frames.")
+        return 0
+
+    with pack, open(myAudioFileName, "wb", buffering=0) as fileTarget :
+        version = pack.header.version
+        if globUnsync :
+            tagBody = makeUnsyncTagBody(None, pack.readFrames(), version)
+            frameSize = len(tagBody)
+            paddingSize = getPaddingSize(frameSize)
+            written = fileTarget.write(makeTagHeaderBytes(frameSize + paddingSize, version, 0b10000000))
+            written = written + fileTarget.write(tagBody)
+        else :
+            # All frames of the pack follow each other, so they are copied at once
+            frameSize = pack.framesSize
+            paddingSize = getPaddingSize(frameSize)
+            written = fileTarget.write(makeTagHeaderBytes(frameSize + paddingSize, version))
+            written = written + copyBytes(pack.file, fileTarget, pack.framesStart, frameSize)
+        writePadding(fileTarget, paddingSize)
+        written = written + paddingSize
+        written = written + copyFileInto(fileTarget, globAudioFilename)
+
+    count("opens", 2)
+    count("bytesWritten", written)
+    count("frames", len(pack))
+    print('writeAudioFileFromPack() OK: New file saved. frameSize=' + str(frameSize) + ', paddingSize=' + str(paddingSize))
+    return written
+
+@timedStage()
+def writeAudioFileFromManifest(myManifestFileName, myAudioFileName, myStoreDir=None) :
+    ''' Writes a new MP3 file from a manifest of the frame store: the tag header
+        (version of the original tag), the frames objects, than the audio data
+        of the original MP3 file. myStoreDir is found from the manifest path,
+        if it is not given. Nothing is written, if a store object is missing
+        or its size is not the size in the manifest.
+        Returns the number of bytes written, 0 if nothing has been written.
+    '''
+    print("writeAudioFileFromManifest() START " + myManifestFileName)
+    try :
+        manifest = readManifest(myManifestFileName)
+        if myStoreDir is None :
+            myStoreDir = findStoreDir(myManifestFileName)
+        st = os.stat(manifest["source"])
+    except (OSError, ValueError) as e :
+        print("writeAudioFileFromManifest() PROBLEM: " + str(e))
+        return 0
+
+    # The audio data is taken from the original file - it must not have changed
+    if st.st_size != manifest["sourceSize"] or st.st_mtime_ns != manifest["sourceMtimeNs"] :
+        print("writeAudioFileFromManifest() PROBLEM: The original file has changed: " + manifest["source"])
+        return 0
+
+    # All objects must be there, with the size written into the tag header
+    frameSize = 0
+    for frame in manifest["frames"] :
+        objectPath = getObjectPath(myStoreDir, frame["sha256"])
         try :
-            with open(myAllFramesFileName, "rb") as f:  # read in binary mode
-                bytesObject = f.read()
-                fileTarget.write(bytesObject)
-        except FileNotFoundError :
-            print('writeAudioFileWithHeaderAndFrames() FATAL ERROR on appending tag.')
-            exit(1) # Exit with error code 1
+            objectSize = os.path.getsize(objectPath)
+        except OSError :
+            print("writeAudioFileFromManifest() PROBLEM: The store object of frame " + frame["frameName"]
+                  + " is missing: " + objectPath)
+            return 0
+        if objectSize != frame["size"] :
+            print("writeAudioFileFromManifest() PROBLEM: The store object of frame " + frame["frameName"] + " has "
+                  + str(objectSize) + " bytes, the manifest tells " + str(frame["size"]) + ": " + objectPath)
+            return 0
+        frameSize = frameSize + frame["size"]
+    tagVersion = int(manifest["header"][6:8], 16)  # byte 3 of the original tag header
+    paddingSize = getPaddingSize(frameSize)
 
-    # Append the AudioFile bytes
-    with open(myAudioFileName, "ab") as fileTarget:
+    try :
+        with open(myAudioFileName, "wb", buffering=0) as fileTarget:
+            written = fileTarget.write(makeTagHeaderBytes(frameSize + paddingSize, tagVersion))
+            for frame in manifest["frames"] :
+                written = written + copyFileInto(fileTarget, getObjectPath(myStoreDir, frame["sha256"]))
+            writePadding(fileTarget, paddingSize)
+            written = written + paddingSize
+            with open(manifest["source"], "rb") as f :
+                audioSize = manifest["audioEnd"] - manifest["audioStart"]
+                written = written + copyBytes(f, fileTarget, manifest["audioStart"], audioSize)
+    except OSError as e :
+        # Don't leave a half-written file
         try :
-            with open(globAudioFilename, "rb") as f:  # read in binary mode
-                bytesObject = f.read()
-                fileTarget.write(bytesObject)
-        except FileNotFoundError :
-            print('writeAudioFileWithHeaderAndFrames() FATAL ERROR on appending audio.')
-            exit(1) # Exit with error code 1    
-
-    print('writeAudioFileWithHeaderAndFrames() OK: New file saved.')
-    
-    # delete the temporary file
-    try:
-        #if os.path.exists(globTempFramesFilename):
-        os.remove(globTempFramesFilename)
-        print('writeAudioFileWithHeaderAndFrames() OK: Temporary file deleted.')
-    except OSError:
-        print("ERROR while deleting temporary file")
+            os.remove(myAudioFileName)
+        except OSError :
+            pass
+        print("writeAudioFileFromManifest() PROBLEM: " + str(e))
+        return 0
+
+    count("opens", 3)   # manifest, original MP3 file, new file
+    count("bytesWritten", written)
+    count("frames", len(manifest["frames"]))
+    print('writeAudioFileFromManifest() OK: New file saved. frameSize=' + str(frameSize) + ', paddingSize=' + str(paddingSize))
+    return written
 
 # --- MAIN SCRIPT ---
-# Write all frames data files into a single temp. file
-tmpFileSize = writeTheAllFramesTmpFile()
-
-if tmpFileSize > 0 :
-    writeAudioFileWithHeaderAndFrames(globNewAudioFilename, tmpFileSize, globTempFramesFilename)
-    
-# Finish
-print("OK, ready: " + globNewAudioFilename)
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description="Builds a MP3 file from the frames files XXX_N*.bin and XXX_audio.mp3.")
+    parser.add_argument("--in-place", metavar="MP3FILE", dest="inPlace",
+                        help="overwrite the tag of MP3FILE, if the frames fit into it")
+    parser.add_argument("--manifest", metavar="MANIFEST", help="build the new file from a frame store manifest")
+    parser.add_argument("--store", metavar="STORE", help="frame store directory (default: found from MANIFEST)")
+    parser.add_argument("--pack", nargs="?", const=globPackFilename, default=None, metavar="PACKFILE",
+                        help="read the frames from a pack file (default: " + globPackFilename + ")")
+    parser.add_argument("--unsync", action="store_true", help="write an unsynchronised tag")
+    parser.add_argument("--padding", default=globPaddingPolicy, metavar="POLICY",
+                        help="padding of the new tag, e.g. none, fixed:4096, percent:10, block:4096, "
+                        "library:id3v2index.sqlite:90 (default: " + globPaddingPolicy + ")")
+    parser.add_argument("--metrics", default=None, metavar="FILE.json", help="write the metrics of the stages as JSON")
+    parser.add_argument("--metrics-prom", default=None, dest="metricsProm", metavar="FILE.prom",
+                        help="write the metrics of the stages as Prometheus textfile")
+    args = parser.parse_args()
+    globUnsync = args.unsync
+    if args.metrics or args.metricsProm :
+        id3v2Metrics.enableMetrics("id3v2TagReassembler")
+        atexit.register(id3v2Metrics.writeMetrics, args.metrics, args.metricsProm)   # at every exit()
+    globPaddingPolicy = args.padding
+    try :
+        getPaddingSize(0)   # check the policy before writing
+    except (ValueError, OSError) as e :
+        print("ERROR: " + str(e))
+        exit(1) # Exit with error code 1
+
+    if args.manifest :
+        if writeAudioFileFromManifest(args.manifest, globNewAudioFilename, args.store) == 0 :
+            exit(1) # Exit with error code 1
+        print("OK, ready: " + globNewAudioFilename)
+        exit(0) # Successful exit
+
+    if args.inPlace and args.pack :
+        if rewriteTagInPlace(args.inPlace, [], args.pack) == 0 :
+            exit(1) # Exit with error code 1
+        print("OK, ready: " + args.inPlace)
+        exit(0) # Successful exit
+
+    if args.pack :
+        if writeAudioFileFromPack(args.pack, globNewAudioFilename) == 0 :
+            exit(1) # Exit with error code 1
+        print("OK, ready: " + globNewAudioFilename)
+        exit(0) # Successful exit
+
+    if args.inPlace :
+        fileList = getFrameFileList()
+        if len(fileList) == 0 :
+            print("PROBLEM: Framefiles are missing.")
+            exit(1) # Exit with error code 1
+        if rewriteTagInPlace(args.inPlace, fileList) == 0 :
+            exit(1) # Exit with error code 1
+        print("OK, ready: " + args.inPlace)
+        exit(0) # Successful exit
+
+    # Write the header, all frames data files and the audio into the new file.
+    # The tag gets the version of the frames, told by XXX_header.bin.
+    fileList = getFrameFileList()
+    try :
+        framesVersion = readHeaderFileVersion(fileList)
+    except (OSError, TagError) as e :
+        print("PROBLEM: " + globBinFilePrefix + "header.bin: " + str(e))
+        exit(1) # Exit with error code 1
+    if writeAudioFileWithHeaderAndFrames(globNewAudioFilename, fileList, framesVersion) == 0 :
+        exit(1) # Exit with error code 1
+
+    # Finish
+    print("OK, ready: " + globNewAudioFilename)
 
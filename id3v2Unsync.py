@@ -0,0 +1,127 @@
+'''
+ID3v2 Unsynchronisation
+-----------------------
+Decodes and encodes the unsynchronisation of ID3v2 tags and frames.
+
+Unsynchronisation inserts a 00H byte behind every FFH byte, that is followed
+by a byte 00H or 111xxxxxb. So no MPEG sync pattern appears in the tag.
+* ID3v2.3: the whole tag behind the header is unsynchronised (flag a of
+  the tag header), the frame sizes are the sizes after decoding.
+* ID3v2.4: every frame is unsynchronised on its own (frame flag n), the
+  frame sizes are the sizes before decoding. Flag a of the tag header tells,
+  that all frames are unsynchronised.
+
+The work is done by bytes.replace() and re.sub() on the whole data,
+not by a Python loop over the bytes.
+
+Benchmark: python id3v2Unsync.py [MEGABYTES]
+Measures the throughput of decoding and encoding a large APIC-like payload.
+
+J. Grätzer
+'''
+
+import sys
+import os
+import time
+
+from id3v2TagParser import (decodeSynchsafe, encodeSynchsafe, decodeUnsync, encodeUnsync,
+                             globFrameFlagUnsync, globFrameFlagDataLength)
+from id3v2FrameCompression import getExtraDataSize, isCompressed, decompressData
+
+
+# --- FUNCTIONS ---
+# decodeUnsync() and encodeUnsync() are part of id3v2TagParser.py, the parser
+# needs them for ID3v2.3 tags. They are imported here, so they can be used
+# from this module, too.
+
+def decodeTagUnsync(myFullTag) :
+    ''' ID3v2.3: Removes the unsynchronisation of a whole tag.
+        myFullTag starts with the 10 header bytes. Returns bytes: the header
+        unchanged, followed by the decoded tag (without footer).
+    '''
+    size = decodeSynchsafe(myFullTag[6:10])
+    return bytes(myFullTag[0:10]) + decodeUnsync(myFullTag[10:10 + size])
+
+def getFramePayload(myFrame, myId3Vers) :
+    ''' Returns the data of a frame (without the 10 header bytes and without
+        group byte, encryption byte and data length indicator), with the ID3v2.4
+        frame unsynchronisation removed and decompressed (see id3v2FrameCompression.py).
+        myFrame is the complete frame (bytes or memoryview).
+    '''
+    flags2 = myFrame[9]
+    data = myFrame[10 + getExtraDataSize(flags2, myId3Vers):]
+    if myId3Vers == 4 and flags2 & globFrameFlagUnsync :
+        data = decodeUnsync(data)
+    if isCompressed(myFrame, myId3Vers) :
+        data = decompressData(data, bytes(myFrame[0:4]).decode("latin-1"))
+    return data
+
+def encodeFrameUnsync(myFrame) :
+    ''' ID3v2.4: Returns the frame myFrame (header and data) unsynchronised:
+        the data is encoded, frame flag n is set, and the size is updated.
+        A data length indicator stays in front of the encoded data.
+    '''
+    flags2 = myFrame[9]
+    if flags2 & globFrameFlagUnsync :
+        return bytes(myFrame)  # already unsynchronised
+    dataStart = 14 if flags2 & globFrameFlagDataLength else 10
+    data = encodeUnsync(myFrame[dataStart:])
+    size = dataStart - 10 + len(data)
+    return (bytes(myFrame[0:4]) + encodeSynchsafe(size) + bytes([myFrame[8], flags2 | globFrameFlagUnsync])
+            + bytes(myFrame[10:dataStart]) + data)
+
+def decodeFrameUnsync(myFrame) :
+    ''' ID3v2.4: Returns the frame myFrame (header and data) with the
+        unsynchronisation removed: frame flag n is cleared, the size is updated.
+    '''
+    flags2 = myFrame[9]
+    if not flags2 & globFrameFlagUnsync :
+        return bytes(myFrame)
+    dataStart = 14 if flags2 & globFrameFlagDataLength else 10
+    data = decodeUnsync(myFrame[dataStart:])
+    size = dataStart - 10 + len(data)
+    return (bytes(myFrame[0:4]) + encodeSynchsafe(size) + bytes([myFrame[8], flags2 & ~globFrameFlagUnsync])
+            + bytes(myFrame[10:dataStart]) + data)
+
+def decodeUnsyncByLoop(myData) :
+    ''' Per-byte reference implementation of decodeUnsync(), for the benchmark only
+    '''
+    result = bytearray()
+    lastByte = 0
+    for b in myData :
+        if not (lastByte == 0xFF and b == 0x00) :
+            result.append(b)
+        lastByte = b
+    return bytes(result)
+
+def benchmark(myMegabytes) :
+    ''' Prints the throughput of decodeUnsync() and encodeUnsync()
+        on random data (like a compressed picture) and on data full of FFH bytes.
+    '''
+    size = myMegabytes * 1024 * 1024
+    payloads = [("random", os.urandom(size)),
+                ("FFH-heavy", (b"\xff\xe0\xff\x00" * (size // 4)))]
+    for name, payload in payloads :
+        startTime = time.perf_counter()
+        encoded = encodeUnsync(payload)
+        encodeTime = time.perf_counter() - startTime
+        startTime = time.perf_counter()
+        decoded = decodeUnsync(encoded)
+        decodeTime = time.perf_counter() - startTime
+        if decoded != payload :
+            print("ERROR: decoding doesn't restore the data")
+            return
+        print("{0:10s} {1} MB: encode {2:8.1f} MB/s, decode {3:8.1f} MB/s, +{4} bytes".format(
+            name, myMegabytes, myMegabytes / max(encodeTime, 1e-9), myMegabytes / max(decodeTime, 1e-9),
+            len(encoded) - len(payload)))
+
+    # The per-byte loop, on 1 MB only - it is slow
+    sample = encodeUnsync(payloads[0][1][0:1024 * 1024])
+    startTime = time.perf_counter()
+    decodeUnsyncByLoop(sample)
+    print("per-byte loop decode: {0:.1f} MB/s".format(1 / max(time.perf_counter() - startTime, 1e-9)))
+
+
+# --- MAIN SCRIPT ---
+if __name__ == "__main__" :
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 16)